@@ -1,8 +1,19 @@
 #!/usr/bin/env python
 
 from optparse import OptionParser
-import subprocess, os
-import dna
+import os, sys, math, multiprocessing, tempfile, atexit
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+import scipy.sparse.linalg
+import scipy.spatial
+
+# run through the symlink bin/compostbin.py, this script's
+# path entry is still CBCBCompostBin, so add Scimm's bin to
+# find dna and pca
+bin_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'bin')
+sys.path.append(bin_dir)
+import dna, pca
 
 ############################################################
 # compostbin.py
@@ -18,22 +29,21 @@ import dna
 # Author: David Kelley
 ############################################################
 
-cb_bin = "/fs/szasmg/dakelley/classes/metagenomics/software/Scimm/CBCBCompostBin"
+# reads to count kmers in at once
+count_chunk = 10000
 
-# add matlab bin to matlabpath...FAILS IF JOB IS RUN IN BACKGROUND?
-if not os.environ.has_key('MATLABPATH'):
-    os.environ['MATLABPATH'] = cb_bin
-elif os.environ['MATLABPATH'].find(cb_bin) == -1:
-    os.environ['MATLABPATH'] = cb_bin + ':' + os.environ['MATLABPATH']
+# principal components to build the neighbor graph on
+princ_comps = 3
 
-############################################################
-# Read
-############################################################
-class Read:
-    def __init__(self, header, seq, k):
-        self.header = header
-        self.kmers = dna.canonical_kmers(dna.count_kmers(k,seq.upper(),True))
+# cut points to try along the eigenvector
+splits = 10
 
+# seed of the eigensolver's starting vector, so cuts don't
+# depend on which process computes them
+eig_seed = 1
+
+# kmer frequencies of all reads, shared with forked workers
+kmers = None
 
 ############################################################
 # main
@@ -43,123 +53,293 @@ def main():
     parser.add_option('-r', dest='readsf', help='Fasta file of reads')
     parser.add_option('-c', dest='num_clust', type='int', help='Number of clusters')
     parser.add_option('-k', dest='k', type='int', help='k-mers to count')
-    parser.add_option('--constrained', dest='constraintsf', help='File of constrained reads') # constrained reads needs more testing
+    parser.add_option('-p', dest='proc', type='int', default=1, help='Number of threads to use [Default=%default]')
+    parser.add_option('--constrained', dest='constraintsf', help='File of constrained reads') # constrained reads needs more testing, and partition ignores them
     (options, args) = parser.parse_args()
-    
-    # count sequences
-    S = 0
-    for line in open(options.readsf):
-        S += (line[0] == '>')
 
-    # get constraints
-    if options.constraintsf:
-        constraints = [line.rstrip() for line in open(options.constraintsf).readlines()]
-
-    # count kmers
-    count_kmers(options.readsf, options.k, 'kmers.dat')
+    # count kmers into a file-backed matrix
+    global kmers
+    (kmers_fd, kmers_file) = tempfile.mkstemp(prefix='kmers.', suffix='.tmp', dir='.')
+    os.close(kmers_fd)
+    atexit.register(os.remove, kmers_file)
+    kmers = count_kmers(options.readsf, options.k, kmers_file)
     
-    # initialize to single cluster, REMEMBER THIS IS 1-BASED
-    clusters = [range(1,S+1)]
+    # initialize to single cluster
+    clusters = [np.arange(len(kmers))]
+
+    # best cut of each cluster, kept until it changes
+    cuts = [None]
 
     # while we have too few clusters
     while(len(clusters) < options.num_clust):
+        # cut new clusters
+        new_c = [c for c in range(len(clusters)) if cuts[c] is None]
+        new_cuts = partition_clusters([clusters[c] for c in new_c], options.proc)
+        for i in range(len(new_c)):
+            cuts[new_c[i]] = new_cuts[i]
+
         # find min cut
         mincut = -1
         for c in range(len(clusters)):
-            # tell matlab script which kmers to consider
-            iout = open('indexes.dat','w')
-            print >> iout, '\n'.join([str(i) for i in clusters[c]])
-            iout.close()
-
-            # tell matlab script constraints
-            if options.constraintsf:
-                cout = open('constraints.dat','w')
-                print >> cout, '\n'.join([str(constraints[i-1]) for i in clusters[c]])
-                cout.close();
-            elif os.path.isfile('constraints.dat'):
-                print 'Renaming constraints.dat as constraints.tmp to avoid confusion'
-                os.rename('constraints.dat', 'constraints.tmp')                
-
-            # matlab partition
-            matlab_attempts = 0
-            while matlab_attempts != -1 and matlab_attempts < 3:
-                p = subprocess.Popen('matlab -nodisplay -nosplash -nodesktop -wait -r partition', shell=True)
-                sts = os.waitpid(p.pid, 0)[1]
-
-                if os.path.isfile('partition.txt'):
-                    matlab_attempts = -1
-                else:
-                    print >> sys.stderr, 'Matlab failed, trying again.'
-                    matlab_attempts += 1
-            if matlab_attempts != -1:
-                exit(1)
+            (part, ncut) = cuts[c]
 
             # compare ncut value
-            ncut = float(open('ncut.txt').readline().rstrip())
-            if mincut == -1 or ncut < mincut:
+            if part is not None and (mincut == -1 or ncut < mincut):
                 minc = c
                 mincut = ncut
-                os.rename('partition.txt','min_part.txt')
+                min_part = part
+
+        if mincut == -1:
+            print >> sys.stderr, 'ERROR: No cluster could be partitioned'
+            exit(1)
                 
         # create new clusters with the min cut
         # in the original slot and a new one
-        tmplist = []
-        clusters.append([])
-        i = 0
-        for line in open('min_part.txt'):
-            if int(line.rstrip()):
-                tmplist.append(clusters[minc][i])
-            else:
-                clusters[-1].append(clusters[minc][i])
-            i += 1
-        clusters[minc] = tmplist
+        clusters.append(clusters[minc][~min_part])
+        clusters[minc] = clusters[minc][min_part]
+        cuts.append(None)
+        cuts[minc] = None
 
     # output clusters
     out_clust(options.readsf, clusters)
 
-    os.remove('min_part.txt')
-
 
 ############################################################
 # count_kmers
 #
-# Count kmers in the reads file, and output vectors
-# for clustering
+# Count kmers in the reads file, and return a reads x
+# canonical kmers matrix of their frequencies for
+# clustering, mapped from kmers_file so that it needn't
+# fit in memory.
 ############################################################
-def count_kmers(readsf, k, output_file):
-    # load reads and count kmers
-    datf = open(output_file, 'w')
+def count_kmers(readsf, k, kmers_file):
+    num_reads = 0
+    for line in open(readsf):
+        num_reads += (line[0] == '>')
+    num_cols = dna.canonical_kmer_columns(k).max() + 1
+    freqs = np.memmap(kmers_file, dtype='float64', mode='w+', shape=(max(num_reads,1), num_cols))[:num_reads]
 
-    header = ''
+    r = 0
+    seqs = []
+    seq_lines = None
     for line in open(readsf):
         if line[0] == '>':
             # add last (if not first)
-            if header:
-                # count kmers
-                r = Read(header, seq, k)
-                print_kmers(r.kmers, datf)
-                
-            header = line[1:].rstrip()
-            seq = ''
+            if seq_lines is not None:
+                seqs.append(''.join(seq_lines))
+                if len(seqs) == count_chunk:
+                    freqs[r:r+len(seqs)] = kmer_freqs(dna.kmer_counts(seqs, k))
+                    r += len(seqs)
+                    seqs = []
+            seq_lines = []
         else:
-            seq += line.rstrip()
+            seq_lines.append(line.rstrip())
 
     # finish last
-    r = Read(header, seq, k)
-    print_kmers(r.kmers, datf)
+    if seq_lines is not None:
+        seqs.append(''.join(seq_lines))
+    freqs[r:r+len(seqs)] = kmer_freqs(dna.kmer_counts(seqs, k))
         
-    datf.close()
+    return freqs
+
+
+############################################################
+# kmer_freqs
+#
+# Normalize each read's row of a kmer count matrix
+############################################################
+def kmer_freqs(kmer_counts):
+    kmers_sum = kmer_counts.sum(axis=1).astype(float)
+    kmers_sum[kmers_sum == 0] = 1
+    return kmer_counts / kmers_sum[:,np.newaxis]
 
 
 ############################################################
-# print_kmers
+# partition_clusters
 #
-# Print the kmer count vector to file f
+# Partition each cluster of read indexes, in parallel worker
+# processes when there are several and proc allows, dividing
+# the threads between them.
 ############################################################
-def print_kmers(kmer_counts, f):
-    kmers = sorted(kmer_counts.keys())
-    kmers_sum = sum(kmer_counts.values())
-    print >> f, '\t'.join([str(kmer_counts[kmer] / kmers_sum) for kmer in kmers])
+def partition_clusters(clusters, proc):
+    workers = min(proc, len(clusters))
+    if workers <= 1:
+        return [partition(kmers, clust, proc) for clust in clusters]
+
+    pool = multiprocessing.Pool(workers)
+    cuts = pool.map(partition_worker, [(clust, proc/workers) for clust in clusters])
+    pool.close()
+    pool.join()
+    return cuts
+
+
+############################################################
+# partition_worker
+#
+# Partition a cluster in a worker process, which sees the
+# kmers counted before it was forked.
+############################################################
+def partition_worker(args):
+    (clust, proc) = args
+    return partition(kmers, clust, proc)
+
+
+############################################################
+# partition
+#
+# Partition the kmer frequency vectors of the given rows
+# of kmers into 2 sets based on the minimum normalized cut method used by
+# CompostBin: project the vectors on their principal
+# components, connect each to its nearest neighbors, and
+# split the graph along the Laplacian's second generalized
+# eigenvector.  Return a boolean array over the rows
+# marking one side and the normalized cut value, or
+# (None, inf) if the set can't be split.
+############################################################
+def partition(kmers, rows, proc=1):
+    num_neighbors = matlab_round(2 + .5*math.log(len(rows)))
+    max_nn = max(num_neighbors+3, matlab_round(1.25*num_neighbors))
+    if len(rows) <= max_nn:
+        return (None, float('inf'))
+
+    # compute PCA
+    kmers_pc = pca.pca(kmers, princ_comps, rows)
+
+    Wconn = False
+    while not Wconn and num_neighbors < max_nn:
+        # form nn graph and compute weights
+        W = knn_graph(kmers_pc, num_neighbors, proc)
+        # force symmetry
+        W = W.maximum(W.T)
+
+        if scipy.sparse.csgraph.connected_components(W, directed=False)[0] == 1:
+            Wconn = True
+        else:
+            num_neighbors += 1
+            print >> sys.stderr, 'Graph is disconnected, increasing number of neighbors'
+
+    # compute second smallest eigenvector of (D-W)v = eDv
+    V = fiedler_vector(W)
+    if V is None:
+        print >> sys.stderr, 'Eigenvector calculation did not converge'
+        return (None, float('inf'))
+
+    # compute optimal partition
+    return split_optimal(W, V)
+
+
+############################################################
+# matlab_round
+#
+# Round halves away from zero as MATLAB does
+############################################################
+def matlab_round(x):
+    return int(math.floor(x + .5))
+
+
+############################################################
+# knn_graph
+#
+# Return the sparse matrix W with W[j,i] = exp(-d(i,j)/maxE)
+# for each of the num_neighbors nearest neighbors j of each
+# point i, where maxE is the largest such distance.
+#
+# Neighbors are found with a KD-tree on the projected
+# points, queried by proc threads.
+############################################################
+def knn_graph(X, num_neighbors, proc=1):
+    m = len(X)
+    tree = scipy.spatial.cKDTree(X)
+    (dists, neighbors) = tree.query(X, k=num_neighbors+1, n_jobs=proc)
+
+    # drop each point from its own neighbors, or its farthest
+    # neighbor if duplicates crowded it out
+    not_self = (neighbors != np.arange(m)[:,np.newaxis])
+    not_self[not_self.all(axis=1), -1] = False
+    neighbors = neighbors[not_self].reshape(m, num_neighbors)
+    dists = dists[not_self].reshape(m, num_neighbors)
+
+    maxE = dists.max()
+    if maxE == 0:
+        maxE = 1.0
+    weights = np.exp(-dists/maxE)
+    cols = np.repeat(np.arange(m), num_neighbors)
+    return scipy.sparse.csr_matrix((weights.ravel(), (neighbors.ravel(), cols)), shape=(m,m))
+
+
+############################################################
+# fiedler_vector
+#
+# Return the generalized eigenvector v of (D-W)v = eDv with
+# the second smallest eigenvalue, where D is the diagonal
+# degree matrix of W, or None if it doesn't converge.  It
+# is found as D^-1/2 u for the eigenvector u of
+# D^-1/2 W D^-1/2 with the second largest eigenvalue.
+############################################################
+def fiedler_vector(W):
+    d_isqrt = 1.0 / np.sqrt(np.asarray(W.sum(axis=1)).ravel())
+    D_isqrt = scipy.sparse.diags(d_isqrt)
+    N = D_isqrt * W * D_isqrt
+
+    v0 = np.random.RandomState(eig_seed).rand(len(d_isqrt))
+    try:
+        (E, U) = scipy.sparse.linalg.eigsh(N, k=2, which='LA', tol=1e-10, maxiter=1000, v0=v0)
+    except scipy.sparse.linalg.ArpackNoConvergence:
+        return None
+
+    return d_isqrt * U[:,np.argmin(E)]
+
+
+############################################################
+# split_optimal
+#
+# Try cuts at evenly spaced points along the eigenvector V
+# and return the one with the smallest normalized cut value
+# as a boolean array marking the reads above the cut, and
+# that value.
+############################################################
+def split_optimal(W, V):
+    n = len(V)
+    cut_int = (V.max() - V.min()) / splits
+
+    minNcut = float('inf')
+    minSegs = np.zeros(n, dtype=bool)
+    cut = V.min()
+
+    for i in range(splits-1):
+        cut += cut_int
+
+        # partition with cut
+        segs = (cut < V)
+
+        # compare to past good cuts
+        ncut = norm_cut(W, segs)
+        if ncut < minNcut:
+            minNcut = ncut
+            minSegs = segs
+
+    return (minSegs, minNcut)
+
+
+############################################################
+# norm_cut
+#
+# Compute the normalized cut value of splitting the graph W
+# into the vertexes in seg and the rest.
+############################################################
+def norm_cut(W, seg):
+    a = seg.astype(float)
+    b = 1 - a
+    cut = np.dot(a, W.dot(b))
+
+    if seg.sum() > 1 and (~seg).sum() > 1:
+        asso_a = np.dot(a, W.dot(np.ones(len(a))))
+        asso_b = np.dot(b, W.dot(np.ones(len(b))))
+        return (cut/asso_a) + (cut/asso_b)
+    elif cut == 0:
+        return 0.0
+    else:
+        return float('inf')
 
 
 ############################################################
@@ -179,7 +359,7 @@ def out_clust(readsf, clusters):
     out = open('partition.txt','w')
     for c in range(len(clusters)):
         for i in clusters[c]:
-            print >> out, '%d\t%s' % (c,seqs[i-1])
+            print >> out, '%d\t%s' % (c,seqs[i])
     out.close()
             
 
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+import os, sys
+import numpy as np
+
+############################################################
+# catalog.py
+#
+# Index a fasta file of reads once, saving each read's
+# header, sequence length and byte offset beside the file,
+# so that later stages can refer to reads by a dense integer
+# index (their order in the file) and fetch them directly
+# instead of rescanning the fasta file.
+############################################################
+
+############################################################
+# load
+#
+# Return the Catalog of the reads file, building and saving
+# it first if it is missing or out of date.
+############################################################
+def load(readsf):
+    readsf = os.path.abspath(readsf)
+    st = os.stat(readsf)
+    source = np.array([st.st_size, int(st.st_mtime)], dtype='int64')
+
+    for prefix in catalog_prefixes(readsf):
+        if os.path.isfile(prefix+'.npz') and os.path.isfile(prefix+'.headers'):
+            cat_data = np.load(prefix+'.npz')
+            if (cat_data['source'] == source).all():
+                return Catalog(readsf, cat_data['offsets'], cat_data['lengths'], prefix+'.headers')
+
+    return build(readsf, source)
+
+
+############################################################
+# catalog_prefixes
+#
+# The catalog is saved beside the reads file, or in the
+# current directory if that one is not writable.
+############################################################
+def catalog_prefixes(readsf):
+    prefixes = []
+    if os.access(os.path.dirname(readsf), os.W_OK):
+        prefixes.append(readsf + '.cat')
+    prefixes.append(os.path.abspath(os.path.basename(readsf) + '.cat'))
+    return prefixes
+
+
+############################################################
+# build
+#
+# Scan the reads file once, recording each read's offset,
+# length and header, and save them atomically.
+############################################################
+def build(readsf, source):
+    prefix = catalog_prefixes(readsf)[0]
+    tmp_prefix = '%s.%d.tmp' % (prefix, os.getpid())
+
+    offsets = []
+    lengths = []
+    headers_out = open(tmp_prefix+'.headers', 'w')
+
+    pos = 0
+    for line in open(readsf):
+        if line[0] == '>':
+            offsets.append(pos)
+            lengths.append(0)
+            print >> headers_out, line[1:].rstrip()
+        elif lengths:
+            lengths[-1] += len(line.rstrip())
+        pos += len(line)
+    offsets.append(pos)
+
+    headers_out.close()
+
+    offsets = np.array(offsets, dtype='int64')
+    lengths = np.array(lengths, dtype='int64')
+    np.savez(tmp_prefix+'.npz', offsets=offsets, lengths=lengths, source=source)
+
+    # headers first, so a matching .npz always has its headers
+    os.rename(tmp_prefix+'.headers', prefix+'.headers')
+    os.rename(tmp_prefix+'.npz', prefix+'.npz')
+
+    return Catalog(readsf, offsets, lengths, prefix+'.headers')
+
+
+############################################################
+# Catalog
+#
+# Reads are numbered 0..num_reads-1 in file order.  offsets
+# has num_reads+1 entries so that read i occupies bytes
+# offsets[i] to offsets[i+1] of the file.
+############################################################
+class Catalog:
+    def __init__(self, readsf, offsets, lengths, headers_file):
+        self.readsf = readsf
+        self.offsets = offsets
+        self.lengths = lengths
+        self.num_reads = len(lengths)
+        self.headers_file = headers_file
+        self.header_list = None
+        self.header_index = None
+
+    ############################################################
+    # headers
+    #
+    # Return the list of read headers (without '>'), loading
+    # them on first use.
+    ############################################################
+    def headers(self):
+        if self.header_list is None:
+            self.header_list = [line.rstrip('\n') for line in open(self.headers_file)]
+        return self.header_list
+
+    ############################################################
+    # index
+    #
+    # Return a dict mapping stripped read headers to read
+    # indexes.
+    ############################################################
+    def index(self):
+        if self.header_index is None:
+            self.header_index = {}
+            headers = self.headers()
+            for i in range(self.num_reads):
+                self.header_index[headers[i].strip()] = i
+        return self.header_index
+
+    ############################################################
+    # write_reads
+    #
+    # Copy the fasta records of the given reads to the file
+    # object out.  If weights are given, prefix each header
+    # with its read's weight as in '>weight;header'.
+    # Otherwise, runs of consecutive reads are copied at once.
+    ############################################################
+    def write_reads(self, out, reads, weights=None):
+        readsf = open(self.readsf)
+        if weights is None:
+            reads = np.asarray(reads, dtype='int64')
+            run_starts = np.nonzero(np.diff(reads) != 1)[0] + 1
+            for run in np.split(reads, run_starts):
+                if len(run) > 0:
+                    readsf.seek(self.offsets[run[0]])
+                    out.write(readsf.read(self.offsets[run[-1]+1] - self.offsets[run[0]]))
+            readsf.close()
+            return
+
+        for j in range(len(reads)):
+            i = reads[j]
+            readsf.seek(self.offsets[i])
+            record = readsf.read(self.offsets[i+1] - self.offsets[i])
+            if weights is not None:
+                record = '>%f;%s' % (weights[j], record[1:])
+            out.write(record)
+        readsf.close()
+
+    ############################################################
+    # write_samples
+    #
+    # Copy the fasta records of each list of reads in samples
+    # to the matching file object in outs, in file order,
+    # reading each record once however many samples hold it.
+    ############################################################
+    def write_samples(self, outs, samples):
+        sample_outs = {}
+        for s in range(len(samples)):
+            for i in samples[s]:
+                sample_outs.setdefault(int(i), []).append(outs[s])
+
+        readsf = open(self.readsf)
+        for i in sorted(sample_outs):
+            readsf.seek(self.offsets[i])
+            record = readsf.read(self.offsets[i+1] - self.offsets[i])
+            for out in sample_outs[i]:
+                out.write(record)
+        readsf.close()
+
+
+############################################################
+# __main__
+############################################################
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print 'Usage: catalog.py <reads_file>'
+    else:
+        cat = load(sys.argv[1])
+        print '%d reads, %d bp' % (cat.num_reads, cat.lengths.sum())
@@ -1,8 +1,8 @@
 #!/usr/bin/env python
 
 from optparse import OptionParser
-import os, glob, subprocess, sys
-import dna
+import os, glob, sys
+import dna, catalog, util
 
 ############################################################
 # cb_init.py
@@ -25,37 +25,47 @@ def main():
     parser.add_option('-k', dest='clusters', type='int', help='Number of clusters')
     parser.add_option('-m', dest='mers', type='int', help='Mers to count')
     parser.add_option('-p', dest='proc', type='int', help='Number of processes to run')
+    parser.add_option('--seed_sample', dest='seed_sample', type='float', help='Score only this fixed random fraction of the reads with the initial IMMs')
+    parser.add_option('--sampled', dest='sampled', action='store_true', default=False, help='The reads are already sampled to sample.fa')
+    parser.add_option('--partition_only', dest='partition_only', action='store_true', default=False, help='Stop after writing the initial partition, leaving the IMMs to the caller')
     parser.add_option('--em', dest='soft_assign', action='store_true', default=False, help='Use a soft assignment of reads to clusters')
 
     (options, args) = parser.parse_args()
 
+    util.start_jobserver(options.proc)
+
     if options.soft_assign:
-        em = '--em'
+        em = ['--em']
+    else:
+        em = []
+
+    if options.seed_sample:
+        sample_args = ['--seed_sample', str(options.seed_sample)]
     else:
-        em = ''
+        sample_args = []
 
     # randomly sample reads
-    total_reads = 0
-    for line in open(options.readsf):
-        if line[0] == '>':
-            total_reads += 1
-    if options.numreads and options.numreads < total_reads:
-        dna.fasta_rand_big(options.numreads, options.readsf, 'sample.fa')
+    cat = catalog.load(options.readsf)
+    if options.sampled:
+        pass
+    elif options.numreads and options.numreads < cat.num_reads:
+        dna.fasta_rand_big(options.numreads, options.readsf, 'sample.fa', cat)
     else:
         if os.path.isfile('sample.fa') or os.path.islink('sample.fa'):
             os.remvoe('sample.fa')
         os.symlink(options.readsf, 'sample.fa')
 
     # CompostBin
-    p = subprocess.Popen('%s/compostbin.py -r sample.fa -c %d -k %d &> cb.log' % (bin_dir, options.clusters, options.mers), shell=True)
-    os.waitpid(p.pid, 0)
+    compostbin = util.Job(['%s/compostbin.py' % bin_dir, '-r', 'sample.fa', '-c', str(options.clusters), '-k', str(options.mers), '-p', str(options.proc)], stdout='cb.log', stderr='cb.log', slots=options.proc)
+    util.run_jobs([compostbin], options.proc)
 
     # initialize clusters
-    init_clusters(options.readsf, options.clusters, options.soft_assign)
+    init_clusters(cat, options.clusters, options.soft_assign)
 
     # run seed_only
-    p = subprocess.Popen('%s/imm_cluster.py -k %d -r %s -p %d -s --seed_only %s >> cb.log' % (bin_dir, options.clusters, options.readsf, options.proc, em), shell=True)
-    os.waitpid(p.pid, 0)
+    if not options.partition_only:
+        immc = util.Job(['%s/imm_cluster.py' % bin_dir, '-k', str(options.clusters), '-r', options.readsf, '-p', str(options.proc), '-s', '--seed_only'] + em + sample_args, stdout='cb.log', append=True)
+        util.run_jobs([immc], 1)
     
 
 ############################################################
@@ -64,42 +74,29 @@ def main():
 # Convert CompostBin output to an initial partitioning of
 # reads for imm_cluster
 ############################################################
-def init_clusters(readsf, clusters, soft_assign):
+def init_clusters(cat, clusters, soft_assign):
     read_clusters = {}
     for line in open('partition.txt'):
         (c,r) = line.split('\t')
         read_clusters[r.rstrip()] = int(c)
 
-    # open files
-    init_files = []
-    build_files = []
-    for c in range(clusters):
-        init_files.append(open('cluster-%d.fa' % c, 'w'))
-        if soft_assign:
-            build_files.append(open('cluster-%d.build.fa' % c, 'w'))
-        
-    # read fasta to cluster-*.fa
-    for line in open(readsf):
-        if line[0] == '>':
-            r = line[1:].rstrip()
-            if read_clusters.has_key(r):
-                c = read_clusters[r]
-                init_files[c].write(line)
-                if soft_assign:
-                    build_files[c].write('>1.0;%s' % line[1:])
-            else:
-                c = -1
-
-        elif c != - 1:
-            init_files[c].write(line)
-            if soft_assign:
-                build_files[c].write(line)
-
-    # close files
+    # collect cluster reads in file order
+    cluster_reads = [[] for c in range(clusters)]
+    headers = cat.headers()
+    for i in range(cat.num_reads):
+        r = headers[i].rstrip()
+        if read_clusters.has_key(r):
+            cluster_reads[read_clusters[r]].append(i)
+
+    # write cluster-*.fa
     for c in range(clusters):
-        init_files[c].close()
+        init_file = open('cluster-%d.fa' % c, 'w')
+        cat.write_reads(init_file, cluster_reads[c])
+        init_file.close()
         if soft_assign:
-            build_files[c].close()
+            build_file = open('cluster-%d.build.fa' % c, 'w')
+            cat.write_reads(build_file, cluster_reads[c], [1.0]*len(cluster_reads[c]))
+            build_file.close()
 
 ############################################################
 # __main__
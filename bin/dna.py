@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 import string, sys, math, random
+import numpy as np
 
 ############################################################
 # dna.py
@@ -17,15 +18,19 @@ def fasta2dict(fasta_file):
     fasta_dict = {}
     
     header = ''
-    seq = ''
+    seq_lines = []
     
     for line in open(fasta_file):
         if line[0] == '>':
+            if header:
+                fasta_dict[header] = ''.join(seq_lines)
             #header = line.split()[0][1:]
             header = line[1:].rstrip()
-            fasta_dict[header] = ''
+            seq_lines = []
         else:
-            fasta_dict[header] += line.rstrip()
+            seq_lines.append(line.rstrip())
+    if header:
+        fasta_dict[header] = ''.join(seq_lines)
 
     return fasta_dict
 
@@ -58,7 +63,6 @@ def count_kmers(k, seq, all=False):
 
         # reverse
         kmer = rc_seq[i:i+k]
-        kmer = seq[i:i+k]
         if kmers.has_key(kmer):
             kmers[kmer] += 1
         else:
@@ -74,7 +78,7 @@ def count_kmers(k, seq, all=False):
 
     if all:
         # add zero count kmers        
-        for i in range(int(math.pow(4,k))):
+        for i in range(4**k):
             kmer = int2kmer(k,i)
             if not kmers.has_key(kmer):
                 kmers[kmer] = 0                
@@ -90,12 +94,102 @@ def int2kmer(k,num):
     nts = ['A','C','G','T']
     kmer = ''
     for x in range(k):
-        b = int(math.pow(4, k-1-x))
-        kmer += nts[num / b]
+        b = 4**(k-1-x)
+        kmer += nts[num // b]
         num =  num % b
     return kmer
 
 
+############################################################
+# kmer_counts
+#
+# Count the canonical kmers (the lesser of each kmer and its
+# reverse complement) on both strands of each sequence in
+# the list seqs, returning a sequences x canonical kmers
+# matrix with columns in the order of canonical_kmer_list.
+# Each occurrence of a kmer or its reverse complement
+# counts once; kmers with non-ACGT characters are skipped.
+#
+# Sequences are 2-bit encoded and concatenated, so each
+# kmer's code and that of its reverse complement are built
+# for all positions at once with k shift-and-add steps.
+############################################################
+nt_codes = np.array([4]*256, dtype=np.uint8)
+for (nt,code) in zip('ACGTacgt', [0,1,2,3,0,1,2,3]):
+    nt_codes[ord(nt)] = code
+
+def kmer_counts(seqs, k):
+    columns = canonical_kmer_columns(k)
+    num_cols = columns.max() + 1
+    counts = np.zeros((len(seqs), num_cols), dtype=np.int64)
+    if not seqs:
+        return counts
+
+    # encode with a non-ACGT separator after each sequence
+    nts = nt_codes[np.frombuffer('N'.join(seqs) + 'N', dtype=np.uint8)]
+    seq_ids = np.repeat(np.arange(len(seqs)), [len(seq)+1 for seq in seqs])
+
+    num_kmers = len(nts) - k + 1
+    if num_kmers <= 0:
+        return counts
+
+    # only windows of all ACGT
+    bad = np.concatenate(([0], np.cumsum(nts == 4)))
+    valid = (bad[k:] == bad[:num_kmers])
+
+    # codes of the kmers and their reverse complements
+    fwd = np.zeros(num_kmers, dtype=np.int64)
+    rev = np.zeros(num_kmers, dtype=np.int64)
+    bits = (nts & 3).astype(np.int64)
+    for j in range(k):
+        fwd = (fwd << 2) | bits[j:j+num_kmers]
+        rev |= (3 - bits[j:j+num_kmers]) << (2*j)
+    canon = np.minimum(fwd, rev)[valid]
+
+    cells = seq_ids[:num_kmers][valid]*num_cols + columns[canon]
+    counts += np.bincount(cells, minlength=len(seqs)*num_cols).reshape(len(seqs), num_cols)
+
+    return counts
+
+
+############################################################
+# canonical_kmer_columns
+#
+# Return an array mapping each kmer code (A,C,G,T = 0..3,
+# first nt most significant) to its canonical kmer's column
+# in kmer_counts matrices.
+############################################################
+def canonical_kmer_columns(k):
+    canon = np.minimum(np.arange(4**k), rc_codes(k))
+    canon_codes = np.unique(canon)
+    return np.searchsorted(canon_codes, canon)
+
+
+############################################################
+# canonical_kmer_list
+#
+# Return the canonical kmers in kmer_counts column order,
+# which is sorted order.
+############################################################
+def canonical_kmer_list(k):
+    codes = np.arange(4**k)
+    return [int2kmer(k, int(code)) for code in codes[codes <= rc_codes(k)]]
+
+
+############################################################
+# rc_codes
+#
+# Return an array of the code of each kmer code's reverse
+# complement.
+############################################################
+def rc_codes(k):
+    codes = np.arange(4**k, dtype=np.int64)
+    rev = np.zeros(4**k, dtype=np.int64)
+    for j in range(k):
+        rev |= (3 - ((codes >> (2*j)) & 3)) << (2*(k-1-j))
+    return rev
+
+
 ############################################################
 # canonical_kmers
 #
@@ -143,81 +237,167 @@ def canonical_kmers(kmers, return_all=False):
 # file, with an option to draw pairs of mates.
 ############################################################
 def fasta_rand(num_seq, reads_file, out_file, mates_file=''):
-    random.seed()
+    fasta_rand_multi([num_seq], reads_file, [out_file], mates_file)
 
-    seqs = fasta2dict(reads_file)
 
-    out = open(out_file, 'w')
-    
+############################################################
+# fasta_rand_big
+#
+# Randomly sample 'num_seq' sequences from a multi-fasta
+# file, without loading the sequences into memory.
+############################################################
+def fasta_rand_big(num_seq, reads_file, out_file, cat=None):
+    fasta_rand_multi([num_seq], reads_file, [out_file], cat=cat)
+
+
+############################################################
+# fasta_rand_multi
+#
+# Draw an independent random sample of num_seqs[i]
+# sequences from a multi-fasta file into each out_files[i],
+# in file order.  Given a mates file of 'left right' lines,
+# draw num_seqs[i]/2 pairs of mates instead, each pair
+# written together.
+#
+# Given the file's Catalog, seek to the sampled reads only.
+# Otherwise, read the file once, reservoir sampling as it
+# goes and keeping only the sampled records.
+############################################################
+def fasta_rand_multi(num_seqs, reads_file, out_files, mates_file='', cat=None):
+    random.seed()
+
+    mates = {}
     if mates_file:
-        # get mates
-        mates = {}
         for line in open(mates_file):
             (lr,rr) = line.split()
             mates[lr] = rr
             mates[rr] = lr
-
-        # sample from left reads, print both
-        for h in random.sample(mates.keys(), num_seq/2):
-            print >> out, '>%s' % h
-            print >> out, seqs[h]
-            print >> out, '>%s' % mates[h]
-            print >> out, seqs[mates[h]]
-
+        num_units = [n/2 for n in num_seqs]
     else:
-        # sample from all
-        for h in random.sample(seqs.keys(), num_seq):
-            print >> out, '>%s' % h
-            print >> out, seqs[h]
+        num_units = num_seqs
 
+    if cat:
+        samples = seek_samples(num_units, cat, mates)
+        outs = [open(out_file, 'w') for out_file in out_files]
+        cat.write_samples(outs, samples)
+        for out in outs:
+            out.close()
+        return
 
-############################################################
-# fasta_rand_big
-#
-# Randomly sample 'num_seq' sequences from a multi-fasta
-# file, without loading the sequences into memory.
-############################################################
-def fasta_rand_big(num_seq, reads_file, out_file):
-    random.seed()
+    reservoirs = [Reservoir(n) for n in num_units]
+    partner_units = {}
+    unit_i = 0
+    records = None
 
-    # count sequences
-    total_seq = 0
     for line in open(reads_file):
         if line[0] == '>':
-            total_seq += 1
+            header = line[1:].rstrip()
+            if partner_units.has_key(header):
+                # second mate, kept if its pair was sampled
+                unit = partner_units.pop(header)
+                if unit:
+                    records = unit[1]
+                    records.append(line)
+                else:
+                    records = None
+                continue
+            elif mates and not mates.has_key(header):
+                # unpaired reads aren't sampled
+                records = None
+                continue
+
+            unit = (unit_i, [line])
+            unit_i += 1
+            records = None
+            for r in reservoirs:
+                if r.offer(unit):
+                    records = unit[1]
+            if mates:
+                if records is not None:
+                    partner_units[mates[header]] = unit
+                else:
+                    partner_units[mates[header]] = None
 
-    # chose random reads
-    rand_seqs = random.sample(xrange(total_seq), num_seq)
-    rand_seqs.sort()
+        elif records is not None:
+            records.append(line)
 
-    # grab reads
-    out = open(out_file, 'w')
-    rand_i = 0
-    seq_i = 0
-    header = ''
-    for line in open(reads_file):
-        if line[0] == '>':
-            if header:
-                # print last
-                if seq_i == rand_seqs[rand_i]:
-                    print >> out, header
-                    print >> out, seq
-                    rand_i += 1
-                    if rand_i >= num_seq:
-                        break
-                seq_i += 1
-
-            header = line.rstrip()
-            seq = ''
+    for i in range(len(out_files)):
+        out = open(out_files[i], 'w')
+        for (unit_i, unit_records) in sorted(reservoirs[i].units):
+            out.write(''.join(unit_records))
+        out.close()
+
+
+############################################################
+# seek_samples
+#
+# Choose each sample's read indexes from the Catalog,
+# taking num_units[i] reads or, given mates, pairs.
+############################################################
+def seek_samples(num_units, cat, mates):
+    if mates:
+        read_index = cat.index()
+        pairs = [(read_index[lr], read_index[rr]) for (lr,rr) in mates.items() if lr < rr and read_index.has_key(lr) and read_index.has_key(rr)]
+
+    samples = []
+    for n in num_units:
+        if mates:
+            sample = []
+            for (li,ri) in random.sample(pairs, min(n, len(pairs))):
+                sample += [li, ri]
         else:
-            seq += line.rstrip()
+            sample = random.sample(xrange(cat.num_reads), min(n, cat.num_reads))
+        samples.append(sorted(sample))
+    return samples
 
-    # print last
-    if rand_i < num_seq and seq_i == rand_seqs[rand_i]:
-        print >> out, header
-        print >> out, seq
 
-    out.close()
+############################################################
+# Reservoir
+#
+# A uniform random sample of n of the units offered in turn,
+# kept with Li's algorithm L so that only O(n log(N/n)) of
+# the N offers draw random numbers.
+############################################################
+class Reservoir:
+    def __init__(self, n):
+        self.n = n
+        self.units = []
+        self.offers = 0
+        if n > 0:
+            self.w = math.exp(math.log(1.0-random.random()) / n)
+            self.next = n + self.skip()
+
+    ############################################################
+    # skip
+    #
+    # Return the number of offers to pass over before the next
+    # one that replaces a sampled unit.
+    ############################################################
+    def skip(self):
+        if self.w >= 1:
+            return 0
+        return int(math.floor(math.log(1.0-random.random()) / math.log(1.0-self.w)))
+
+    ############################################################
+    # offer
+    #
+    # Offer the next unit, returning True if it is sampled.
+    ############################################################
+    def offer(self, unit):
+        i = self.offers
+        self.offers += 1
+
+        if i < self.n:
+            self.units.append(unit)
+            return True
+
+        elif self.n > 0 and i == self.next:
+            self.units[random.randint(0, self.n-1)] = unit
+            self.w *= math.exp(math.log(1.0-random.random()) / self.n)
+            self.next += 1 + self.skip()
+            return True
+
+        return False
 
 
 ############################################################
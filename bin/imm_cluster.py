@@ -2,7 +2,9 @@
 
 from __future__ import division
 from optparse import OptionParser
-import sys, os, glob, random, math, util, pdb, sys, shutil
+import sys, os, glob, random, math, util, pdb, sys, shutil, hashlib
+import numpy as np
+import catalog
 
 ############################################################
 # imm_cluster.py
@@ -17,6 +19,12 @@ use_priors = True
 like_decrease_t = 5
 rsments_t = .002
 soft_assign_t = .01
+shard_bp_t = 1000000
+lazy_change_t = .02
+stage_max_iter = 10
+stage_min_reads = 100
+sample_seed = 1
+checkpoint_file = 'imm_cluster.ckpt.npz'
 
 ############################################################
 # main
@@ -33,8 +41,17 @@ def main():
     parser.add_option('-i','--initial', dest='initial_done', action='store_true', default=False, help='Initial partition is given')
     parser.add_option('-s','--seed', dest='seed', action='store_true', default=False, help='Incomplete initial partition is given')
     parser.add_option('--seed_only', dest='seed_only', action='store_true', default=False, help='Perform a single iteration of the algorithm using a seeded initialization')
+    parser.add_option('--seed_sample', dest='seed_sample', type='float', help='With --seed_only, score only a fixed random SEED_SAMPLE fraction of the reads, as chosen by fixed_sample')
     parser.add_option('--trained', dest='trained', action='store_true', default=False, help='The models are already trained for the first iteration (e.g. by --seed_only')
     parser.add_option('--em', dest='soft_assign', action='store_true', default=False, help='Use a soft assignment of sequences to clusters and use expectation maximization')
+    parser.add_option('--job_log', dest='job_log', help='Append the status, wall time, CPU time and peak memory of each job run to this file')
+    parser.add_option('--checkpoint', dest='checkpoint', type='int', default=1, help='Save the iteration state every CHECKPOINT iterations, or never if 0. Each save writes about 8 bytes per read, plus 4 per read per cluster with --em, and as much again when the best iteration so far has changed [Default=%default]')
+    parser.add_option('--resume', dest='resume', action='store_true', default=False, help='Resume from the last saved iteration, if any')
+    parser.add_option('--lazy', dest='lazy_margin', type='float', help='Rescore only reads whose best cluster beats the next by less than LAZY_MARGIN log-likelihood, or whose top two IMMs changed much')
+    parser.add_option('--cascade', dest='cascade', type='int', default=0, help='Prefilter clusters for each read with low-order Markov models and score only the best CASCADE with the full IMMs')
+    parser.add_option('--update_t', dest='update_t', type='float', default=0, help='Update a hard assignment IMM with just the reads that joined or left its cluster while fewer than UPDATE_T of them have moved since it was trained from scratch, keeping its tree structure fixed [Default=%default]')
+    parser.add_option('--progressive', dest='progressive', help='Run the first iterations on growing random samples of the reads, given as comma-separated fractions, e.g. 0.01,0.1')
+    parser.add_option('--full_every', dest='full_every', type='int', default=5, help='With --lazy, rescore all reads every FULL_EVERY iterations [Default=%default]')
 
     (options, args) = parser.parse_args()
 
@@ -42,11 +59,13 @@ def main():
         parser.error('Must define k')
     if not options.reads_file and not options.reads_dir:
         parser.error('Must provide reads')
+    if options.job_log:
+        os.environ['SCIMM_JOB_LOG'] = os.path.abspath(options.job_log)
+    util.start_jobserver(options.par)
 
-    num_reads = 0
-    for line in open(options.reads_file):
-        if line[0] == '>':
-            num_reads += 1
+    # index reads
+    cat = catalog.load(options.reads_file)
+    num_reads = cat.num_reads
 
     # in case k shrinks
     k = options.k
@@ -57,161 +76,521 @@ def main():
     # load constraints
     constraints = load_constraints(options.constraints_file)
     
-    # partition reads into k files
-    if options.seed:
-        if options.constraints_file:
-            constraint_seed(options.reads_file, k, mates, constraints, options.soft_assign)
-        (like,priors) = seed_partition(options.reads_file, k, mates, constraints, options.soft_assign, options.par)
-        (k,priors) = filter_empty(k, priors, constraints)
-        print 'Iter 0:\t%d' % int(like)
-
-        if options.seed_only:
-            # train on all sequences for fair likelihood comparisons
-            train_imm(k, options.soft_assign, options.par)
-            # score each read with each IMM
-            score_reads(k, options.reads_file, options.par)
-            exit()
+    if options.resume and os.path.isfile(checkpoint_file):
+        # pick up after the last saved iteration
+        (iter,k,priors,assign,read_probs,converged,good_prog,prog,sample) = load_checkpoint(cat, mates, options.soft_assign)
+        counts = ICMCounts()
+
     else:
-        priors = [1.0/k]*k
+        # forget any earlier run
+        remove_checkpoint()
+
+        # partition reads into k clusters
+        if options.seed:
+            if options.constraints_file:
+                (assign,read_probs) = constraint_seed(cat, k, constraints, options.soft_assign)
+            else:
+                (assign,read_probs) = load_partition(cat, k, options.soft_assign)
+            if options.seed_only and options.seed_sample and options.seed_sample < 1:
+                sample = fixed_sample(num_reads, options.seed_sample)
+            else:
+                sample = None
+            (like,priors,assign,read_probs) = seed_partition(cat, k, assign, read_probs, mates, constraints, options.soft_assign, options.par, sample)
+            (k,priors,assign,read_probs) = filter_empty(k, priors, assign, read_probs, constraints, None)
+            print 'Iter 0:\t%d' % int(like)
+
+            if options.seed_only:
+                # train on all sequences for fair likelihood comparisons
+                write_clusters(cat, k, assign, read_probs, options.soft_assign)
+                train_imm(cat, k, assign, read_probs, options.soft_assign, options.par)
+                # score each read with each IMM
+                score_reads(cat, k, options.par, reads=sample)
+                exit()
+        else:
+            priors = [1.0/k]*k
+
+        if options.initial_done and not options.seed:
+            (assign,read_probs) = load_partition(cat, k, options.soft_assign)
 
-    if options.initial_done or options.seed:
-        verify_constraints(k, constraints)
+        if options.initial_done or options.seed:
+            (assign,read_probs) = verify_constraints(cat, k, assign, read_probs, constraints)
         
-    else:
-        random_partition(options.reads_file, options.reads_dir, k, mates, options.soft_assign)
-        #correct_partition_cb(options.reads_file, k, options.soft_assign)
+        else:
+            (assign,read_probs) = random_partition(cat, k, mates, options.soft_assign)
 
-    # progress data
-    prog = Progress(k)
-    good_prog = True
-    rsments = num_reads
-    iter = 0
+        # start on a sample of the reads
+        if options.progressive:
+            fractions = [float(x) for x in options.progressive.split(',')]
+            sample = ProgressiveSample(fractions, assign, mate_index(cat, mates))
+        else:
+            sample = None
+
+        # progress data
+        prog = Progress(k)
+        counts = ICMCounts()
+        good_prog = True
+        converged = False
+        iter = 0
     
-    while iter < max_iter and rsments >= num_reads*rsments_t and good_prog:
+    if options.lazy_margin:
+        lazy = LazyScores(options.lazy_margin, options.full_every)
+    else:
+        lazy = None
+
+    while iter < max_iter and not converged and good_prog:
         iter += 1
                 
         if iter > 1 or not options.trained:
             # train an IMM on each cluster
-            train_imm(k, options.soft_assign, options.par)
+            trained = train_imm(cat, k, assign, read_probs, options.soft_assign, options.par, counts, options.cascade, options.update_t)
+
+            # add more reads to the sample to be scored
+            if sample and sample.advancing:
+                sample.advance(iter, assign)
+                trained = range(k)
+                prog = Progress(k)
+                priors = [1.0/k]*k
+                if sample.full() and lazy:
+                    lazy.clear()
         
-            # score each read with each IMM
-            score_reads(k, options.reads_file, options.par)
+            # score each read with each new IMM
+            if sample and not sample.full():
+                score_reads(cat, k, options.par, trained, np.nonzero(sample.mask)[0], options.cascade)
+            elif lazy:
+                score_reads(cat, k, options.par, trained, lazy.active_reads(iter, assign), options.cascade)
+            else:
+                score_reads(cat, k, options.par, trained, cascade=options.cascade)
 
         # reassign reads to max scoring IMM
-        (rsments,like,priors) = reassign_reads(options.reads_file, priors, mates, constraints, options.soft_assign, False)
-        (k,priors) = filter_empty(k, priors, constraints)
+        if sample and not sample.full():
+            (rsments,like,priors,assign,read_probs) = reassign_reads(cat, assign, priors, mates, constraints, options.soft_assign, sample=sample.mask)
+        else:
+            (rsments,like,priors,assign,read_probs) = reassign_reads(cat, assign, priors, mates, constraints, options.soft_assign, lazy)
+
+        # a cluster may be empty only in the sample
+        if not sample or sample.full():
+            (k,priors,assign,read_probs) = filter_empty(k, priors, assign, read_probs, constraints, counts)
+        if lazy and k != lazy.k:
+            lazy.clear()
 
         print 'Iter %d:\t%d\t%d reassignments' % (iter,int(like),rsments)
         sys.stdout.flush()
 
-        good_prog = prog.assess(like,k)
+        # only trust convergence of IMMs trained from scratch
+        if sample and not sample.full():
+            converged = (rsments < sample.mask.sum()*rsments_t)
+        else:
+            converged = (rsments < num_reads*rsments_t)
+        if converged and counts.updated:
+            converged = False
+            counts.clear()
+
+        # nor of stale scores
+        if converged and lazy and lazy.stale:
+            converged = False
+            lazy.clear()
+
+        good_prog = prog.assess(like, k, assign, read_probs)
+
+        # move on to a bigger sample rather than stop early
+        if sample and not sample.full() and (converged or not good_prog or iter - sample.start_iter >= stage_max_iter):
+            sample.advancing = True
+            converged = False
+            good_prog = True
+
+        if options.checkpoint and iter % options.checkpoint == 0:
+            save_checkpoint(iter, k, priors, assign, read_probs, converged, good_prog, prog, sample)
 
     # take max
-    for i in range(k):
-        os.rename('cluster-%d.max'%i, 'cluster-%d.fa'%i)
+    write_clusters(cat, prog.max_k, prog.max_assign, prog.max_probs, options.soft_assign)
+
+    # clean up training counts and the finished run's checkpoint
+    for c in range(k):
+        for f in ['cluster-%d.counts' % c, 'cluster-%d.mm' % c]:
+            if os.path.isfile(f):
+                os.remove(f)
+    remove_checkpoint()
 
 
 ############################################################
 # train_imm
 #
-# Train an IMM on each cluster.  The reads are in 
-# cluster-#.fa, and the IMM will be in cluster-#.icm
+# Train an IMM on each cluster, running at most 'par' at
+# a time.  Each cluster's reads are piped from the reads
+# file to the trainer's stdin, and the IMM will be in
+# cluster-#.icm
+#
+# Given ICMCounts, a cluster whose reads (and weights) are
+# the same as when its IMM was last made is not retrained.
+# Also, if update_t is set, hard assignment IMMs save their
+# training counts in cluster-#.counts, and a cluster's IMM
+# is updated with just the reads that joined or left it if,
+# in total since it was last trained from scratch, fewer
+# than update_t of its reads have moved.  The update keeps
+# the IMM's tree structure, so it only approximates
+# retraining.
+#
+# A cluster with no reads, as happens to clusters with no
+# sampled reads while sampling, keeps its last IMM.
+#
+# If markov is set, the trainers also save a low-order
+# Markov model of each cluster in cluster-#.mm for cascaded
+# scoring.  Return the list of clusters whose IMMs were
+# (re)made.
 ############################################################
-def train_imm(k, soft_assign, par):
-    cmds = []
-    for i in range(k):
+def train_imm(cat, k, assign, read_probs, soft_assign, par, counts=None, markov=False, update_t=0):
+    if soft_assign:
+        build_icm = '%s/em_build-icm' % bin_dir
+    else:
+        build_icm = '%s/build-icm' % bin_dir
+
+    moved = [0]*k
+    prints = [None]*k
+    trained = []
+    jobs = []
+    for c in range(k):
+        if soft_assign:
+            soft_reads = cluster_soft_reads(c, assign, read_probs)
+            prints[c] = membership_print(soft_reads, read_probs[soft_reads,c])
+            cluster_size = len(soft_reads)
+        else:
+            prints[c] = membership_print(np.nonzero(assign == c)[0])
+            cluster_size = (assign == c).sum()
+
+        if cluster_size == 0 and os.path.isfile('cluster-%d.icm' % c):
+            # keep the IMM, but not counts of reads now gone
+            if os.path.isfile('cluster-%d.counts' % c):
+                os.remove('cluster-%d.counts' % c)
+            continue
+
+        if counts is not None and counts.same_print(c, prints[c]):
+            # reuse the IMM
+            moved[c] = counts.moved[c]
+            continue
+        trained.append(c)
+
+        if markov:
+            build_args = [build_icm, '-p', '1', '-M', 'cluster-%d.mm' % c]
+        else:
+            build_args = [build_icm, '-p', '1']
+
         if soft_assign:
-            cmds.append('%s/em_build-icm -p 1 cluster-%d.icm < cluster-%d.build.fa' % (bin_dir,i,i))
+            jobs.append(util.Job(build_args + ['cluster-%d.icm' % c], feed=read_feeder(cat, soft_reads, read_probs[soft_reads,c])))
+
+        elif counts is None or not update_t:
+            jobs.append(util.Job(build_args + ['cluster-%d.icm' % c], feed=read_feeder(cat, np.nonzero(assign == c)[0])))
+
         else:
-            cmds.append('%s/build-icm -p 1 cluster-%d.icm < cluster-%d.fa' % (bin_dir,i,i))
+            (joined, left) = counts.changes(c, assign)
+            if joined is not None and counts.moved[c] + len(joined) + len(left) < update_t*cluster_size:
+                # update counts
+                moved[c] = counts.moved[c] + len(joined) + len(left)
+                jobs.append(util.Job(build_args + ['-u', '-c', 'cluster-%d.counts' % c, 'cluster-%d.icm' % c], feed=read_feeder(cat, joined, removed=left)))
+            else:
+                # train from scratch
+                jobs.append(util.Job(build_args + ['-c', 'cluster-%d.counts' % c, 'cluster-%d.icm' % c], feed=read_feeder(cat, np.nonzero(assign == c)[0])))
 
-    util.exec_par(cmds, par)
+    util.run_jobs(jobs, par)
+
+    if counts is not None:
+        counts.assign = assign.copy()
+        counts.moved = moved
+        counts.prints = prints
+        counts.updated = (max(moved) > 0)
+
+    return trained
+
+############################################################
+# membership_print
+#
+# Return a fingerprint of a cluster's training set: the
+# indexes of its reads and, for EM, their weights as they
+# are written for the trainer.
+############################################################
+def membership_print(reads, weights=None):
+    fp = hashlib.sha1(np.asarray(reads, dtype='int64').tostring())
+    if weights is not None:
+        fp.update(''.join(['%f' % w for w in weights]))
+    return fp.hexdigest()
 
 ############################################################
 # score_reads
 #
-# For each IMM, run on each cluster of reads outputting the
-# scores to a temp file cluster-#.icm-#.scores.tmp
+# Split the IMMs into groups and the reads into shards as
+# chosen by score_plan, and score each shard with each
+# group in a single pass, outputting each IMM's scores as
+# binary floats to cluster-#.scores in the order of the
+# reads file.  Each job writes its shard's scores in place.
+# If 'clusters' is given, only those clusters' IMMs are
+# scored, and if 'reads' is given, only those reads are
+# rescored, keeping the others' scores.
+#
+# If 'cascade' is set, each read gets full IMM scores from
+# only the 'cascade' clusters whose low-order Markov models
+# score it best, so every job scores with all the IMMs.
+# Print how often the best full score disagreed with the
+# Markov models' choice.
 ############################################################
-def score_reads(k, readsf, par):
-    cmds = []
-    for c in range(k):
-        cmds.append('%s/simple-score -N cluster-%d.icm < %s > icm-%d.scores.tmp 2>/dev/null' % (bin_dir,c,readsf,c))
+def score_reads(cat, k, par, clusters=None, reads=None, cascade=0):
+    if clusters is None or cascade:
+        clusters = range(k)
+    score_icms(cat, ['cluster-%d.icm' % c for c in clusters], par, reads, cascade)
+
+############################################################
+# score_icms
+#
+# Score the reads with the IMMs in the list of .icm files
+# as score_reads does, writing each IMM's scores beside it
+# with the extension .scores, so that IMMs of several
+# clusterings can share one pass over the reads.
+############################################################
+def score_icms(cat, icms, par, reads=None, cascade=0):
+    if not icms:
+        return
+    scores_files = [os.path.splitext(icm)[0] + '.scores' for icm in icms]
+
+    if reads is None:
+        readsf = cat.readsf
+        lengths = cat.lengths
+        offsets = cat.offsets
+        index_args = []
+
+        # make the score files for the shards to fill
+        for scores_file in scores_files:
+            scores_out = open(scores_file, 'wb')
+            scores_out.truncate(4*cat.num_reads)
+            scores_out.close()
+
+    else:
+        if len(reads) == 0:
+            return
+
+        # copy the reads out, with their positions
+        readsf = 'rescore.fa'
+        rescore_out = open(readsf, 'w')
+        cat.write_reads(rescore_out, reads)
+        rescore_out.close()
+        np.asarray(reads, dtype='int32').tofile('rescore.idx')
+
+        # unscored reads keep zero scores in new score files
+        for scores_file in scores_files:
+            if not os.path.isfile(scores_file):
+                scores_out = open(scores_file, 'wb')
+                scores_out.truncate(4*cat.num_reads)
+                scores_out.close()
+
+        lengths = cat.lengths[reads]
+        offsets = np.concatenate(([0], np.cumsum(cat.offsets[reads+1] - cat.offsets[reads])))
+        index_args = ['-x', 'rescore.idx']
+
+    if cascade:
+        (groups, shards) = score_plan(1, par, lengths.sum())
+        cascade_args = ['-m', str(cascade)]
+    else:
+        (groups, shards) = score_plan(len(icms), par, lengths.sum())
+        cascade_args = []
+
+    # split reads into shards of about equal length
+    cum_bp = np.cumsum(lengths)
+    bounds = np.searchsorted(cum_bp, [cum_bp[-1]*s/shards for s in range(1,shards)])
+    bounds = np.unique(np.concatenate(([0], bounds, [len(lengths)])))
+
+    jobs = []
+    shard_ins = []
+    c = 0
+    for g in range(groups):
+        group_k = len(icms)//groups + (g < len(icms)%groups)
+        group_icms = icms[c:c+group_k]
+        for s in range(len(bounds)-1):
+            shard_ins.append(open(readsf))
+            shard_ins[-1].seek(offsets[bounds[s]])
+            shard_args = ['-s', str(bounds[s]), '-n', str(bounds[s+1]-bounds[s])]
+            if cascade:
+                job_err = 'cascade-%d.txt' % len(jobs)
+            else:
+                job_err = os.devnull
+            jobs.append(util.Job(['%s/multi-score' % bin_dir, '-B'] + cascade_args + index_args + shard_args + group_icms, stdin=shard_ins[-1], stderr=job_err))
+        c += group_k
     
-    util.exec_par(cmds, par)
+    util.run_jobs(jobs, par)
+
+    for shard_in in shard_ins:
+        shard_in.close()
+
+    if cascade:
+        cascade_stats = np.zeros(3, dtype=int)
+        for j in range(len(jobs)):
+            for line in open('cascade-%d.txt' % j):
+                if line.startswith('Cascade'):
+                    cascade_stats += [int(x) for x in line.split()[1:]]
+            os.remove('cascade-%d.txt' % j)
+        print 'Cascade:\t%d of %d reads disagreed, %d at the cutoff' % (cascade_stats[1], cascade_stats[0], cascade_stats[2])
+    if reads is not None:
+        os.remove('rescore.fa')
+        os.remove('rescore.idx')
+
+############################################################
+# score_plan
+#
+# Choose the number of IMM groups and read shards whose
+# groups x shards scoring jobs should finish soonest on
+# 'par' cpus, keeping at least shard_bp_t bp in a shard so
+# that loading the IMMs stays cheap next to scoring.
+############################################################
+def score_plan(k, par, total_bp):
+    max_shards = int(max(1, min(par, total_bp // shard_bp_t)))
+
+    best = None
+    for groups in range(1, min(k,par)+1):
+        for shards in range(1, max_shards+1):
+            # waves of jobs times the work of the largest job
+            span = math.ceil(groups*shards / par) * math.ceil(k / groups) / shards
+            if best is None or span < best[0]:
+                best = (span, groups, shards)
+
+    return best[1:]
+
+############################################################
+# read_feeder
+#
+# Return a function writing the given reads, and then the
+# given removed reads with weight -1, to a trainer's stdin.
+############################################################
+def read_feeder(cat, reads, weights=None, removed=None):
+    def feed(pipe):
+        cat.write_reads(pipe, reads, weights)
+        if removed is not None:
+            cat.write_reads(pipe, removed, [-1]*len(removed))
+    return feed
+
+############################################################
+# load_scores
+#
+# Map the binary score files into a reads x k matrix whose
+# rows are indexed like the reads in the catalog.
+############################################################
+def load_scores(k, num_reads):
+    scores = np.empty((num_reads,k))
+    for c in range(k):
+        c_scores = np.memmap('cluster-%d.scores' % c, dtype='float32', mode='r')
+        if len(c_scores) != num_reads:
+            print 'ERROR: cluster-%d.scores has %d scores for %d reads' % (c, len(c_scores), num_reads)
+            exit()
+        scores[:,c] = c_scores
+
+    return scores
 
 ############################################################
 # reassign_reads
 #
-# For each cluster of reads, check their IMM scores and
-# assign each read to a new cluster.  Also, calculate the
-# likelihood of the reads (in their current clusters)
-# given the current model.
+# Check the IMM scores of each clustered read (assign[i]
+# != -1) and assign it to a new cluster.  Also, calculate
+# the likelihood of the reads (in their current clusters)
+# given the current model.  Given LazyScores, record each
+# read's margin.  Given a sample mask, only the sampled
+# reads count toward the priors and likelihood, the others
+# being unscored.  Return the new assignment array and, for EM, the read x cluster probabilities.
 ############################################################
-def reassign_reads(readsf, priors, mates, constraints, soft_assign, initial_seed):
+def reassign_reads(cat, assign, priors, mates, constraints, soft_assign, lazy=None, sample=None):
     k = len(priors)
 
+    rp = ReadProbs(k, cat, mates, constraints, sample)
+
     if use_priors:
-        priors = update_priors(priors, readsf, mates, constraints, soft_assign)
+        priors = rp.update_priors(priors, soft_assign)
 
-    (likelihood, read_probs) = get_read_probs(priors, mates, constraints, soft_assign)
+    if lazy:
+        lazy.update(rp, priors)
+
+    (likelihood, read_probs) = rp.get_read_probs(priors, soft_assign)
+    clustered = (assign != -1)
+
+    for i in np.nonzero(clustered & rp.constrained & (assign != rp.constraint))[0]:
+        print 'Found a constrained read in the wrong cluster'
+
+    # count reassignments
+    new_assign = np.where(clustered, rp.max_icms, -1)
+    rsments = int(((new_assign != assign) & clustered & ~rp.constrained).sum())
+
+    if not soft_assign:
+        read_probs = None
+
+    return (rsments,likelihood,priors,new_assign,read_probs)
+
+############################################################
+# write_clusters
+#
+# Write the reads assigned to each cluster to cluster-#.fa
+# and, for EM, the reads with probability > soft_assign_t
+# and their weights to cluster-#.build.fa.
+############################################################
+def write_clusters(cat, k, assign, read_probs, soft_assign):
+    for c in range(k):
+        cluster_file = open('cluster-%d.fa' % c, 'w')
+        cat.write_reads(cluster_file, np.nonzero(assign == c)[0])
+        cluster_file.close()
 
-    # open files
-    read_files = []
-    build_files = []
-    for i in range(k):
-        read_files.append(open('cluster-%d.tmp' % i,'w'))
         if soft_assign:
-            build_files.append(open('cluster-%d.build.fa' % i, 'w'))
-    
-    if initial_seed:
-        myk = 1
-    else:
-        myk = k
+            soft_reads = cluster_soft_reads(c, assign, read_probs)
+            build_file = open('cluster-%d.build.fa' % c, 'w')
+            cat.write_reads(build_file, soft_reads, read_probs[soft_reads,c])
+            build_file.close()
 
-    rsments = 0
-    for c in range(myk):
-        # reassign
+############################################################
+# cluster_soft_reads
+#
+# Return the indexes of the clustered reads with
+# probability > soft_assign_t of belonging to cluster c.
+############################################################
+def cluster_soft_reads(c, assign, read_probs):
+    return np.nonzero((read_probs[:,c] > soft_assign_t) & (assign != -1))[0]
+
+############################################################
+# load_partition
+#
+# Read the given initial partition from cluster-#.fa (and
+# the weights from cluster-#.build.fa for EM) into an
+# assignment array.  Reads in no cluster are assigned -1.
+############################################################
+def load_partition(cat, k, soft_assign):
+    read_index = cat.index()
+
+    assign = -np.ones(cat.num_reads, dtype=int)
+    for c in range(k):
         for line in open('cluster-%d.fa' % c):
             if line[0] == '>':
                 r = line[1:].strip()  # remove front spaces
-                if not read_probs.has_key(r):
-                    print 'ERROR: missing read %s scores' % r
+                if not read_index.has_key(r):
+                    print 'ERROR: missing read %s in %s' % (r, cat.readsf)
                     exit()
-                    
-                elif constraints.has_key(r):
-                    if constraints[r] != c:
-                        print 'Found a constrained read in the wrong cluster'
-                    max_icm = constraints[r]
-
-                else:
-                    (max_prob, max_icm) = util.max_i(read_probs[r])
-
-                    # count reassignments
-                    if max_icm != c:
-                        rsments += 1
-
-            # print line to files
-            read_files[max_icm].write(line)
-            if soft_assign:
-                for i in range(k):
-                    if read_probs[r][i] > soft_assign_t:
-                        if line[0] == '>':
-                            build_files[i].write('>%f;%s' % (read_probs[r][i],line[1:]))
-                        else:
-                            build_files[i].write(line)
-            
-    # close files
-    for i in range(k):
-        read_files[i].close()
-        if soft_assign:
-            build_files[i].close()
+                assign[read_index[r]] = c
 
-    # move tmp
-    for i in range(k):
-        os.rename('cluster-%d.tmp'%i, 'cluster-%d.fa'%i)
+    if not soft_assign:
+        return (assign, None)
 
-    return (rsments,likelihood,priors)
+    if os.path.isfile('cluster-0.build.fa'):
+        read_probs = np.zeros((cat.num_reads,k))
+        for c in range(k):
+            for line in open('cluster-%d.build.fa' % c):
+                if line[0] == '>':
+                    (w,r) = line[1:].split(';',1)
+                    read_probs[read_index[r.strip()],c] = float(w)
+    else:
+        read_probs = one_hot(assign, k)
+
+    return (assign, read_probs)
+
+############################################################
+# one_hot
+#
+# Return a reads x k probability matrix with each read's
+# assigned cluster set to 1.0.
+############################################################
+def one_hot(assign, k):
+    read_probs = np.zeros((len(assign),k))
+    clustered = np.nonzero(assign != -1)[0]
+    read_probs[clustered, assign[clustered]] = 1.0
+    return read_probs
 
 ############################################################
 # log_add
@@ -223,162 +602,174 @@ def log_add(l_i, l_j):
         return l_i + math.log(1 + math.exp((l_j - l_i)))
     else:
         return l_j + math.log(1 + math.exp((l_i - l_j)))
-    
 
 ############################################################
-# update_priors
+# ReadProbs
 #
-# Calculate the proportion of sequence in each cluster
-# to be used as the prior probability of a read being
-# from that cluster.
+# Read x cluster score matrix for the current IMMs, with
+# mates' scores combined and constraints applied once so
+# that read probabilities, likelihoods, priors and
+# assignments can be computed with whole-matrix operations
+# for any set of priors.  Rows are catalog read indexes.
 ############################################################
-def update_priors(prev_priors, readsf, mates, constraints, soft_assign):    
-    k = len(prev_priors)
-
-    # get read probs
-    (l,read_probs) = get_read_probs(prev_priors, mates, constraints, soft_assign)
-
-    # count expected bp
-    exp_bp = [0]*k
-    for line in open(readsf):
-        if line[0] == '>':
-            r = line[1:].strip()  # ignore front space too
+class ReadProbs:
+    def __init__(self, k, cat, mates, constraints, sample=None):
+        self.k = k
+        self.lengths = cat.lengths
+        num_reads = cat.num_reads
+        scores = load_scores(k, num_reads)
+
+        if constraints:
+            read_index = cat.index()
+
+        # combine mate likelihoods, counting each pair's
+        # likelihood once since both mates are assigned
+        mate_i = mate_index(cat, mates)
+        self.mated = (mate_i != np.arange(num_reads))
+        self.mate_i = mate_i
+        self.scores = scores
+        self.scores[self.mated] += scores[mate_i[self.mated]]
+        self.like_weights = np.where(self.mated, 0.5, 1.0)
+
+        # constrained reads have fixed clusters and I don't
+        # care about their likelihood
+        self.constraint = -np.ones(num_reads, dtype=int)
+        for r in constraints:
+            if read_index.has_key(r):
+                self.constraint[read_index[r]] = constraints[r]
+        self.constrained = (self.constraint != -1)
+        self.like_weights[self.constrained] = 0
+
+        # unsampled reads have no scores
+        if sample is not None:
+            self.lengths = np.where(sample, self.lengths, 0)
+            self.like_weights[~sample] = 0
+
+        self.probs_key = None
+
+    ############################################################
+    # get_read_probs
+    #
+    # Given a set of priors, return the overall likelihood
+    # and a reads x k matrix of read probabilities, and set
+    # each read's most probable cluster in max_icms.
+    ############################################################
+    def get_read_probs(self, priors, soft_assign):
+        # reuse the last result for the same priors
+        key = (tuple(priors), soft_assign)
+        if key == self.probs_key:
+            return (self.likelihood, self.read_probs)
+
+        read_scores = self.scores + np.log(priors)
+
+        # determine probabilities of assignments
+        max_score = read_scores.max(axis=1)
+        sum_score = max_score + np.log(np.exp(read_scores - max_score[:,np.newaxis]).sum(axis=1))
+        read_probs = np.exp(read_scores - sum_score[:,np.newaxis])
+        max_icms = read_probs.argmax(axis=1)
+
+        # likelihood, accounting for mates being assigned twice
+        if soft_assign:
+            likelihood = np.dot(self.like_weights, sum_score)
         else:
-            for c in range(k):
-                exp_bp[c] += read_probs[r][c]*len(line.rstrip())
+            likelihood = np.dot(self.like_weights, max_score)
 
-    # normalize
-    total_bp = sum(exp_bp)
-    priors = [bp/total_bp for bp in exp_bp]
+        # if constrained, set prob accordingly
+        constrained_i = np.nonzero(self.constrained)[0]
+        read_probs[constrained_i] = 0
+        read_probs[constrained_i, self.constraint[constrained_i]] = 1.0
+        max_icms[constrained_i] = self.constraint[constrained_i]
 
-    return priors
+        self.probs_key = key
+        self.likelihood = float(likelihood)
+        self.read_probs = read_probs
+        self.max_icms = max_icms
 
-############################################################
-# get_read_probs
-#
-# Given a set of priors, return the overall likelihood
-# and a dict of read probabilities
-############################################################
-def get_read_probs(priors, mates, constraints, soft_assign):
-    k = len(priors)
+        return (self.likelihood, self.read_probs)
 
-    read_likes = {}
-    for c in range(k):
-        for line in open('icm-%d.scores.tmp' % c):
-            (r,s) = line.split('\t')
-            r = r.strip()
-            if not read_likes.has_key(r):
-                read_likes[r] = [0]*k
-            read_likes[r][c] = float(s)
-            
-    read_probs = {}
-    likelihood = 0.0
-    for r in read_likes:
-        # if constrained, set prob accordingly
-        if constraints.has_key(r):
-            read_probs[r] = [0]*k
-            read_probs[r][constraints[r]] = 1.0
+    ############################################################
+    # update_priors
+    #
+    # Calculate the proportion of sequence in each cluster
+    # to be used as the prior probability of a read being
+    # from that cluster.
+    ############################################################
+    def update_priors(self, prev_priors, soft_assign):
+        (l, read_probs) = self.get_read_probs(prev_priors, soft_assign)
 
-            # I don't care about their likelihood
+        # count expected bp
+        exp_bp = np.dot(self.lengths, read_probs)
 
-        else:
-            # combine mate likelihoods and priors
-            if mates.has_key(r):
-                r1 = read_likes[r]
-                r2 = read_likes[mates[r]['mate']]
-                read_scores = [r1[x]+r2[x]+math.log(priors[x]) for x in range(k)]
-            else:
-                r1 = read_likes[r]
-                read_scores = [r1[x]+math.log(priors[x]) for x in range(k)]
-
-            # determine probabilities of assignments
-            sum_score = read_scores[0]
-            for i in range(1,k):
-                sum_score = log_add(sum_score,read_scores[i])
-            read_probs[r] = []
-            for i in range(k):
-                read_probs[r].append(math.exp(read_scores[i] - sum_score))
-
-            # update likelihood, accounting for mates being assigned twice
-            if mates.has_key(r):
-                if soft_assign:
-                    likelihood += sum_score/2
-                else:
-                    likelihood += max(read_scores)/2
-            else:
-                if soft_assign:
-                    likelihood += sum_score
-                else:
-                    likelihood += max(read_scores)
+        # normalize
+        return list(exp_bp / exp_bp.sum())
 
-    return (likelihood, read_probs)
 
+############################################################
+# mate_index
+#
+# Return an array giving the index of each read's mate, or
+# of the read itself if it has none.
+############################################################
+def mate_index(cat, mates):
+    mate_i = np.arange(cat.num_reads)
+    if mates:
+        read_index = cat.index()
+        for r in mates:
+            if read_index.has_key(r):
+                mate_i[read_index[r]] = read_index[mates[r]['mate']]
+    return mate_i
+
+############################################################
+# fixed_sample
+#
+# Return the sorted indexes of a random fraction of the
+# reads, the same in every process, so that different
+# initial partitions can be compared on it.  A smaller
+# fraction's sample is a subset of a larger one's.
+############################################################
+def fixed_sample(num_reads, fraction):
+    order = np.random.RandomState(sample_seed).permutation(num_reads)
+    return np.sort(order[:int(math.ceil(fraction*num_reads))])
 
 ############################################################
 # random_partition
 #
-# The input is a directory name where there will be a bunch
-# of read fasta files.  Split them up randomly into k files
-# called cluster-#.fa
+# Split the reads randomly into k clusters, returning the
+# assignment array and, for EM, the probability matrix.
 ############################################################
-def random_partition(reads_file, reads_dir, k, mates, soft_assign):
-    # open files
-    rand_read_files = []
-    build_files = []
-    for c in range(k):
-        rand_read_files.append(open('cluster-%d.fa' % c,'w'))
-        if soft_assign:
-            build_files.append(open('cluster-%d.build.fa' % c,'w'))
+def random_partition(cat, k, mates, soft_assign):
+    assign = np.zeros(cat.num_reads, dtype=int)
+    headers = cat.headers()
+
+    for i in range(cat.num_reads):
+        # keep mates together
+        header = headers[i]
+        if mates.has_key(header):
+            m = mates[header]
+
+            # assign to mates cluster
+            if m['cluster'] != -1:
+                rf = m['cluster']
+            else:
+                # or to random (and save)
+                rf = random.randint(0,k-1)
+                m['cluster'] = rf
+                mates[m['mate']]['cluster'] = rf
 
-    # check for read files
-    if reads_file:
-        read_files = [reads_file]
-    elif reads_dir:        
-        read_files = glob.glob(reads_dir+'/*.fa')
-        
-    if not read_files:
-        print reads_dir
-        print 'No read files.'
-        exit()
-        
-    # split reads into new files
-    for readf in read_files:
-        for line in open(readf):
-            if line[0] == '>':
-                # keep mates together
-                header = line.rstrip()[1:]
-                if mates.has_key(header):
-                    m = mates[header]
-
-                    # assign to mates cluster
-                    if m['cluster'] != -1:
-                        rf = m['cluster']
-                    else:
-                        # or to random (and save)
-                        rf = random.randint(0,k-1)
-                        m['cluster'] = rf
-                        mates[m['mate']]['cluster'] = rf
-                        
-                # or to random
-                else:
-                    rf = random.randint(0,k-1)
-                    
-            rand_read_files[rf].write(line)
-            if soft_assign:
-                if line[0] == '>':
-                    build_files[rf].write('>1.0;%s' % line[1:])
-                else:
-                    build_files[rf].write(line)
-        
-    # close files
-    for c in range(k):
-        rand_read_files[c].close()
-        if soft_assign:
-            build_files[c].close()
+        # or to random
+        else:
+            rf = random.randint(0,k-1)
+
+        assign[i] = rf
 
     # get back mate 'cluster' memory
     for r in mates:
         del mates[r]['cluster']
+
+    if soft_assign:
+        return (assign, one_hot(assign, k))
+    else:
+        return (assign, None)
         
 
 ############################################################
@@ -439,20 +830,36 @@ def correct_partition_simXC(reads_dir, k):
 # To initialize the algorithm, train IMM's on incomplete
 # read clusters and do a maximization step to partition
 # the remainder of the reads. (Actually the seed reads
-# can be moved as well which I think is ok.)
+# can be moved as well which I think is ok.)  Given an
+# array of sample read indexes, score and partition only
+# those, leaving the others in no cluster.
 ############################################################
-def seed_partition(readsf, k, mates, constraints, soft_assign, par):
+def seed_partition(cat, k, assign, read_probs, mates, constraints, soft_assign, par, sample=None):
     # train IMMs
-    train_imm(k, soft_assign, par)
+    train_imm(cat, k, assign, read_probs, soft_assign, par)
 
     # score all reads
-    score_reads(k, readsf, par)
+    score_reads(cat, k, par, reads=sample)
+
+    # check scores and partition all reads
+    return seed_assign(cat, k, mates, constraints, soft_assign, sample)
 
-    # check scores and partition
-    shutil.copy(readsf, 'cluster-0.fa')
-    (rsments, likelihood, priors) = reassign_reads(readsf, [1.0/k]*k, mates, constraints, soft_assign, True)
+############################################################
+# seed_assign
+#
+# Partition all reads, or the sample reads, by the scores
+# of IMMs trained on the seed clusters.
+############################################################
+def seed_assign(cat, k, mates, constraints, soft_assign, sample=None):
+    if sample is None:
+        assign = np.zeros(cat.num_reads, dtype=int)
+        (rsments, likelihood, priors, assign, read_probs) = reassign_reads(cat, assign, [1.0/k]*k, mates, constraints, soft_assign)
+    else:
+        assign = -np.ones(cat.num_reads, dtype=int)
+        assign[sample] = 0
+        (rsments, likelihood, priors, assign, read_probs) = reassign_reads(cat, assign, [1.0/k]*k, mates, constraints, soft_assign, sample=(assign != -1))
 
-    return(likelihood,priors)
+    return(likelihood,priors,assign,read_probs)
 
 ############################################################
 # constraint_seed
@@ -460,72 +867,52 @@ def seed_partition(readsf, k, mates, constraints, soft_assign, par):
 # Seed the algorithm's initial partitioning with the
 # constraint reads.
 ############################################################
-def constraint_seed(reads_file, k, mates, constraints, soft_assign):
-    # open files
-    seed_read_files = []
-    build_files = []
-    seed_reads = [0]*k    
-    for i in range(k):
-        seed_read_files.append(open('cluster-%d.fa' % i,'w'))
-        if soft_assign:
-            build_files.append(open('cluster-%d.build.fa' % i,'w'))
-
-    # parse reads file, printing constrained reads
-    for line in open(reads_file):
-        if line[0] == '>':
-            header = line[1:].rstrip()
-            if constraints.has_key(header):
-                c = constraints[header]
-                seed_reads[c] += 1
-            else:
-                c = -1
-                
-        if c != -1:
-            seed_read_files[c].write(line)
-            if soft_assign:
-                if line[0] == '>':
-                    build_files[c].write('>1.0;%s' % line[1:])
-                else:
-                    build_files[c].write(line)
+def constraint_seed(cat, k, constraints, soft_assign):
+    # assign constrained reads
+    assign = -np.ones(cat.num_reads, dtype=int)
+    headers = cat.headers()
+    for i in range(cat.num_reads):
+        if constraints.has_key(headers[i]):
+            assign[i] = constraints[headers[i]]
 
-    # close files
-    for c in range(k):
-        seed_read_files[c].close()
-        if soft_assign:
-            build_files[c].close()
-    
     # check seeds all > 0
+    seed_reads = np.bincount(assign[assign != -1], minlength=k)
     for c in range(k):
         if seed_reads[c] == 0:
             print 'Cluster %d has no seed reads.  Try a different initialization method.' % c
             exit()        
 
+    if soft_assign:
+        return (assign, one_hot(assign, k))
+    else:
+        return (assign, None)
+
 
 ############################################################
 # verify_constraints
 #
 # My constraints map reads to certain cluster #'s so I may
-# need to swap some files if the initial clusters are
-# given.
+# need to renumber some clusters if the initial clusters
+# are given.
 ############################################################
-def verify_constraints(k, constraints):
-    cluster_map = {}    
-    for c in range(k):
-        for line in open('cluster-%d.fa' % c):
-            if line[0] == '>':
-                header = line[1:].rstrip()
-
-                # if read is constrainted
-                if constraints.has_key(header):
-                    # either initialize cluster map
-                    if not cluster_map.has_key(c):
-                        cluster_map[c] = constraints[header]
-
-                    # or verify that it matches
-                    else:
-                        if cluster_map[c] != constraints[header]:
-                            print 'Inconsistent constraints: cluster %d' % c
-                            exit()
+def verify_constraints(cat, k, assign, read_probs, constraints):
+    cluster_map = {}
+    headers = cat.headers()
+    for i in range(cat.num_reads):
+        header = headers[i]
+        c = assign[i]
+
+        # if read is constrainted
+        if c != -1 and constraints.has_key(header):
+            # either initialize cluster map
+            if not cluster_map.has_key(c):
+                cluster_map[c] = constraints[header]
+
+            # or verify that it matches
+            else:
+                if cluster_map[c] != constraints[header]:
+                    print 'Inconsistent constraints: cluster %d' % c
+                    exit()
 
     # handle unconstrained clusters
     # by finding clusters that aren't mapped to
@@ -541,23 +928,28 @@ def verify_constraints(k, constraints):
             cluster_map[c] = open_clusters[i]
             i += 1
 
-    # move clusters to their matching constraint number
-    for c in range(k):
-        os.rename('cluster-%d.fa'%c, 'cluster-%d.tmp.fa'%cluster_map[c])
-    for c in range(k):
-        os.rename('cluster-%d.tmp.fa'%c, 'cluster-%d.fa'%c)
+    # renumber clusters to their matching constraint number
+    new_c = np.array([cluster_map[c] for c in range(k)] + [-1])
+    assign = new_c[assign]
+    if read_probs is not None:
+        new_probs = np.empty(read_probs.shape)
+        new_probs[:,new_c[:k]] = read_probs
+        read_probs = new_probs
+
+    return (assign, read_probs)
 
 
 ############################################################
 # filter_empty
 #
-# Filter out empty cluster files
+# Filter out empty clusters
 ############################################################
-def filter_empty(k, priors, constraints):
+def filter_empty(k, priors, assign, read_probs, constraints, counts):
     # find empty clusters
+    cluster_reads = np.bincount(assign[assign != -1], minlength=k)
     empty = []
     for c in range(k):
-        if os.path.getsize('cluster-%d.fa' % c) == 0:
+        if cluster_reads[c] == 0:
             empty.append(c)
 
     while empty:
@@ -567,18 +959,32 @@ def filter_empty(k, priors, constraints):
 
         # rename all following clusters by 1, update priors
         if c+1 >= k:
-            os.remove('cluster-%d.fa'%c)
             os.remove('cluster-%d.icm'%c)
-            os.remove('icm-%d.scores.tmp'%c)
+            os.remove('cluster-%d.scores'%c)
+            for f in ['cluster-%d.counts'%c, 'cluster-%d.mm'%c]:
+                if os.path.isfile(f):
+                    os.remove(f)
         else:
             for i in range(c+1,k):
-                os.rename('cluster-%d.fa'%i, 'cluster-%d.fa'%(i-1))
                 os.rename('cluster-%d.icm'%i, 'cluster-%d.icm'%(i-1))
-                os.rename('icm-%d.scores.tmp'%i, 'icm-%d.scores.tmp'%(i-1))
-                if os.path.isfile('cluster-%d.max' % i):
-                    os.rename('cluster-%d.max'%i, 'cluster-%d.max'%(i-1))
+                os.rename('cluster-%d.scores'%i, 'cluster-%d.scores'%(i-1))
+                for f in ['cluster-%d.counts', 'cluster-%d.mm']:
+                    if os.path.isfile(f%i):
+                        os.rename(f%i, f%(i-1))
                 priors[i-1] = priors[i]
 
+        # cluster files are rewritten from the assignment
+        for f in ['cluster-%d.fa'%(k-1), 'cluster-%d.build.fa'%(k-1)]:
+            if os.path.isfile(f):
+                os.remove(f)
+
+        # update assignments
+        assign[assign > c] -= 1
+        if read_probs is not None:
+            read_probs = np.delete(read_probs, c, axis=1)
+        if counts is not None:
+            counts.drop_cluster(c)
+
         # update constraints
         for r in constraints:
             if constraints[r] > c:
@@ -596,7 +1002,109 @@ def filter_empty(k, priors, constraints):
     sp = sum(priors)
     priors = [p/sp for p in priors]
 
-    return (k,priors)
+    return (k,priors,assign,read_probs)
+
+############################################################
+# save_checkpoint
+#
+# Save the state at the end of an iteration to
+# checkpoint_file, replacing the last one atomically.  The
+# IMMs are not saved, since the next iteration retrains
+# them from the assignment anyway.  Probabilities are saved
+# as float32.  The best partition so far is not saved again
+# while it is the current one; otherwise it is saved in its
+# own file, named by its version, once per version, and
+# older ones are removed once the state refers to it.
+############################################################
+def save_checkpoint(iter, k, priors, assign, read_probs, converged, good_prog, prog, sample=None):
+    max_file = None
+    if prog.max_assign is not None and not prog.max_current:
+        max_file = checkpoint_max_file(prog.max_version)
+        if not os.path.isfile(max_file):
+            atomic_savez(max_file, prog.max_state())
+
+    state = prog.state()
+    if sample:
+        state.update(sample.state())
+    state['iter'] = iter
+    state['k'] = k
+    state['priors'] = np.array(priors)
+    state['assign'] = assign
+    if read_probs is not None:
+        state['read_probs'] = read_probs.astype('float32')
+    state['flags'] = np.array([converged, good_prog])
+    atomic_savez(checkpoint_file, state)
+
+    remove_checkpoint(keep=[checkpoint_file, max_file])
+
+############################################################
+# atomic_savez
+#
+# Save the dict of arrays to the .npz file, replacing any
+# old one atomically.
+############################################################
+def atomic_savez(npz_file, arrays):
+    tmp_file = '%s.%d.tmp.npz' % (npz_file[:-4], os.getpid())
+    np.savez(tmp_file, **arrays)
+    os.rename(tmp_file, npz_file)
+
+############################################################
+# checkpoint_max_file
+#
+# The file holding version 'version' of the best partition.
+############################################################
+def checkpoint_max_file(version):
+    return '%s.max%s.npz' % (checkpoint_file[:-4], version)
+
+############################################################
+# remove_checkpoint
+#
+# Remove the checkpoint and its best partition files, but
+# for those named in keep.
+############################################################
+def remove_checkpoint(keep=[]):
+    for f in [checkpoint_file] + glob.glob(checkpoint_max_file('*')):
+        if f not in keep and os.path.isfile(f):
+            os.remove(f)
+
+############################################################
+# load_checkpoint
+#
+# Load the state saved by save_checkpoint, checking that it
+# matches this run.
+############################################################
+def load_checkpoint(cat, mates, soft_assign):
+    num_reads = cat.num_reads
+    state = dict(np.load(checkpoint_file))
+    if len(state['assign']) != num_reads:
+        print 'ERROR: %s has %d reads, not %d' % (checkpoint_file, len(state['assign']), num_reads)
+        exit()
+    if state.has_key('read_probs') != soft_assign:
+        print 'ERROR: %s does not match the --em option' % checkpoint_file
+        exit()
+
+    iter = int(state['iter'])
+    k = int(state['k'])
+    (converged, good_prog) = [bool(f) for f in state['flags']]
+    read_probs = state.get('read_probs')
+    if read_probs is not None:
+        read_probs = read_probs.astype(float)
+
+    prog = Progress(k)
+    prog.restore(state)
+    if prog.max_current:
+        prog.restore_max({'max_assign':state['assign'].copy(), 'max_probs':read_probs})
+    elif prog.max_version > 0:
+        prog.restore_max(dict(np.load(checkpoint_max_file(prog.max_version))))
+
+    if state.has_key('sample_order'):
+        sample = ProgressiveSample([], state['assign'], mate_index(cat, mates))
+        sample.restore(state)
+    else:
+        sample = None
+
+    print 'Resuming after iter %d' % iter
+    return (iter, k, list(state['priors']), state['assign'], read_probs, converged, good_prog, prog, sample)
 
 ############################################################
 # load_mates
@@ -607,7 +1115,7 @@ def load_mates(matef):
     mates = {}
     if matef:
         for line in open(matef):
-            (r1,r2) = line.split('\t')
+            (r1,r2) = line.rstrip().split('\t')
             mates[r1] = {'mate':r2, 'cluster':-1, 'scores':[]}
             mates[r2] = {'mate':r1, 'cluster':-1, 'scores':[]}
     return mates
@@ -626,6 +1134,240 @@ def load_constraints(constrainf):
     return constraints
 
 
+############################################################
+# ICMCounts
+#
+# Remember the assignment that the IMM training counts in
+# cluster-#.counts were made from, each IMM's membership
+# fingerprint, and how many reads have moved in or out of
+# each cluster since its IMM was last trained from scratch.
+############################################################
+class ICMCounts:
+    def __init__(self):
+        self.clear()
+
+    ############################################################
+    # clear
+    #
+    # Forget the counts so that every IMM is next trained
+    # from scratch.
+    ############################################################
+    def clear(self):
+        self.assign = None
+        self.moved = []
+        self.prints = []
+        self.updated = False
+
+    ############################################################
+    # same_print
+    #
+    # Return True if cluster c's IMM was made from a training
+    # set with the given fingerprint and is still around.
+    ############################################################
+    def same_print(self, c, fp):
+        return c < len(self.prints) and self.prints[c] == fp and os.path.isfile('cluster-%d.icm' % c) and os.path.isfile('cluster-%d.scores' % c)
+
+    ############################################################
+    # changes
+    #
+    # Return the indexes of the reads that have joined and
+    # left cluster c since its counts were made, or
+    # (None,None) if it has no counts.
+    ############################################################
+    def changes(self, c, assign):
+        if self.assign is None or c >= len(self.moved) or not os.path.isfile('cluster-%d.counts' % c):
+            return (None, None)
+
+        joined = np.nonzero((assign == c) & (self.assign != c))[0]
+        left = np.nonzero((self.assign == c) & (assign != c))[0]
+        return (joined, left)
+
+    ############################################################
+    # drop_cluster
+    #
+    # Renumber the clusters after cluster c is removed.
+    ############################################################
+    def drop_cluster(self, c):
+        if self.assign is not None:
+            self.assign[self.assign == c] = -1
+            self.assign[self.assign > c] -= 1
+            del self.moved[c]
+            del self.prints[c]
+
+
+############################################################
+# LazyScores
+#
+# Choose the reads to rescore each iteration in --lazy mode.
+# After a full rescore, a read is rescored only if its best
+# cluster beat the runner-up by less than margin_t, or if
+# the reads of either cluster have changed by more than
+# lazy_change_t since the last full rescore.  All reads are
+# rescored every full_every iterations.
+############################################################
+class LazyScores:
+    def __init__(self, margin_t, full_every):
+        self.margin_t = margin_t
+        self.full_every = full_every
+        self.clear()
+
+    ############################################################
+    # clear
+    #
+    # Forget the margins so that all reads are next rescored.
+    ############################################################
+    def clear(self):
+        self.k = None
+        self.margins = None
+        self.stale = False
+
+    ############################################################
+    # active_reads
+    #
+    # Return the indexes of the reads to rescore with IMMs
+    # trained on 'assign', or None to rescore all reads.
+    ############################################################
+    def active_reads(self, iter, assign):
+        if self.margins is None or iter % self.full_every == 0:
+            self.full_assign = assign.copy()
+            self.stale = False
+            return None
+
+        # clusters whose reads have changed much
+        k = self.k
+        diff = (assign != self.full_assign)
+        moved = np.bincount(assign[diff & (assign != -1)], minlength=k)
+        moved += np.bincount(self.full_assign[diff & (self.full_assign != -1)], minlength=k)
+        sizes = np.bincount(assign[assign != -1], minlength=k)
+        changed = (moved > lazy_change_t*sizes)
+
+        active = (self.margins < self.margin_t) | changed[self.best] | changed[self.second]
+        active |= active[self.mate_i]
+
+        self.stale = not active.all()
+        return np.nonzero(active)[0]
+
+    ############################################################
+    # update
+    #
+    # Record each read's best and runner-up clusters and the
+    # margin between them, given ReadProbs and priors.
+    ############################################################
+    def update(self, rp, priors):
+        self.k = len(priors)
+        self.mate_i = rp.mate_i
+        if self.k == 1:
+            self.best = self.second = np.zeros(len(rp.scores), dtype=int)
+            self.margins = np.zeros(len(rp.scores))
+            return
+
+        read_scores = rp.scores + np.log(priors)
+        top2 = np.argsort(read_scores, axis=1)[:,-2:]
+        self.best = top2[:,1]
+        self.second = top2[:,0]
+        rows = np.arange(len(read_scores))
+        self.margins = read_scores[rows,self.best] - read_scores[rows,self.second]
+
+
+############################################################
+# ProgressiveSample
+#
+# Choose the growing random samples of the clustered reads
+# that the first iterations run on in --progressive mode.
+# The sample starts as the given fraction of the reads and
+# grows to the next fraction when the iterations on it
+# converge or stall, or after stage_max_iter of them, ending
+# with all reads.  Each initial cluster is sampled
+# separately, so none starts empty.  Mates are sampled
+# together, and reads outside the sample are assigned -1.
+############################################################
+class ProgressiveSample:
+    def __init__(self, fractions, assign, mate_i):
+        self.fractions = sorted([f for f in fractions if f < 1]) + [1.0]
+        self.order = np.random.permutation(np.nonzero(assign != -1)[0])
+        self.strata = assign[self.order]
+        self.mate_i = mate_i
+        self.stage = 0
+        self.start_iter = 0
+        self.advancing = False
+
+        self.mask = self.stage_mask()
+        assign[~self.mask] = -1
+
+    ############################################################
+    # stage_mask
+    #
+    # Return the mask of the reads sampled at this stage: the
+    # fraction of each initial cluster's reads first in the
+    # random order, but at least stage_min_reads of them (or
+    # all, if fewer), and their mates.
+    ############################################################
+    def stage_mask(self):
+        sizes = np.bincount(self.strata)
+        quotas = np.maximum(np.ceil(self.fractions[self.stage]*sizes), np.minimum(sizes, stage_min_reads))
+
+        # rank of each read in its cluster's order
+        ranks = np.zeros(len(self.order), dtype=int)
+        for c in np.nonzero(sizes)[0]:
+            stratum = np.nonzero(self.strata == c)[0]
+            ranks[stratum] = np.arange(len(stratum))
+
+        clustered = np.zeros(len(self.mate_i), dtype=bool)
+        clustered[self.order] = True
+        mask = np.zeros(len(self.mate_i), dtype=bool)
+        mask[self.order[ranks < quotas[self.strata]]] = True
+        return (mask | mask[self.mate_i]) & clustered
+
+    ############################################################
+    # full
+    #
+    # Return True if all reads are sampled.
+    ############################################################
+    def full(self):
+        return self.stage == len(self.fractions)-1
+
+    ############################################################
+    # advance
+    #
+    # Grow the sample to the next fraction, marking the new
+    # reads as clustered (in cluster 0 until they are
+    # reassigned from their scores).
+    ############################################################
+    def advance(self, iter, assign):
+        self.stage += 1
+        self.start_iter = iter
+        self.advancing = False
+
+        new_mask = self.stage_mask() & ~self.mask
+        assign[new_mask] = 0
+        self.mask |= new_mask
+
+    ############################################################
+    # state
+    #
+    # Return the sample as a dict of arrays to save.
+    ############################################################
+    def state(self):
+        return {'sample_fractions': np.array(self.fractions),
+                'sample_order': self.order,
+                'sample_strata': self.strata,
+                'sample_mask': self.mask,
+                'sample_stage': np.array([self.stage, self.start_iter, self.advancing])}
+
+    ############################################################
+    # restore
+    #
+    # Set the sample from a dict made by state.
+    ############################################################
+    def restore(self, state):
+        self.fractions = list(state['sample_fractions'])
+        self.order = state['sample_order']
+        self.strata = state['sample_strata']
+        self.mask = state['sample_mask']
+        [self.stage, self.start_iter, self.advancing] = [int(x) for x in state['sample_stage']]
+        self.advancing = bool(self.advancing)
+
+
 ############################################################
 # Progress
 #
@@ -637,8 +1379,13 @@ class Progress:
         self.max_like = ''
         self.like_decr = 0
         self.k = k
+        self.max_k = None
+        self.max_assign = None
+        self.max_probs = None
+        self.max_version = 0
+        self.max_current = False
 
-    def assess(self,like,k):
+    def assess(self, like, k, assign, read_probs):
         self.k = k
 
         # compare to last likelihood
@@ -651,15 +1398,72 @@ class Progress:
         self.last_like = like
 
         # compare to max likelihood
+        self.max_current = False
         if not self.max_like or like > self.max_like:
             # save current as max
-            for i in range(self.k):
-                shutil.copy('cluster-%d.fa'%i, 'cluster-%d.max'%i)
+            self.max_k = k
+            self.max_version += 1
+            self.max_current = True
+            self.max_assign = assign.copy()
+            if read_probs is None:
+                self.max_probs = None
+            else:
+                self.max_probs = read_probs.copy()
 
         if self.like_decr >= like_decrease_t:
             return False
         else:
             return True
+
+    ############################################################
+    # state
+    #
+    # Return the progress, but for the best partition, as a
+    # dict of arrays to save, with nan standing in for unset
+    # likelihoods.  max_current marks that the best partition
+    # is the current one.
+    ############################################################
+    def state(self):
+        likes = [self.last_like, self.max_like]
+        return {'prog_likes': np.array([l if l != '' else np.nan for l in likes]),
+                'prog_counts': np.array([self.like_decr, -1 if self.max_k is None else self.max_k, self.max_version, self.max_current])}
+
+    ############################################################
+    # max_state
+    #
+    # Return the best partition as a dict of arrays to save,
+    # its probabilities as float32.  It changes only when
+    # max_version does.
+    ############################################################
+    def max_state(self):
+        state = {'max_assign': self.max_assign}
+        if self.max_probs is not None:
+            state['max_probs'] = self.max_probs.astype('float32')
+        return state
+
+    ############################################################
+    # restore
+    #
+    # Set the progress from a dict made by state.
+    ############################################################
+    def restore(self, state):
+        [self.last_like, self.max_like] = [l if not np.isnan(l) else '' for l in state['prog_likes']]
+        [self.like_decr, self.max_k, self.max_version, self.max_current] = [int(c) for c in state['prog_counts']]
+        self.max_current = bool(self.max_current)
+        if self.max_k == -1:
+            self.max_k = None
+
+    ############################################################
+    # restore_max
+    #
+    # Set the best partition from a dict made by max_state.
+    ############################################################
+    def restore_max(self, state):
+        self.max_assign = state['max_assign']
+        self.max_probs = state.get('max_probs')
+        if self.max_probs is not None:
+            # a copy, even if already float64
+            self.max_probs = self.max_probs.astype(float)
         
 ############################################################
 # __main__
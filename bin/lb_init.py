@@ -1,8 +1,8 @@
 #!/usr/bin/env python
 
 from optparse import OptionParser
-import os, glob, util, subprocess, sys, pdb
-import imm_cluster, dna
+import os, glob, util, sys, pdb
+import imm_cluster, dna, catalog
 
 ############################################################
 # lb_init.py
@@ -24,42 +24,52 @@ def main():
     parser.add_option('-k', dest='k', type='int', help='Number of clusters')
     parser.add_option('-o', dest='order', type='int', help='Order of Markov model')
     parser.add_option('-p', dest='proc', type='int', help='Number of processes to run')
+    parser.add_option('--seed_sample', dest='seed_sample', type='float', help='Score only this fixed random fraction of the reads with the initial IMMs')
+    parser.add_option('--sampled', dest='sampled', action='store_true', default=False, help='The reads are already sampled to sample.fa')
+    parser.add_option('--partition_only', dest='partition_only', action='store_true', default=False, help='Stop after writing the initial partition, leaving the IMMs to the caller')
     parser.add_option('--em', dest='soft_assign', action='store_true', default=False, help='Use a soft assignment of reads to clusters')
 
     (options, args) = parser.parse_args()
 
+    util.start_jobserver(options.proc)
+
     if options.soft_assign:
-        em = '--em'
+        em = ['--em']
+    else:
+        em = []
+
+    if options.seed_sample:
+        sample_args = ['--seed_sample', str(options.seed_sample)]
     else:
-        em = ''
+        sample_args = []
 
     # randomly sample reads
-    total_reads = 0
-    for line in open(options.readsf):
-        if line[0] == '>':
-            total_reads += 1
-    if options.numreads and options.numreads < total_reads:
-        dna.fasta_rand_big(options.numreads, options.readsf, 'sample.fa')
+    cat = catalog.load(options.readsf)
+    if options.sampled:
+        pass
+    elif options.numreads and options.numreads < cat.num_reads:
+        dna.fasta_rand_big(options.numreads, options.readsf, 'sample.fa', cat)
     else:
         if os.path.isfile('sample.fa') or os.path.islink('sample.fa'):
             os.remove('sample.fa')
         os.symlink(options.readsf, 'sample.fa')
 
     # LikelyBin
-    p = subprocess.Popen('%s/mcmc.pl sample.fa -num_sources %d -chain_order %d -num_threads %d &> lb.log' % (bin_dir,options.k, options.order, options.proc), shell=True)
-    os.waitpid(p.pid, 0)
+    mcmc = util.Job(['%s/mcmc.pl' % bin_dir, 'sample.fa', '-num_sources', str(options.k), '-chain_order', str(options.order), '-num_threads', str(options.proc)], stdout='lb.log', stderr='lb.log', slots=options.proc)
+    util.run_jobs([mcmc], 1, fail_fast=False)
 
     if os.path.isfile('sample.fa.binning.allprobs') and os.path.getsize('sample.fa.binning.allprobs') > 0:
 
         # initialize clusters
-        init_clusters(options.readsf, options.soft_assign)
+        init_clusters(cat, options.soft_assign)
         
         # check for k clusters
         new_k = drop_empty(options.k, options.soft_assign)
     
         # run seed_only
-        p = subprocess.Popen('%s/imm_cluster.py -k %d -r %s -p %d -s --seed_only %s >> lb.log' % (bin_dir, new_k, options.readsf, options.proc, em), shell=True)
-        os.waitpid(p.pid, 0)
+        if not options.partition_only:
+            immc = util.Job(['%s/imm_cluster.py' % bin_dir, '-k', str(new_k), '-r', options.readsf, '-p', str(options.proc), '-s', '--seed_only'] + em + sample_args, stdout='lb.log', append=True)
+            util.run_jobs([immc], 1)
 
 
 ############################################################
@@ -68,7 +78,7 @@ def main():
 # Convert LikelyBin output to an initial partitioning of
 # reads for imm_cluster
 ############################################################
-def init_clusters(readsf, soft_assign):
+def init_clusters(cat, soft_assign):
     # load_mates
     mates = {}
     #if matesf:   ... just in case I need this later ...
@@ -125,46 +135,29 @@ def init_clusters(readsf, soft_assign):
                         if r != m:
                             soft_clusters[m].append((i,prob))
 
-    chunk_size = 50
-    chunk_i = 0
-    while chunk_i*chunk_size < k:
-        # open files
-        init_files = {}
-        build_files = {}
-        for c in range(chunk_i*chunk_size, min(k, (chunk_i+1)*chunk_size)):
-            init_files[c] = open('cluster-%d.fa' % c, 'w')
+    # collect cluster reads in file order
+    hard_reads = [[] for c in range(k)]
+    soft_reads = [[] for c in range(k)]
+    soft_probs = [[] for c in range(k)]
+    headers = cat.headers()
+    for i in range(cat.num_reads):
+        r = headers[i].strip()  # front spaces are removed by LikelyBin
+        if hard_clusters.has_key(r):
+            hard_reads[hard_clusters[r]].append(i)
             if soft_assign:
-                build_files[c] = open('cluster-%d.build.fa' % c, 'w')
-
-        # read fasta to cluster-*.fa
-        for line in open(readsf):
-            if line[0] == '>':
-                r = line[1:].strip()  # front spaces are removed by LikelyBin
-                if hard_clusters.has_key(r):
-                    hc = hard_clusters[r]
-                    if init_files.has_key(hc):
-                        init_files[hc].write(line)
-                        if soft_assign:
-                            for (sc,p) in soft_clusters[r]:
-                                build_files[sc].write('>%f;%s' % (p,line[1:]))
-                else:
-                    hc = -1
-
-            elif hc != -1:
-                if init_files.has_key(hc):
-                    init_files[hc].write(line)
-                    if soft_assign:
-                        for (sc,p) in soft_clusters[r]:
-                            build_files[sc].write(line)
-
-        # close files
-        for c in init_files:
-            init_files[c].close()
-            if soft_assign:
-                build_files[c].close()
-
-        # increment
-        chunk_i += 1
+                for (sc,p) in soft_clusters[r]:
+                    soft_reads[sc].append(i)
+                    soft_probs[sc].append(p)
+
+    # write cluster-*.fa
+    for c in range(k):
+        init_file = open('cluster-%d.fa' % c, 'w')
+        cat.write_reads(init_file, hard_reads[c])
+        init_file.close()
+        if soft_assign:
+            build_file = open('cluster-%d.build.fa' % c, 'w')
+            cat.write_reads(build_file, soft_reads[c], soft_probs[c])
+            build_file.close()
 
 
 ############################################################
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+import numpy as np
+
+############################################################
+# pca.py
+#
+# Principal component scores of a data matrix that is only
+# ever read in blocks of rows, so that it may be a memmap
+# of a file larger than memory, and the memory used stays
+# O(rows * components + block * cols + cols^2).  Small
+# matrices get an exact eigendecomposition of their
+# covariance; large ones a randomized SVD (Halko, Martinsson
+# and Tropp 2011).  Both make a few passes over the blocks.
+############################################################
+
+# rows per block
+block_rows = 10000
+
+# matrices with at most this many rows get an exact PCA
+exact_max_rows = 20000
+
+# extra random directions sampled beyond the components
+oversample = 10
+
+# power iterations to sharpen the sampled range
+power_iters = 4
+
+# seed of the random directions, so results are repeatable
+rand_seed = 1
+
+############################################################
+# pca
+#
+# Return the num_pc principal component scores of the rows
+# of X, an array or memmap, optionally restricted to the
+# given rows.
+############################################################
+def pca(X, num_pc, rows=None):
+    blocks = array_blocks(X, rows)
+    if rows is None:
+        num_rows = len(X)
+    else:
+        num_rows = len(rows)
+
+    if num_rows <= exact_max_rows:
+        return exact_pca(blocks, num_pc)
+    else:
+        return randomized_pca(blocks, num_pc)
+
+
+############################################################
+# array_blocks
+#
+# Return a function that iterates over blocks of the given
+# rows of X (all of them by default), each time it's called.
+############################################################
+def array_blocks(X, rows=None):
+    def blocks():
+        if rows is None:
+            for start in range(0, len(X), block_rows):
+                yield X[start:start+block_rows]
+        else:
+            for start in range(0, len(rows), block_rows):
+                yield X[rows[start:start+block_rows]]
+    return blocks
+
+
+############################################################
+# exact_pca
+#
+# Return the num_pc principal component scores of the matrix
+# whose row blocks are iterated by calling blocks(), from
+# the top eigenvectors of its covariance, which is summed
+# over the blocks after a first pass finds the means.
+############################################################
+def exact_pca(blocks, num_pc):
+    col_sums = 0
+    num_rows = 0
+    for Xb in blocks():
+        col_sums = col_sums + Xb.sum(axis=0)
+        num_rows += len(Xb)
+    mu = col_sums / float(num_rows)
+
+    C = 0
+    for Xb in blocks():
+        Xbc = Xb - mu
+        C = C + np.dot(Xbc.T, Xbc)
+    (E, V) = np.linalg.eigh(C)
+    V = V[:,::-1][:,:num_pc]
+
+    return centered_dot(blocks, mu, V)
+
+
+############################################################
+# randomized_pca
+#
+# Return the num_pc principal component scores of the matrix
+# whose row blocks are iterated by calling blocks().  The
+# centered matrix Xc is never formed: products with it are
+# taken as products with X corrected by the column means.
+############################################################
+def randomized_pca(blocks, num_pc):
+    # sample the range of X, and find the column means
+    Omega = None
+    Y = []
+    col_sums = 0
+    num_rows = 0
+    for Xb in blocks():
+        if Omega is None:
+            num_cols = Xb.shape[1]
+            l = min(num_pc + oversample, num_cols)
+            Omega = np.random.RandomState(rand_seed).randn(num_cols, l)
+        Y.append(np.dot(Xb, Omega))
+        col_sums = col_sums + Xb.sum(axis=0)
+        num_rows += len(Xb)
+    mu = col_sums / float(num_rows)
+    Y = np.vstack(Y) - np.dot(mu, Omega)
+    Q = np.linalg.qr(Y)[0]
+
+    # power iterations
+    for i in range(power_iters):
+        Z = np.linalg.qr(centered_tdot(blocks, mu, Q))[0]
+        Q = np.linalg.qr(centered_dot(blocks, mu, Z))[0]
+
+    # SVD of the projection of Xc onto the sampled range
+    B = centered_tdot(blocks, mu, Q).T
+    (Ub, S, Vt) = np.linalg.svd(B, full_matrices=False)
+    return np.dot(Q, Ub[:,:num_pc]) * S[:num_pc]
+
+
+############################################################
+# centered_dot
+#
+# Return Xc * Z, one block of rows at a time.
+############################################################
+def centered_dot(blocks, mu, Z):
+    muZ = np.dot(mu, Z)
+    return np.vstack([np.dot(Xb, Z) - muZ for Xb in blocks()])
+
+
+############################################################
+# centered_tdot
+#
+# Return Xc' * Q, accumulated over blocks of rows.
+############################################################
+def centered_tdot(blocks, mu, Q):
+    XtQ = 0
+    start = 0
+    for Xb in blocks():
+        XtQ = XtQ + np.dot(Xb.T, Q[start:start+len(Xb)])
+        start += len(Xb)
+    return XtQ - np.outer(mu, Q.sum(axis=0))
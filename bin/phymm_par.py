@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 from optparse import OptionParser, SUPPRESS_HELP
-import os, random, subprocess, time, sys
+import os, random, sys
+import util
 
 ################################################################################
 # phymm_par.py
@@ -32,6 +33,8 @@ def main():
 
     (options,args) = parser.parse_args()
 
+    util.start_jobserver(options.proc)
+
     if len(args) != 1 or not os.path.isfile(args[0]):
         parser.error('Please provide sequence fasta file')
     else:
@@ -55,7 +58,7 @@ def main():
             (cmds,pids) = build_cmds_imm(seqsf, options.ignore_file, icms, options)
 
         # execute commands in parallel
-        exec_par(cmds, options.proc)
+        util.run_jobs([util.Job(cmd) for cmd in cmds], options.proc)
 
         # combine results
         combine_imm(seqsf, pids, origdir)
@@ -74,7 +77,7 @@ def main():
             (cmds,pids) = build_cmds_seq(seqsf, options.ignore_file, icms, options)
 
         # execute commands in parallel
-        exec_par(cmds, options.proc)
+        util.run_jobs([util.Job(cmd) for cmd in cmds], options.proc)
         
         # combine results
         combine_seq(seqsf, pids, origdir)
@@ -83,44 +86,6 @@ def main():
         clean(seqsf, pids)
 
 
-############################################################
-# exec_par
-#
-# Execute the commands in the list 'cmds' in parallel, but
-# only running 'max_proc' at a time.
-############################################################
-def exec_par(cmds, max_proc):
-    total = len(cmds)
-    finished = 0
-    running = 0
-    p = []
-
-    while finished + running < total:
-        # launch jobs up to max
-        while running < max_proc and finished+running < total:
-            p.append(subprocess.Popen(cmds[finished+running], shell=True))
-            #print 'Running %d' % p[running].pid
-            running += 1
-
-        # are any jobs finished
-        new_p = []
-        for i in range(len(p)):
-            if p[i].poll() != None:
-                running -= 1
-                finished += 1
-            else:
-                new_p.append(p[i])
-
-        # if none finished, sleep
-        if len(new_p) == len(p):
-            time.sleep(1)
-        p = new_p
-
-    # wait for all to finish
-    for i in range(len(p)):
-        p[i].wait()
-
-
 ############################################################
 # max_i
 #
@@ -145,14 +110,11 @@ def max_i(lis):
 ################################################################################
 def build_cmds_imm(seqsf, ignoref, icms, options):
     # options
+    phymm_opts = []
     if options.no_blast:
-        dash_b = '-b'
-    else:
-        dash_b = ''
+        phymm_opts.append('-b')
     if options.chr_only:
-        dash_c = '-c'
-    else:
-        dash_c = ''
+        phymm_opts.append('-c')
 
     # ignored ICMs
     ignored_icms = set()
@@ -164,8 +126,7 @@ def build_cmds_imm(seqsf, ignoref, icms, options):
     (prefix,suffix) = os.path.splitext(seqsf)
     rc_seqsf = prefix + '.revComp' + suffix
     if not os.path.isfile(rc_seqsf):
-        p = subprocess.Popen('.scripts/revCompFASTA.pl %s' % seqsf, shell=True)
-        os.waitpid(p.pid, 0)
+        util.run_jobs([util.Job(['.scripts/revCompFASTA.pl', seqsf])], 1)
 
     # work out ICM ranges
     icms_per = len(icms) / options.proc
@@ -195,7 +156,7 @@ def build_cmds_imm(seqsf, ignoref, icms, options):
         print >> ignore_out, '\n'.join(ignore_icms)
         ignore_out.close()
 
-        cmds.append('%s/scoreReadsScimm.pl seqs_%d.fa %s %s -i ignore_%d.txt' % (bin_dir,pids[p],dash_b,dash_c,pids[p]))
+        cmds.append(['%s/scoreReadsScimm.pl' % bin_dir, 'seqs_%d.fa' % pids[p]] + phymm_opts + ['-i', 'ignore_%d.txt' % pids[p]])
 
     return (cmds,pids)
 
@@ -209,14 +170,11 @@ def build_cmds_imm(seqsf, ignoref, icms, options):
 ################################################################################
 def build_cmds_seq(seqsf, ignoref, icms, options):
     # options
+    phymm_opts = []
     if options.no_blast:
-        dash_b = '-b'
-    else:
-        dash_b = ''
+        phymm_opts.append('-b')
     if options.chr_only:
-        dash_c = '-c'
-    else:
-        dash_c = ''
+        phymm_opts.append('-c')
 
     # count sequences
     num_seqs = 0
@@ -256,7 +214,7 @@ def build_cmds_seq(seqsf, ignoref, icms, options):
 
     cmds = []
     for p in range(options.proc):
-        cmds.append('%s/scoreReadsScimm.pl seqs_%d.fa %s %s' % (bin_dir,pids[p],dash_b,dash_c))
+        cmds.append(['%s/scoreReadsScimm.pl' % bin_dir, 'seqs_%d.fa' % pids[p]] + phymm_opts)
 
     return cmds, pids
 
@@ -269,7 +227,7 @@ def build_condor_cmds(tmp_cmds):
     cmds = []
 
     for tcmd in tmp_cmds:
-        cmds.append('runCmd -c "%s"' % tcmd)
+        cmds.append(['runCmd', '-c', ' '.join(tcmd)])
 
     return cmds
 
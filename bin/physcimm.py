@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 from optparse import OptionParser, SUPPRESS_HELP
-import os, glob, subprocess, math, random, sys
-import scimm, util, dna
+import os, glob, math, random, sys
+import scimm, util, dna, catalog
 
 ############################################################
 # physcimm.py
@@ -43,18 +43,21 @@ def main():
 
     (options, args) = parser.parse_args()
 
-    # check data
-    data_integrity(options.readsf)
-    
+    util.start_jobserver(options.proc)
+
     # make robust to directory changes
     options.readsf = os.path.abspath(options.readsf)
+
+    # index and check data
+    cat = catalog.load(options.readsf)
+    data_integrity(cat)
     if options.ignore:
         options.ignore = os.path.abspath(options.ignore)    
 
     if options.soft_assign:
-        em = '--em'
+        em = ['--em']
     else:
-        em = ''
+        em = []
 
     if options.phymm_results_file:
         if not os.path.isfile('sample.fa') and not os.path.islink('sample.fa'):
@@ -64,24 +67,20 @@ def main():
 
     else:
         # randomly sample reads
-        total_reads = 0
-        for line in open(options.readsf):
-            if line[0] == '>':
-                total_reads += 1
-        if options.numreads and options.numreads < total_reads:
-            dna.fasta_rand_big(options.numreads, options.readsf, 'sample.fa')
+        if options.numreads and options.numreads < cat.num_reads:
+            dna.fasta_rand_big(options.numreads, options.readsf, 'sample.fa', cat)
         else:
             os.symlink(options.readsf, 'sample.fa')
 
         # classify
         if options.bc:
-            bc_str = '-b -c'
+            bc_args = ['-b', '-c']
             phymm_results_file = 'results.01.phymm_sample_fa.txt'
         else:
-            bc_str = ''
+            bc_args = []
             phymm_results_file = 'results.03.phymmBL_sample_fa.txt'
-        p = subprocess.Popen('%s/phymm_par.py -p %d %s sample.fa' % (bin_dir, options.proc,bc_str), shell=True)
-        os.waitpid(p.pid, 0)
+        phymm = util.Job(['%s/phymm_par.py' % bin_dir, '-p', str(options.proc)] + bc_args + ['sample.fa'])
+        util.run_jobs([phymm], 1)
 
     # determine minimum bp for cluster
     total_bp = 0
@@ -91,12 +90,12 @@ def main():
     minbp = options.minbp_pct*total_bp
 
     # initialize clusters
-    class_k = init_clusters(options.readsf, phymm_results_file, options.taxlevel, minbp, options.soft_assign)
+    class_k = init_clusters(cat, phymm_results_file, options.taxlevel, minbp, options.soft_assign)
 
     # run IMM clustering
     if not options.init:
-        p = subprocess.Popen('%s/imm_cluster.py -k %d -r %s -p %d -s %s &> immc.log' % (bin_dir, class_k, options.readsf, options.proc, em), shell=True)
-        os.waitpid(p.pid, 0)
+        immc = util.Job(['%s/imm_cluster.py' % bin_dir, '-k', str(class_k), '-r', options.readsf, '-p', str(options.proc), '-s'] + em, stdout='immc.log', stderr='immc.log')
+        util.run_jobs([immc], 1)
         
 
 
@@ -105,15 +104,14 @@ def main():
 #
 # Check for uniqueness of headers.
 ############################################################
-def data_integrity(readsf):
+def data_integrity(cat):
     reads = {}
-    for line in open(readsf):
-        if line[0] == '>':
-            r = line[1:].split()[0]
-            if reads.has_key(r):
-                print 'Sorry, Phymm only considers fasta headers up to the first whitespace.  Please make these unique in your file.  E.g. %s is not unique' % r
-                exit()
-            reads[r] = True
+    for header in cat.headers():
+        r = header.split()[0]
+        if reads.has_key(r):
+            print 'Sorry, Phymm only considers fasta headers up to the first whitespace.  Please make these unique in your file.  E.g. %s is not unique' % r
+            exit()
+        reads[r] = True
 
 
 ############################################################
@@ -122,23 +120,18 @@ def data_integrity(readsf):
 # Convert Phymm output to an initial partitioning of
 # reads for imm_cluster
 ############################################################
-def init_clusters(readsf, phymm_results_file, taxlevel, minbp, soft_assign):
+def init_clusters(cat, phymm_results_file, taxlevel, minbp, soft_assign):
     if open(phymm_results_file).readline().find('CONF') == -1:
         class2index = {'strain':1, 'species':1, 'genus':3, 'family':4, 'order':5, 'class':6, 'phylum':7}
     else:
         class2index = {'strain':1, 'species':1, 'genus':3, 'family':5, 'order':7, 'class':9, 'phylum':11}
     col = class2index[taxlevel.lower()]
 
-    # get read sizes and map between Phymm headers and true headers
-    readbp = {}
+    # map between Phymm headers and read indexes
     phymm2true = {}
-    for line in open(readsf):
-        if line[0] == '>':
-            header = line[1:].rstrip()
-            readbp[header] = 0
-            phymm2true[header.split()[0]] = header
-        else:
-            readbp[header] += len(line.rstrip())    
+    headers = cat.headers()
+    for i in range(cat.num_reads):
+        phymm2true[headers[i].split()[0]] = i
 
     # fill clusters with reads
     clusters = {}
@@ -149,14 +142,14 @@ def init_clusters(readsf, phymm_results_file, taxlevel, minbp, soft_assign):
 
         if a[0] != 'QUERY_ID' and a[col]: # some species are missing classifications
             if phymm2true.has_key(a[0]): # results file is allowed to have extra sequences
-                header = phymm2true[a[0]]
+                ri = phymm2true[a[0]]
 
                 if clusters.has_key(a[col]):
-                    clusters[a[col]].append(header)
-                    clustbp[a[col]] += readbp[header]
+                    clusters[a[col]].append(ri)
+                    clustbp[a[col]] += cat.lengths[ri]
                 else:
-                    clusters[a[col]] = [header]
-                    clustbp[a[col]] = readbp[header]
+                    clusters[a[col]] = [ri]
+                    clustbp[a[col]] = cat.lengths[ri]
 
     # extra cluster for deleted classes
     clusters['extra'] = []
@@ -182,42 +175,16 @@ def init_clusters(readsf, phymm_results_file, taxlevel, minbp, soft_assign):
     else:
         del clusters['extra']
 
-    # map reads -> clusters
-    read2cluster = {}
+    # write cluster-*.fa in file order
     for c in clusters:
-        for r in clusters[c]:
-            read2cluster[r] = clust_nums[c]
-
-    # open files
-    init_files = []
-    build_files = []
-    for i in range(len(clusters)):
-        init_files.append(open('cluster-%d.fa' % i, 'w'))
-        if soft_assign:
-            build_files.append(open('cluster-%d.build.fa' % i, 'w'))
-        
-    # read fasta to cluster-*.fa
-    for line in open(readsf):
-        if line[0] == '>':
-            r = line[1:].rstrip()
-            if read2cluster.has_key(r):
-                c = read2cluster[r]
-                init_files[c].write(line)
-                if soft_assign:
-                    build_files[c].write('>1.0;%s' % line[1:])
-            else:
-                c = -1
-
-        elif c != - 1:
-            init_files[c].write(line)
-            if soft_assign:
-                build_files[c].write(line)
-
-    # close files
-    for i in range(len(clusters)):
-        init_files[i].close()
+        cluster_reads = sorted(clusters[c])
+        init_file = open('cluster-%d.fa' % clust_nums[c], 'w')
+        cat.write_reads(init_file, cluster_reads)
+        init_file.close()
         if soft_assign:
-            build_files[i].close()
+            build_file = open('cluster-%d.build.fa' % clust_nums[c], 'w')
+            cat.write_reads(build_file, cluster_reads, [1.0]*len(cluster_reads))
+            build_file.close()
     
     return len(clusters)
 
@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 from optparse import OptionParser, SUPPRESS_HELP
-import os, glob, subprocess, sys, math, shutil
-import imm_cluster, util
+import os, glob, sys, math, shutil
+import numpy as np
+import imm_cluster, util, catalog, dna
 
 ############################################################
 # scimm.py
@@ -29,6 +30,8 @@ def main():
     parser.add_option('-s','-r', dest='readsf', help='Fasta file of sequences')
     parser.add_option('-k', dest='k', type='int', help='Number of clusters')
     parser.add_option('-p', dest='proc', type='int', default=2, help='Number of processes to run [Default=%default]')
+    parser.add_option('--halving', dest='halving', type='float', help='Compare starts on a fixed random HALVING fraction of the reads, keeping the better half of them as the sample doubles, so that only the best start scores all reads')
+    parser.add_option('--job_log', dest='job_log', help='Append the status, wall time, CPU time and peak memory of each job run to this file')
     # help='Use a soft assignment of reads to clusters [Default=%default]'
     parser.add_option('--em',dest='soft_assign', action='store_true', default=False, help=SUPPRESS_HELP)
 
@@ -47,80 +50,118 @@ def main():
     (options, args) = parser.parse_args()
 
     options.readsf = os.path.abspath(options.readsf)
+    if options.job_log:
+        os.environ['SCIMM_JOB_LOG'] = os.path.abspath(options.job_log)
+
+    # share proc CPUs among all jobs of the run
+    util.start_jobserver(options.proc)
+
+    # index reads once for all starts
+    cat = catalog.load(options.readsf)
 
     total_starts = options.lb_starts + options.cb_starts
 
     if options.soft_assign:
-        em = '--em'
+        em = ['--em']
+    else:
+        em = []
+
+    # score starts on a sample first
+    if options.halving and options.halving < 1:
+        sample = imm_cluster.fixed_sample(cat.num_reads, options.halving)
+    else:
+        sample = None
+
+    if options.lb_starts > 0 and options.lb_threads > options.proc:
+        print 'Cannot use more lb threads than processes'
+        exit()
+    if options.cb_starts > 0 and options.cb_threads > options.proc:
+        print 'Cannot use more cb threads than processes'
+        exit()
+
+    # make initial starts, each in a temp dir to compute in
+    starts = []
+    for i in range(total_starts):
+        temp_dir('tmp.start%d' % i)
+
+        # LikelyBin
+        if i < options.lb_starts:
+            starts.append(util.Job(['%s/lb_init.py' % bin_dir, '-r', options.readsf, '-n', str(options.lb_numreads), '-k', str(options.k), '-o', str(options.lb_order), '-p', str(options.lb_threads), '--sampled', '--partition_only'] + em, cwd='tmp.start%d' % i, slots=options.lb_threads))
+
+        # CompostBin
+        else:
+            starts.append(util.Job(['%s/cb_init.py' % bin_dir, '-r', options.readsf, '-n', str(options.cb_numreads), '-k', str(options.k), '-m', str(options.cb_mers), '-p', str(options.cb_threads), '--sampled', '--partition_only'] + em, cwd='tmp.start%d' % i, slots=options.cb_threads))
+
+    # sample reads for all starts in one pass
+    numreads = [options.lb_numreads]*options.lb_starts + [options.cb_numreads]*options.cb_starts
+    sample_starts(cat, numreads)
+
+    # run them as slots free up, tolerating failed starts.  With
+    # CPUs to spare, train and score each start's IMMs as it
+    # finishes, overlapping the starts still running, and take
+    # its entropy.  With one, nothing can overlap, so load each
+    # start's seed partition to score all their IMMs together
+    # in one pass over the reads.
+    if sample is None:
+        sample_args = []
     else:
-        em = ''
-
-    # run initial samples
-    i = 0
-    while i < total_starts:
-        p = []
-        j = 0
-        while j < options.proc and i < total_starts:
-            # LikelyBin
-            if i < options.lb_starts:
-                # double check processes
-                if j + options.lb_threads <= options.proc:
-                    # make a temp dir to compute in and cd to it
-                    temp_dir('tmp.start%d' % i)                    
-                    p.append(subprocess.Popen('%s/lb_init.py -r %s -n %d -k %d -o %d -p %d %s' % (bin_dir, options.readsf, options.lb_numreads, options.k, options.lb_order, options.lb_threads, em), shell=True))
-                    os.chdir('..')
-                    i += 1
-                elif j == 0:
-                    print 'Cannot use more lb threads than processes'
-                    exit()
-            
-                j += options.lb_threads  # even if not true, just move things along
-
-            # CompostBin
-            else:
-                # double check processes
-                if j + options.cb_threads <= options.proc:
-                    # make a temp dir to compute in and cd to it
-                    temp_dir('tmp.start%d' % i)
-                    p.append(subprocess.Popen('%s/cb_init.py -r %s -n %d -k %d -m %d -p %d %s' % (bin_dir, options.readsf, options.cb_numreads, options.k, options.cb_mers, options.cb_threads, em), shell=True))
-                    os.chdir('..')
-                    i += 1
-                elif j == 0:
-                    print 'Cannot use more cb threads than processes'
-                    exit()
-            
-                j += options.lb_threads  # even if not true, just move things along
-
-        # wait for processes to finish
-        for j in range(len(p)):
-            os.waitpid(p[j].pid, 0)
+        sample_args = ['--seed_sample', str(options.halving)]
+    seeds = {}
+    seed_jobs = {}
+    entropy = ['']*total_starts
+    def start_done(job):
+        if seed_jobs.has_key(job):
+            i = seed_jobs[job]
+            if job.status == 0:
+                entropy[i] = start_entropy('tmp.start%d' % i, options.readsf, options.k, options.soft_assign, sample)
+            return []
+
+        i = starts.index(job)
+        if options.proc > 1:
+            seed_job = seed_only_job('tmp.start%d' % i, options.readsf, options.k, job.slots, em + sample_args)
+            if seed_job:
+                seed_jobs[seed_job] = i
+                return [seed_job]
+        else:
+            seed = load_seeds('tmp.start%d' % i, cat, options.k, options.soft_assign)
+            if seed:
+                seeds[i] = seed
+        return []
+    util.run_jobs(starts, options.proc, fail_fast=False, done=start_done)
+
+    # train and score the loaded starts' IMMs together
+    if seeds:
+        seed_entropy = seed_starts(cat, seeds, total_starts, options.k, options.soft_assign, options.proc, sample)
+        for i in seeds:
+            entropy[i] = seed_entropy[i]
+
+    # prune starts on growing samples
+    if sample is not None:
+        halve_starts(cat, entropy, options.halving, options.k, options.soft_assign, options.proc)
 
     # choose best start
-    #maxlike_clusters(total_starts, options.readsf, options.k, options.soft_assign)    
-    minentropy_clusters(total_starts, options.readsf, options.k, options.soft_assign)    
+    minentropy_clusters(entropy)
 
     # in case k changed
     new_k = determine_k(options.soft_assign, options.k)
 
     # run imm clustering completely
-    p = subprocess.Popen('%s/imm_cluster.py -k %d -r %s -p %d -i --trained %s &> immc.log' % (bin_dir, new_k, options.readsf, options.proc, em), shell=True)
-    os.waitpid(p.pid, 0)
+    immc = util.Job(['%s/imm_cluster.py' % bin_dir, '-k', str(new_k), '-r', options.readsf, '-p', str(options.proc), '-i', '--trained'] + em, stdout='immc.log', stderr='immc.log')
+    util.run_jobs([immc], 1)
 
 
 ############################################################
 # temp_dir
 #
-# Create and change to a temporary directory to do initial
+# Create, or empty, a temporary directory to do initial
 # runs within
 ############################################################
 def temp_dir(tmpdir):
     if os.path.isdir(tmpdir):
-        os.chdir(tmpdir)
-        for f in glob.glob('*'):
+        for f in glob.glob('%s/*' % tmpdir):
             os.remove(f)
     else:
         os.mkdir(tmpdir)
-        os.chdir(tmpdir)
 
 
 ############################################################
@@ -151,7 +192,7 @@ def maxlike_clusters(total_starts, readsf, k, soft_assign):
     # get files from max
     for c in range(len(glob.glob('cluster-*.fa'))):
         shutil.copy('tmp.start%d/cluster-%d.fa' % (max_clust,c), 'cluster-%d.fa' % c)
-        shutil.copy('tmp.start%d/icm-%dscores.tmp' % (max_clust,c), 'icm-%dscores.tmp' % c)
+        shutil.copy('tmp.start%d/cluster-%d.scores' % (max_clust,c), 'cluster-%d.scores' % c)
 
 
 ############################################################
@@ -161,54 +202,226 @@ def maxlike_clusters(total_starts, readsf, k, soft_assign):
 ############################################################
 def scimm_like(readsf, k, soft_assign):
     new_k = determine_k(soft_assign, k)
-    priors = imm_cluster.update_priors([1.0/new_k]*new_k, readsf, {}, {}, soft_assign)
-    (likelihood,read_probs) = imm_cluster.get_read_probs(priors, {}, {}, soft_assign)
+    rp = imm_cluster.ReadProbs(new_k, catalog.load(readsf), {}, {})
+    priors = rp.update_priors([1.0/new_k]*new_k, soft_assign)
+    (likelihood,read_probs) = rp.get_read_probs(priors, soft_assign)
     return likelihood
 
 
 ############################################################
-# minentropy_clusters
+# start_entropy
 #
-# Copy the clustering with minimum entropy to the main
-# directory.
+# Return the entropy of the clusters of the start in
+# start_dir over the sample reads (or all), or '' if it
+# failed.
 ############################################################
-def minentropy_clusters(total_starts, readsf, k, soft_assign):
-    entropy = [0]*total_starts
-    for i in range(total_starts):
-        os.chdir('tmp.start%d' % i)
-        if len(glob.glob('cluster-*.fa')) > 0:
-            # determine likelihood
-            entropy[i] = get_entropy(readsf, k, soft_assign)
+def start_entropy(start_dir, readsf, k, soft_assign, sample=None):
+    os.chdir(start_dir)
+    if len(glob.glob('cluster-*.fa')) > 0:
+        entropy = get_entropy(readsf, k, soft_assign, sample)
+    else:
+        # something failed
+        entropy = ''
+    os.chdir('..')
+    return entropy
+
+
+############################################################
+# sample_starts
+#
+# Write a random sample of numreads[i] reads (or all) to
+# each start's sample.fa, reading the reads file once.
+############################################################
+def sample_starts(cat, numreads):
+    sample_nums = []
+    sample_files = []
+    for i in range(len(numreads)):
+        if numreads[i] and numreads[i] < cat.num_reads:
+            sample_nums.append(numreads[i])
+            sample_files.append('tmp.start%d/sample.fa' % i)
         else:
-            # something failed
+            os.symlink(cat.readsf, 'tmp.start%d/sample.fa' % i)
+
+    dna.fasta_rand_multi(sample_nums, cat.readsf, sample_files, cat=cat)
+
+
+############################################################
+# load_seeds
+#
+# Return the number of clusters, assignment array and, for
+# EM, probability matrix of the seed partition of the start
+# in start_dir, or None if it failed.
+############################################################
+def load_seeds(start_dir, cat, k, soft_assign):
+    os.chdir(start_dir)
+    new_k = determine_k(soft_assign, k)
+    if new_k > 0:
+        (assign, read_probs) = imm_cluster.load_partition(cat, new_k, soft_assign)
+        seed = (new_k, assign, read_probs)
+    else:
+        # something failed
+        seed = None
+    os.chdir('..')
+    return seed
+
+
+############################################################
+# seed_only_job
+#
+# Return a Job running imm_cluster --seed_only on the seed
+# partition of the start in start_dir, or None if it failed.
+############################################################
+def seed_only_job(start_dir, readsf, k, slots, args):
+    os.chdir(start_dir)
+    new_k = determine_k('--em' in args, k)
+    os.chdir('..')
+    if new_k == 0:
+        return None
+    return util.Job(['%s/imm_cluster.py' % bin_dir, '-k', str(new_k), '-r', readsf, '-p', str(slots), '-s', '--seed_only'] + args, stdout='immc.log', cwd=start_dir, slots=slots)
+
+
+############################################################
+# seed_starts
+#
+# Do what imm_cluster --seed_only does in each start's
+# directory, given the starts' seed partitions, but score
+# all starts' IMMs in one pass over the reads (or the
+# sample reads): train IMMs on the seeds, partition the
+# reads by their scores, then retrain and rescore on that
+# partition.  Return the entropy of each start, '' for
+# those that failed.
+############################################################
+def seed_starts(cat, seeds, total_starts, k, soft_assign, proc, sample=None):
+    starts = sorted(seeds.keys())
+
+    # train on seeds
+    for i in starts:
+        os.chdir('tmp.start%d' % i)
+        (new_k, assign, read_probs) = seeds[i]
+        imm_cluster.train_imm(cat, new_k, assign, read_probs, soft_assign, proc)
+        os.chdir('..')
+    score_starts(cat, starts, k, soft_assign, proc, sample)
+
+    # partition reads and train on the partition
+    for i in starts:
+        os.chdir('tmp.start%d' % i)
+        new_k = seeds[i][0]
+        (like, priors, assign, read_probs) = imm_cluster.seed_assign(cat, new_k, {}, {}, soft_assign, sample)
+        (new_k, priors, assign, read_probs) = imm_cluster.filter_empty(new_k, priors, assign, read_probs, {}, None)
+        imm_cluster.write_clusters(cat, new_k, assign, read_probs, soft_assign)
+        imm_cluster.train_imm(cat, new_k, assign, read_probs, soft_assign, proc)
+        os.chdir('..')
+    score_starts(cat, starts, k, soft_assign, proc, sample)
+
+    entropy = ['']*total_starts
+    for i in starts:
+        entropy[i] = start_entropy('tmp.start%d' % i, cat.readsf, k, soft_assign, sample)
+    return entropy
+
+
+############################################################
+# score_starts
+#
+# Score the reads (or the given reads) with the IMMs of all
+# the given starts in one pass.
+############################################################
+def score_starts(cat, starts, k, soft_assign, proc, reads=None):
+    icms = []
+    for i in starts:
+        os.chdir('tmp.start%d' % i)
+        new_k = determine_k(soft_assign, k)
+        os.chdir('..')
+        icms += ['tmp.start%d/cluster-%d.icm' % (i,c) for c in range(new_k)]
+    imm_cluster.score_icms(cat, icms, proc, reads)
+
+
+############################################################
+# halve_starts
+#
+# Successive halving of the starts scored on the sample of
+# the given fraction: drop the worse half by entropy, score
+# the survivors on a sample twice as big, and repeat until
+# the sample is all reads, going straight to it once a
+# single start is left.  The survivors then partition all
+# reads by their scores and, as --seed_only does, retrain
+# and rescore on that partition.  Dropped starts' entropy
+# is set to ''.
+############################################################
+def halve_starts(cat, entropy, fraction, k, soft_assign, proc):
+    survivors = [i for i in range(len(entropy)) if entropy[i] != '']
+    sample = imm_cluster.fixed_sample(cat.num_reads, fraction)
+
+    while survivors and fraction < 1:
+        # keep the better half
+        survivors.sort(key=lambda i: entropy[i])
+        for i in survivors[(len(survivors)+1)//2:]:
             entropy[i] = ''
+        survivors = survivors[:(len(survivors)+1)//2]
+
+        if len(survivors) == 1:
+            fraction = 1.0
+        else:
+            fraction = min(1.0, 2*fraction)
+        new_sample = imm_cluster.fixed_sample(cat.num_reads, fraction)
+        new_reads = np.setdiff1d(new_sample, sample)
+        sample = new_sample
+
+        # score the new reads
+        score_starts(cat, survivors, k, soft_assign, proc, new_reads)
+        for i in survivors:
+            entropy[i] = start_entropy('tmp.start%d' % i, cat.readsf, k, soft_assign, sample)
+
+    # partition all reads and retrain
+    for i in survivors:
+        os.chdir('tmp.start%d' % i)
+        new_k = determine_k(soft_assign, k)
+        rp = imm_cluster.ReadProbs(new_k, cat, {}, {})
+        priors = rp.update_priors([1.0/new_k]*new_k, soft_assign)
+        (like, read_probs) = rp.get_read_probs(priors, soft_assign)
+        imm_cluster.write_clusters(cat, new_k, rp.max_icms, read_probs, soft_assign)
+        imm_cluster.train_imm(cat, new_k, rp.max_icms, read_probs, soft_assign, proc)
         os.chdir('..')
+    score_starts(cat, survivors, k, soft_assign, proc)
 
+
+############################################################
+# minentropy_clusters
+#
+# Copy the clustering with minimum entropy, given the
+# entropy of each start, to the main directory.
+############################################################
+def minentropy_clusters(entropy):
     # find min entropy partitioning ('' is greater than numbers)
     (min_entropy, min_clust) = util.min_i(entropy)
 
     # get files from min
     for c in range(len(glob.glob('tmp.start%d/cluster-*.fa' % min_clust))):
         shutil.copy('tmp.start%d/cluster-%d.fa' % (min_clust,c), 'cluster-%d.fa' % c)
-        shutil.copy('tmp.start%d/icm-%d.scores.tmp' % (min_clust,c), 'icm-%d.scores.tmp' % c)
+        shutil.copy('tmp.start%d/cluster-%d.scores' % (min_clust,c), 'cluster-%d.scores' % c)
 
 
 ############################################################
 # get_entropy
 #
 # Return the entropy of the clusters in the current
-# directory.
+# directory, over the reads in the sample array if given.
 ############################################################
-def get_entropy(readsf, k, soft_assign):
+def get_entropy(readsf, k, soft_assign, sample=None):
     new_k = determine_k(soft_assign, k)
-    priors = imm_cluster.update_priors([1.0/new_k]*new_k, readsf, {}, {}, soft_assign)
-    (like, read_probs) = imm_cluster.get_read_probs(priors, {}, {}, soft_assign)
-
-    entropy = 0.0
-    for r in read_probs:
-        for c in range(len(read_probs[r])):
-            if read_probs[r][c] > 0:
-                entropy += -read_probs[r][c]*math.log(read_probs[r][c])
+    cat = catalog.load(readsf)
+    if sample is None:
+        rp = imm_cluster.ReadProbs(new_k, cat, {}, {})
+    else:
+        mask = np.zeros(cat.num_reads, dtype=bool)
+        mask[sample] = True
+        rp = imm_cluster.ReadProbs(new_k, cat, {}, {}, mask)
+    priors = rp.update_priors([1.0/new_k]*new_k, soft_assign)
+    (like, read_probs) = rp.get_read_probs(priors, soft_assign)
+
+    if sample is not None:
+        read_probs = read_probs[sample]
+    nz_probs = read_probs[read_probs > 0]
+    entropy = -np.dot(nz_probs, np.log(nz_probs))
 
     return entropy
 
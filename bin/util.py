@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-import operator, subprocess, time, math
+import operator, subprocess, time, math, os, sys, errno, tempfile, shutil, atexit, select, signal, fcntl
 
 ############################################################
 # util
@@ -8,42 +8,376 @@ import operator, subprocess, time, math
 #
 ############################################################
 
+# the process-wide JobServer, once started
+jobserver = None
+
+# pipe written to when a signal (e.g. SIGCHLD) arrives
+wakeup_fds = None
+
+############################################################
+# JobServer
+#
+# A budget of CPU slots shared by every process of a run,
+# in the manner of make's jobserver.  The process that
+# starts it creates a FIFO holding proc-1 tokens and names
+# it in $SCIMM_JOBSERVER; its descendants open the same
+# FIFO.  Each process owns the slots its parent acquired
+# for it ($SCIMM_SLOTS, 1 for the first process) and must
+# take a token from the FIFO for every further slot its
+# jobs occupy, returning it when the job exits.  Thus
+# nested pools of jobs never occupy more than proc CPUs in
+# total.
+############################################################
+class JobServer:
+    def __init__(self, path, total, own):
+        self.fd = os.open(path, os.O_RDWR|os.O_NONBLOCK)
+        self.total = total
+        self.free = own
+
+    ############################################################
+    # acquire
+    #
+    # Take the slots the job needs, first from this process's
+    # own and then as tokens, and return True, or return
+    # False, holding nothing, if not enough are free.
+    ############################################################
+    def acquire(self, job):
+        need = min(job.slots, self.total)
+        own = min(need, self.free)
+
+        tokens = ''
+        while len(tokens) < need - own:
+            try:
+                t = os.read(self.fd, need - own - len(tokens))
+            except OSError, e:
+                if e.errno in [errno.EAGAIN, errno.EINTR]:
+                    break
+                raise
+            tokens += t
+
+        # take all or nothing, so waiting jobs can't deadlock
+        if len(tokens) < need - own:
+            if tokens:
+                os.write(self.fd, tokens)
+            return False
+
+        self.free -= own
+        job.held = (own, tokens)
+        return True
+
+    ############################################################
+    # release
+    #
+    # Return the slots held by the job.
+    ############################################################
+    def release(self, job):
+        (own, tokens) = job.held
+        self.free += own
+        if tokens:
+            os.write(self.fd, tokens)
+        job.held = None
+
+############################################################
+# start_jobserver
+#
+# Join the run's JobServer or, in its first process, start
+# one with proc slots.  Jobs run after this share them.
+############################################################
+def start_jobserver(proc):
+    global jobserver
+    if jobserver:
+        return
+
+    if os.environ.get('SCIMM_JOBSERVER'):
+        (path, total) = os.environ['SCIMM_JOBSERVER'].rsplit(':', 1)
+        jobserver = JobServer(path, int(total), int(os.environ.get('SCIMM_SLOTS', 1)))
+
+    else:
+        if proc < 1:
+            print 'ERROR: Need at least 1 process'
+            exit()
+        tmp_dir = tempfile.mkdtemp(prefix='scimm_jobs.')
+        atexit.register(shutil.rmtree, tmp_dir, True)
+        path = os.path.join(tmp_dir, 'tokens')
+        os.mkfifo(path)
+        jobserver = JobServer(path, proc, 1)
+        os.write(jobserver.fd, '+'*(proc-1))
+        os.environ['SCIMM_JOBSERVER'] = '%s:%d' % (path, proc)
+
+    start_wakeup()
+
+############################################################
+# start_wakeup
+#
+# Have every signal, and in particular SIGCHLD, write a byte
+# to a pipe, so that a process waiting on JobServer tokens
+# can also wake when one of its jobs exits.  Interrupted
+# system calls other than select are restarted.
+############################################################
+def start_wakeup():
+    global wakeup_fds
+    if wakeup_fds:
+        return
+
+    wakeup_fds = os.pipe()
+    for fd in wakeup_fds:
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    signal.siginterrupt(signal.SIGCHLD, False)
+    signal.set_wakeup_fd(wakeup_fds[1])
+
+############################################################
+# clear_wakeup
+#
+# Empty the wakeup pipe of signals already seen.
+############################################################
+def clear_wakeup():
+    try:
+        while os.read(wakeup_fds[0], 512):
+            pass
+    except OSError, e:
+        if e.errno != errno.EAGAIN:
+            raise
+
 ############################################################
-# exec_par
+# wait_wakeup
 #
-# Execute the commands in the list 'cmds' in parallel, but
-# only running 'max_proc' at a time.
+# Block until a token can be read from the JobServer or a
+# signal arrives.
 ############################################################
-def exec_par(cmds, max_proc):
-    total = len(cmds)
-    finished = 0
-    running = 0
-    p = []
+def wait_wakeup():
+    try:
+        select.select([jobserver.fd, wakeup_fds[0]], [], [])
+    except select.error, e:
+        if e.args[0] != errno.EINTR:
+            raise
 
-    while finished + running < total:
+############################################################
+# Job
+#
+# A command to run with run_jobs, given as an argument list
+# rather than a shell string.  stdin, stdout and stderr may
+# be file names, open files, subprocess.PIPE or (stderr
+# only) subprocess.STDOUT.  Output files are truncated
+# unless append is set.  If feed is given, stdin is a pipe
+# and feed is called with it to write the job's input.  A
+# job that exits non-zero is run again up to retries times.
+# slots is the number of CPUs the job keeps busy, acquired
+# from the JobServer if one is running.
+#
+# Once run, status holds the exit status (negative for a
+# signal), and wall, cpu and maxrss the wall time, CPU time
+# and peak resident memory (KB) of its last attempt.
+############################################################
+class Job:
+    def __init__(self, args, stdin=None, stdout=None, stderr=None, append=False, cwd=None, feed=None, retries=0, name=None, slots=1):
+        self.args = args
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self.append = append
+        self.cwd = cwd
+        self.feed = feed
+        self.retries = retries
+        self.slots = slots
+        self.held = None
+        if name:
+            self.name = name
+        else:
+            self.name = os.path.basename(args[0])
+
+        self.status = None
+        self.attempts = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.maxrss = 0
+
+    ############################################################
+    # start
+    #
+    # Launch the command, feed its stdin and return the Popen.
+    ############################################################
+    def start(self):
+        if self.append:
+            out_mode = 'a'
+        else:
+            out_mode = 'w'
+
+        opened = []
+        if self.feed:
+            stdin = subprocess.PIPE
+        else:
+            stdin = self.open_file(self.stdin, 'r', opened)
+        stdout = self.open_file(self.stdout, out_mode, opened)
+        if self.stderr is not None and self.stderr == self.stdout:
+            stderr = subprocess.STDOUT
+        else:
+            stderr = self.open_file(self.stderr, out_mode, opened)
+
+        # tell the job how many slots it holds
+        if self.held:
+            env = dict(os.environ)
+            env['SCIMM_SLOTS'] = str(self.held[0] + len(self.held[1]))
+        else:
+            env = None
+
+        self.attempts += 1
+        self.start_time = time.time()
+        p = subprocess.Popen(self.args, stdin=stdin, stdout=stdout, stderr=stderr, cwd=self.cwd, close_fds=True, env=env)
+        for f in opened:
+            f.close()
+
+        if self.feed:
+            try:
+                self.feed(p.stdin)
+                p.stdin.close()
+            except IOError:
+                # the job died early; its status will tell
+                pass
+
+        return p
+
+    ############################################################
+    # open_file
+    #
+    # Open a stream given by file name relative to the job's
+    # directory, passing anything else through.
+    ############################################################
+    def open_file(self, stream, mode, opened):
+        if isinstance(stream, str):
+            if self.cwd:
+                stream = os.path.join(self.cwd, stream)
+            opened.append(open(stream, mode))
+            return opened[-1]
+        else:
+            return stream
+
+    ############################################################
+    # finish
+    #
+    # Record the exit status and resource usage of an attempt.
+    ############################################################
+    def finish(self, status, rusage):
+        if os.WIFSIGNALED(status):
+            self.status = -os.WTERMSIG(status)
+        else:
+            self.status = os.WEXITSTATUS(status)
+        self.wall = time.time() - self.start_time
+        self.cpu = rusage.ru_utime + rusage.ru_stime
+        self.maxrss = rusage.ru_maxrss
+
+    ############################################################
+    # log
+    #
+    # Append a line of the job's statistics to the file named
+    # by $SCIMM_JOB_LOG, if set.
+    ############################################################
+    def log(self):
+        if os.environ.get('SCIMM_JOB_LOG'):
+            line = '%s\t%d\t%d\t%.2f\t%.2f\t%d\t%s\n' % (self.name, self.status, self.attempts, self.wall, self.cpu, self.maxrss, ' '.join(self.args))
+            log_fd = os.open(os.environ['SCIMM_JOB_LOG'], os.O_WRONLY|os.O_APPEND|os.O_CREAT, 0644)
+            os.write(log_fd, line)
+            os.close(log_fd)
+
+
+############################################################
+# run_jobs
+#
+# Run the Jobs in the list 'jobs', keeping at most
+# 'max_proc' slots busy, sleeping until some job exits and
+# then immediately starting the next.  A job needing more
+# slots than max_proc runs with max_proc.  If a JobServer is
+# running, jobs also wait for their slots from it, sleeping
+# until a token is returned or some job exits.  If done
+# is given, it is called with each job that has finished
+# for good, once the jobs that can run in its place are
+# launched; it must not run jobs itself, as run_jobs waits
+# for any child, but may return a list of further jobs to
+# run, which are queued after the pending ones.  A job that fails for good stops the run: the
+# other jobs are killed and the program exits, unless
+# fail_fast is False, in which case the remaining jobs run
+# on.  Return the list of failed jobs.
+############################################################
+def run_jobs(jobs, max_proc, fail_fast=True, done=None):
+    pending = list(jobs)
+    running = {}
+    failed = []
+    finished = []
+    busy = 0
+
+    while pending or running or finished:
         # launch jobs up to max
-        while running < max_proc and finished+running < total:
-            p.append(subprocess.Popen(cmds[finished+running], shell=True))
-            #print 'Running %d' % p[running].pid
-            running += 1
-
-        # are any jobs finished
-        new_p = []
-        for i in range(len(p)):
-            if p[i].poll() != None:
-                running -= 1
-                finished += 1
-            else:
-                new_p.append(p[i])
+        while pending and busy + min(pending[0].slots, max_proc) <= max_proc and (not jobserver or jobserver.acquire(pending[0])):
+            job = pending.pop(0)
+            p = job.start()
+            running[p.pid] = (job, p)
+            busy += min(job.slots, max_proc)
+
+        # handle finished jobs while the next ones run
+        queued = False
+        if done:
+            for job in finished:
+                more = done(job)
+                if more:
+                    pending += more
+                    queued = True
+        finished = []
+        if queued:
+            continue
+
+        # wait for any job to finish or, if the next job is
+        # waiting for tokens, for either that or a token.  The
+        # wakeup pipe is emptied before checking for finished
+        # jobs, so a job exiting after the check wakes select.
+        waiting = pending and busy + min(pending[0].slots, max_proc) <= max_proc
+        if waiting:
+            clear_wakeup()
+            wait_options = os.WNOHANG
+        else:
+            wait_options = 0
 
-        # if none finished, sleep
-        if len(new_p) == len(p):
-            time.sleep(1)
-        p = new_p
+        if not running:
+            if waiting:
+                wait_wakeup()
+            continue
+        try:
+            (pid, status, rusage) = os.wait4(-1, wait_options)
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        if pid == 0:
+            wait_wakeup()
+            continue
+        if not running.has_key(pid):
+            continue
+
+        (job, p) = running.pop(pid)
+        busy -= min(job.slots, max_proc)
+        job.finish(status, rusage)
+        p.returncode = job.status
+        job.log()
+        if jobserver:
+            jobserver.release(job)
+
+        if job.status != 0:
+            if job.attempts <= job.retries:
+                pending.insert(0, job)
+            else:
+                failed.append(job)
+                finished.append(job)
+                if fail_fast:
+                    for (rjob, rp) in running.values():
+                        rp.kill()
+                        rp.wait()
+                        if jobserver:
+                            jobserver.release(rjob)
+                    print >> sys.stderr, 'ERROR: %s exited with status %d' % (' '.join(job.args), job.status)
+                    exit(1)
+        else:
+            finished.append(job)
 
-    # wait for all to finish
-    for i in range(len(p)):
-        p[i].wait()
+    return failed
 
 ############################################################
 # max_i
@@ -14,6 +14,13 @@
 #include  "build-icm.hh"
 
 
+static char  * Counts_Filename = NULL;
+  // Name of file to which the model's training counts are written,
+  // and from which they are read if  Update_Counts  is true
+static char  * Markov_Filename = NULL;
+  // Name of file to which a fixed-order Markov model of the training
+  // strings is written, and from which its counts are read if
+  // Update_Counts  is true
 static int  Genbank_Xlate_Code = 0;
   // Holds the Genbank translation table number that determines
   // stop codons and codon translation.
@@ -37,6 +44,12 @@ static vector <const char *>  Stop_Codon;
   // Sequences assumed to be stop codons
 static vector <char *>  Training_Data;
   // Holds the training strings
+static vector <char *>  Removed_Data;
+  // Holds the strings whose counts are to be removed from the
+  // model when  Update_Counts  is true
+static bool  Update_Counts = false;
+  // If true then update the counts in  Counts_Filename  with the
+  // input strings instead of training the model from scratch
 
 
 
@@ -48,80 +61,79 @@ int  Unused = Filter ('a');
 int  main
     (int argc, char **argv)
   {
-   FILE  * output_fp;
+   FILE  * output_fp, * counts_fp;
+   Markov_t  markov;
    int  string_ct;
      // Number of strings read from training file
 
 
    Parse_Command_Line (argc, argv);
 
-   if  (strcmp (Output_Filename, "-") == 0)
-       output_fp = stdout;
-   else if  (Print_Binary)
-       output_fp = File_Open (Output_Filename, "wb");
-     else
-       output_fp = File_Open (Output_Filename, "w");
-
    // create the model
    ICM_Training_t  model (Model_Len, Model_Depth, Model_Periodicity);
 
+   if  (Update_Counts)
+       {
+        counts_fp = File_Open (Counts_Filename, "rb");
+        model . Input_Counts (counts_fp);
+        fclose (counts_fp);
+       }
+
    Read_Training_Data (stdin);
    string_ct = Training_Data . size ();
-   if  (string_ct == 0)
+   if  (string_ct == 0 && ! Update_Counts)
        {
         fprintf (stderr, "ERROR:  Cannot create model--no input data\n");
-        fclose (output_fp);
         exit (EXIT_FAILURE);
        }
 
-   if  (Skip_In_Frame_Stop_Strings)
-       {
-        bool  skip;
-        int  i, j, k, s, len, ct = 0;
-
-        Set_Stop_Codons ();
-
-        int  num_stops = Stop_Codon . size ();
-
-        for  (i = k = 0;  i < string_ct;  i ++)
-          {
-           skip = false;
-
-           // Assuming data has been converted to lower-case if needed
-
-           len = strlen (Training_Data [i]);
-
-           for  (j = 0;  j < len - 2 && ! skip;  j += 3)
-             for  (s = 0;  s < num_stops && ! skip;  s ++)
-               skip = (strncmp (Training_Data [i] + j, Stop_Codon [s], 3) == 0);
-
-           if  (skip)
-               ct ++;
-             else
-               Training_Data [k ++] = Training_Data [i];
-          }
-
-        fprintf (stderr,
-                 "Skipped %d strings with in-frame stops of %d total strings\n",
-                 ct, string_ct);
-        Training_Data . resize (k);
-       }
+   Prepare_Data (Training_Data);
+   Prepare_Data (Removed_Data);
 
-   if  (Reverse_Strings)
+   if  (Markov_Filename != NULL)
        {
         int  i, n;
 
+        if  (Update_Counts)
+            markov . Read (Markov_Filename);
         n = Training_Data . size ();
         for  (i = 0;  i < n;  i ++)
-          Reverse_String (Training_Data [i]);
+          markov . Count_String (Training_Data [i], 1.0);
+        n = Removed_Data . size ();
+        for  (i = 0;  i < n;  i ++)
+          markov . Count_String (Removed_Data [i], -1.0);
        }
 
-   model . Train_Model (Training_Data);
+   if  (Update_Counts)
+       model . Update_Model (Training_Data, Removed_Data);
+     else
+       model . Train_Model (Training_Data);
+
+   if  (strcmp (Output_Filename, "-") == 0)
+       output_fp = stdout;
+   else if  (Print_Binary)
+       output_fp = File_Open (Output_Filename, "wb");
+     else
+       output_fp = File_Open (Output_Filename, "w");
 
    model . Output (output_fp, Print_Binary);
 
    fclose (output_fp);
 
+   if  (Counts_Filename != NULL)
+       {
+        counts_fp = File_Open (Counts_Filename, "wb");
+        model . Output_Counts (counts_fp);
+        fclose (counts_fp);
+       }
+
+   if  (Markov_Filename != NULL)
+       {
+        counts_fp = File_Open (Markov_Filename, "wb");
+        markov . Output (counts_fp);
+        fclose (counts_fp);
+       }
+
    return 0;
   }
 
@@ -143,12 +155,15 @@ static void  Parse_Command_Line
 #if  ALLOW_LONG_OPTIONS
    int  option_index = 0;
    static struct option  long_options [] = {
+        {"counts", 1, 0, 'c'},
         {"depth", 1, 0, 'd'},
         {"no_stops", 0, 0, 'F'},
         {"help", 0, 0, 'h'},
+        {"markov", 1, 0, 'M'},
         {"period", 1, 0, 'p'},
         {"reverse", 0, 0, 'r'},
         {"text", 0, 0, 't'},
+        {"update", 0, 0, 'u'},
         {"verbose", 1, 0, 'v'},
         {"width", 1, 0, 'w'},
         {"trans_table", 1, 0, 'z'},
@@ -157,15 +172,19 @@ static void  Parse_Command_Line
       };
 
    while  (! errflg && ((ch = getopt_long (argc, argv,
-        "d:Fhp:rtv:w:z:Z:",
+        "c:d:FhM:p:rtuv:w:z:Z:",
         long_options, & option_index)) != EOF))
 #else
    while  (! errflg && ((ch = getopt (argc, argv,
-        "d:Fhp:rtv:w:z:Z:")) != EOF))
+        "c:d:FhM:p:rtuv:w:z:Z:")) != EOF))
 #endif
 
      switch  (ch)
        {
+        case  'c' :
+          Counts_Filename = optarg;
+          break;
+
         case  'd' :
           Model_Depth = int (strtol (optarg, & p, 10));
           if  (p == optarg || Model_Depth <= 0)
@@ -184,6 +203,10 @@ static void  Parse_Command_Line
           errflg = TRUE;
           break;
 
+        case  'M' :
+          Markov_Filename = optarg;
+          break;
+
         case  'p' :
           Model_Periodicity = int (strtol (optarg, & p, 10));
           if  (p == optarg || Model_Periodicity <= 0)
@@ -201,6 +224,10 @@ static void  Parse_Command_Line
         case  't' :
           Print_Binary = false;
           break;
+
+        case  'u' :
+          Update_Counts = true;
+          break;
           
         case  'v' :
           Verbose = int (strtol (optarg, & p, 10));
@@ -244,6 +271,12 @@ static void  Parse_Command_Line
           errflg = TRUE;
        }
 
+   if  (Update_Counts && Counts_Filename == NULL)
+       {
+        fprintf (stderr, "ERROR:  -u requires a counts file (-c)\n");
+        errflg = TRUE;
+       }
+
    if  (errflg || optind != argc - 1)
        {
         Usage (argv [0]);
@@ -316,12 +349,73 @@ static int  Read_String
 
 
 
+static void  Prepare_Data
+    (vector <char *> & data)
+
+//  Remove from  data  the strings with in-frame stop codons and
+//  reverse the remaining strings, if the options say to.
+
+  {
+   int  string_ct;
+
+   string_ct = data . size ();
+
+   if  (Skip_In_Frame_Stop_Strings)
+       {
+        bool  skip;
+        int  i, j, k, s, len, ct = 0;
+
+        Set_Stop_Codons ();
+
+        int  num_stops = Stop_Codon . size ();
+
+        for  (i = k = 0;  i < string_ct;  i ++)
+          {
+           skip = false;
+
+           // Assuming data has been converted to lower-case if needed
+
+           len = strlen (data [i]);
+
+           for  (j = 0;  j < len - 2 && ! skip;  j += 3)
+             for  (s = 0;  s < num_stops && ! skip;  s ++)
+               skip = (strncmp (data [i] + j, Stop_Codon [s], 3) == 0);
+
+           if  (skip)
+               ct ++;
+             else
+               data [k ++] = data [i];
+          }
+
+        fprintf (stderr,
+                 "Skipped %d strings with in-frame stops of %d total strings\n",
+                 ct, string_ct);
+        data . resize (k);
+       }
+
+   if  (Reverse_Strings)
+       {
+        int  i, n;
+
+        n = data . size ();
+        for  (i = 0;  i < n;  i ++)
+          Reverse_String (data [i]);
+       }
+
+   return;
+  }
+
+
+
 static void  Read_Training_Data
     (FILE  * fp)
 
 // Read in training strings from  fp .  Format is multifasta, i.e., for
 // each string a header line (starting with '>') followed by arbitrarily
-// many data lines.  Save strings in global  Training_Data
+// many data lines.  Save strings in global  Training_Data .
+// If  Update_Counts  is true, a header starting with a negative
+// weight, as in  ">-1;tag" , marks a string to remove from the
+// model, which is saved in  Removed_Data  instead.
 
   {
    char  * string = NULL, * tag = NULL;
@@ -331,16 +425,21 @@ static void  Read_Training_Data
 
    while  (Read_String (fp, string, string_size, tag, tag_size))
      {       
+      vector <char *>  * data = & Training_Data;
+
+      if  (Update_Counts && strtod (tag, & p) < 0.0 && * p == ';')
+          data = & Removed_Data;
+
       p = strdup (string);
       Make_Lower_Case (p);
-      Training_Data . push_back (p);
+      data -> push_back (p);
 
       rc = strdup(string);
       for(int i = 0; i < strlen (string); i++) {
 	rc[i] = Complement (p[strlen(string)-1-i]);
       }
       Make_Lower_Case (rc);
-      Training_Data . push_back (rc);
+      data -> push_back (rc);
      }
 
    return;
@@ -388,18 +487,29 @@ static void  Usage
            "If <output-file> is \"-\", then output goes to standard output\n"
            "\n"
            "Options:\n"
+           " -c <file>\n"
+           "    Also write the model's training counts to <file>\n"
            " -d <num>\n"
            "    Set depth of model to <num>\n"
            " -F\n"
            "    Ignore input strings with in-frame stop codons\n"
            " -h\n"
            "    Print this message\n"
+           " -M <file>\n"
+           "    Also write a fixed low-order Markov model of the input\n"
+           "    strings to <file>, for pre-filtering in  multi-score .\n"
+           "    With -u, update the one in <file>\n"
            " -p <num>\n"
            "    Set period of model to <num>\n"
            " -r\n"
            "    Use the reverse of input strings to build the model\n"
            " -t\n"
            "    Output model as text (for debugging only)\n"
+           " -u\n"
+           "    Update the counts in the -c file instead of training from\n"
+           "    scratch:  add the input strings, except those whose header\n"
+           "    starts with a negative weight (e.g., >-1;tag), which are\n"
+           "    removed.  The shape of the model tree is not changed\n"
            " -v <num>\n"
            "    Set verbose level; higher is more diagnostic printouts\n"
            " -w <num>\n"
@@ -43,6 +43,8 @@ const int  T_BASE = 3;
 
 static void  Parse_Command_Line
     (int argc, char * argv []);
+static void  Prepare_Data
+    (vector <char *> & data);
 static int  Read_String
     (FILE * fp, char * & s, long int & s_size, char * & tag, long int & tag_size);
 static void  Read_Training_Data
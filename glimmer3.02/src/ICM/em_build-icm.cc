@@ -17,6 +17,9 @@
 static int  Genbank_Xlate_Code = 0;
   // Holds the Genbank translation table number that determines
   // stop codons and codon translation.
+static char  * Markov_Filename = NULL;
+  // Name of file to which a fixed-order Markov model of the
+  // weighted training strings is written
 static int  Model_Depth = DEFAULT_MODEL_DEPTH;
   // Maximum number of positions to use in Markov context
 static int  Model_Len = DEFAULT_MODEL_LEN;
@@ -117,6 +120,21 @@ int  main
           Reverse_String (Training_Data [i] . seq);
        }
 
+   if  (Markov_Filename != NULL)
+       {
+        Markov_t  markov;
+        FILE  * markov_fp;
+        int  i, n;
+
+        n = Training_Data . size ();
+        for  (i = 0;  i < n;  i ++)
+          markov . Count_String (Training_Data [i] . seq, Training_Data [i] . p);
+
+        markov_fp = File_Open (Markov_Filename, "wb");
+        markov . Output (markov_fp);
+        fclose (markov_fp);
+       }
+
    model . Train_Model (Training_Data);
 
    model . Output (output_fp, Print_Binary);
@@ -147,6 +165,7 @@ static void  Parse_Command_Line
         {"depth", 1, 0, 'd'},
         {"no_stops", 0, 0, 'F'},
         {"help", 0, 0, 'h'},
+        {"markov", 1, 0, 'M'},
         {"period", 1, 0, 'p'},
         {"reverse", 0, 0, 'r'},
         {"text", 0, 0, 't'},
@@ -158,11 +177,11 @@ static void  Parse_Command_Line
       };
 
    while  (! errflg && ((ch = getopt_long (argc, argv,
-        "d:Fhp:rtv:w:z:Z:",
+        "d:FhM:p:rtv:w:z:Z:",
         long_options, & option_index)) != EOF))
 #else
    while  (! errflg && ((ch = getopt (argc, argv,
-        "d:Fhp:rtv:w:z:Z:")) != EOF))
+        "d:FhM:p:rtv:w:z:Z:")) != EOF))
 #endif
 
      switch  (ch)
@@ -185,6 +204,10 @@ static void  Parse_Command_Line
           errflg = TRUE;
           break;
 
+        case  'M' :
+          Markov_Filename = optarg;
+          break;
+
         case  'p' :
           Model_Periodicity = int (strtol (optarg, & p, 10));
           if  (p == optarg || Model_Periodicity <= 0)
@@ -409,6 +432,9 @@ static void  Usage
            "    Ignore input strings with in-frame stop codons\n"
            " -h\n"
            "    Print this message\n"
+           " -M <file>\n"
+           "    Also write a fixed low-order Markov model of the weighted\n"
+           "    input strings to <file>, for pre-filtering in  multi-score\n"
            " -p <num>\n"
            "    Set period of model to <num>\n"
            " -r\n"
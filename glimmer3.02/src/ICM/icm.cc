@@ -1042,14 +1042,12 @@ void  ICM_Training_t :: Complete_Tree
 //  in the low-count case.
 
   {
-   int  sub, max_pos, string_ct;
-   double  best_info, next_info, used_info;
-   int  sum;
+   int  sub, string_ct;
    int  symbol;
      // subscript of character in alphabet
    int  first_node, last_node, nodes_on_level;
    int  frame, level;
-   int  i, j, k;
+   int  i;
 
    string_ct = int (data . size ());
 
@@ -1068,80 +1066,7 @@ void  ICM_Training_t :: Complete_Tree
          symbol = 0;
          for  (sub = first_node;  sub <= last_node;
                  sub ++, symbol = (symbol + 1) % ALPHABET_SIZE)
-           {
-            int  final_char_ct [ALPHABET_SIZE] = {0};
-              // number of occurrences of each symbol in the last position
-
-            train [frame] [sub] . mut_info_seq = (short int) symbol;
-
-            if  (score [frame] [PARENT (sub)] . mut_info_pos < 0)
-                // Don't process this node; stopped at parent
-                {
-                 score [frame] [sub] . mut_info_pos = -2;
-                 continue;
-                }
-
-            // sum over k of  count [i] [k]  is same for any i
-            sum = 0;
-            for  (i = k = 0;  i < ALPHABET_SIZE;  i ++)
-              for  (j = 0;  j < ALPHABET_SIZE;  j ++)
-                {
-                 sum += train [frame] [sub] . count [0] [k];
-                 final_char_ct [j] += train [frame] [sub] . count [0] [k];
-                 k ++;
-                }
-
-            // find the position pair with the max mutual information
-            max_pos = 0;
-            best_info = Get_Mutual_Info (train [frame] [sub] . count [0],
-                                         ALPHABET_SIZE, sum);
-            used_info = best_info;
-
-            for  (i = 1;  i < model_len - 1;  i ++)
-              {
-               next_info = Get_Mutual_Info (train [frame] [sub] . count [i],
-                                            ALPHABET_SIZE, sum);
-               if  (next_info >= best_info)
-                   {
-                    used_info = best_info = next_info;
-                    max_pos = i;
-                   }
-               else if  (next_info >= (best_info / (1.0 + MUT_INFO_BIAS)))
-                   {
-                    // prefer positions to the right (i.e., closer to the
-                    // predicted base) if mutual-information values are
-                    // close enough
-                    max_pos = i;
-                    used_info = next_info;
-                   }
-              }
-
-            if  (best_info <= MUT_INFO_EPSILON && sum < SAMPLE_SIZE_BOUND)
-                // Not enough information gain; don't go down tree any further
-                max_pos = -1;
-
-            score [frame] [sub] . mut_info_pos = (short int) max_pos;
-#if  STORE_MUT_INFO
-            score [frame] [sub] . mut_info = float (used_info);
-#endif
-
-            if  (Verbose > 1)
-                {
-                 fprintf (stderr,
-                      "frame = %d  node = %d  mut_info_pos = %d  mut_info = %.3f  cts: ",
-                          frame, sub, max_pos, best_info);
-                 for  (i = 0;  i < ALPHABET_SIZE;  i ++)
-                   fprintf (stderr, " %4d", final_char_ct [i]);
-                 fputc ('\n', stderr);
-                }
-
-            Interpolate_Probs (frame, sub, final_char_ct);
-
-#if  0
-// Should be in a separate method
-            print_node (print_string, level, sub, mut_info[max_pos],frame, ending_sum);
-#endif
-           }
+           Set_Node (frame, sub, symbol);
         }
 
       first_node = last_node + 1;
@@ -1199,6 +1124,57 @@ void  ICM_Training_t :: Count_Char_Pairs_Restricted
 
 
 
+void  ICM_Training_t :: Count_String_Delta
+    (const char * string, int incr)
+
+//  For each complete window of length  model_len  in  string
+//  add  incr  to the character-pair counts (as in
+//  Count_Char_Pairs_Restricted ) of the root and of each node
+//  below it that the window reaches in its frame 's segment of
+//  the model, following the current mutual-information positions.
+
+  {
+   ICM_Training_Node_t  * node;
+   int  start, stop, end, frame, last_char_sub;
+   int  level, sub, pos;
+   int  i, j;
+
+   start = 0;
+   end = int (strlen (string));
+   frame = model_len % periodicity;
+
+   for  (stop = model_len - 1;  stop < end;  start ++, stop ++)
+     {
+      last_char_sub = Subscript (string [stop]);
+
+      sub = 0;
+      for  (level = 0;  level <= model_depth;  level ++)
+        {
+         node = train [frame] + sub;
+         for  (i = 0;  i < model_len - 1;  i ++)
+           {
+            j = ALPHABET_SIZE * Subscript (string [start + i])
+                    + last_char_sub;
+            node -> count [i] [j] += incr;
+           }
+
+         pos = score [frame] [sub] . mut_info_pos;
+         if  (pos < 0 || level == model_depth)
+             break;
+
+         sub = sub * ALPHABET_SIZE + Subscript (string [start + pos]) + 1;
+        }
+
+      frame ++;
+      if  (frame == periodicity)
+          frame = 0;
+     }
+
+   return;
+  }
+
+
+
 ICM_Training_Node_t *  ICM_Training_t :: Get_Training_Node
     (const char * w, int frame, int level)
 
@@ -1226,6 +1202,70 @@ ICM_Training_Node_t *  ICM_Training_t :: Get_Training_Node
 
 
 
+void  ICM_Training_t :: Input_Counts
+    (FILE * fp)
+
+//  Input from  fp , which has already been opened, the counts and
+//  mutual-information positions of a model with the same parameters
+//  as this one, written by  Output_Counts .
+
+  {
+   int  param [NUM_COUNT_PARAMS];
+   int  node_id, frame, i, j;
+
+   if  (fread (param, sizeof (int), NUM_COUNT_PARAMS, fp) != NUM_COUNT_PARAMS)
+       {
+        fprintf (stderr, "ERROR reading count parameters\n");
+        exit (EXIT_FAILURE);
+       }
+
+   if  (param [0] != model_len || param [1] != model_depth
+          || param [2] != periodicity || param [3] != num_nodes)
+       {
+        fprintf (stderr, "ERROR:  Counts are for a model with len = %d  depth = %d"
+                 "  periodicity = %d  num_nodes = %d\n",
+                 param [0], param [1], param [2], param [3]);
+        exit (EXIT_FAILURE);
+       }
+
+   for  (frame = 0;  frame < periodicity;  frame ++)
+     for  (i = 0;  i < num_nodes;  i ++)
+       {
+        score [frame] [i] . mut_info_pos = -2;
+        if  (model_depth > 0)
+            for  (j = 0;  j < model_len - 1;  j ++)
+              memset (train [frame] [i] . count [j], 0, sizeof (int [ALPHA_SQUARED]));
+       }
+
+   for  (frame = 0;  frame < periodicity;  frame ++)
+     while  (true)
+       {
+        if  (fread (& node_id, sizeof (int), 1, fp) != 1)
+            {
+             fprintf (stderr, "ERROR reading counts for frame %d\n", frame);
+             exit (EXIT_FAILURE);
+            }
+
+        if  (node_id < 0)
+            break;
+
+        if  (node_id >= num_nodes
+               || fread (& (score [frame] [node_id] . mut_info_pos),
+                         sizeof (short int), 1, fp) != 1
+               || fread (train [frame] [node_id] . count, sizeof (int [ALPHA_SQUARED]),
+                         model_len - 1, fp) != unsigned (model_len - 1))
+            {
+             fprintf (stderr, "ERROR reading counts for node = %d  frame = %d\n",
+                      node_id, frame);
+             exit (EXIT_FAILURE);
+            }
+       }
+
+   return;
+  }
+
+
+
 void  ICM_Training_t :: Interpolate_Probs
     (int frame, int sub, int ct [])
 
@@ -1300,6 +1340,203 @@ void  ICM_Training_t :: Interpolate_Probs
 
 
 
+void  ICM_Training_t :: Output_Counts
+    (FILE * fp)
+
+//  Output to  fp  in binary the character-pair counts and the
+//  mutual-information position of every node that was trained,
+//  so that  Update_Model  can later adjust them.  Each frame's
+//  nodes are followed by an id of  -1 .
+
+  {
+   int  param [NUM_COUNT_PARAMS];
+   int  end_marker = -1;
+   int  frame, i;
+
+   param [0] = model_len;
+   param [1] = model_depth;
+   param [2] = periodicity;
+   param [3] = num_nodes;
+   fwrite (param, sizeof (int), NUM_COUNT_PARAMS, fp);
+
+   for  (frame = 0;  frame < periodicity;  frame ++)
+     {
+      if  (model_depth > 0)
+          for  (i = 0;  i < num_nodes;  i ++)
+            if  (score [frame] [i] . mut_info_pos >= -1)
+                {
+                 fwrite (& i, sizeof (int), 1, fp);
+                 fwrite (& (score [frame] [i] . mut_info_pos), sizeof (short int), 1, fp);
+                 fwrite (train [frame] [i] . count, sizeof (int [ALPHA_SQUARED]),
+                         model_len - 1, fp);
+                }
+      fwrite (& end_marker, sizeof (int), 1, fp);
+     }
+
+   return;
+  }
+
+
+
+void  ICM_Training_t :: Set_Node
+    (int frame, int sub, int symbol)
+
+//  Set the max mutual-information position and the probabilities
+//  of the non-root node at subscript  sub  in the  frame 'th
+//  segment of the model from its counts.   symbol  is the
+//  character restricted at the parent's mutual-information position
+//  to reach this node.
+
+  {
+   int  final_char_ct [ALPHABET_SIZE] = {0};
+     // number of occurrences of each symbol in the last position
+   double  best_info, next_info, used_info;
+   int  max_pos, sum;
+   int  i, j, k;
+
+   train [frame] [sub] . mut_info_seq = (short int) symbol;
+
+   if  (score [frame] [PARENT (sub)] . mut_info_pos < 0)
+       // Don't process this node; stopped at parent
+       {
+        score [frame] [sub] . mut_info_pos = -2;
+        return;
+       }
+
+   // sum over k of  count [i] [k]  is same for any i
+   sum = 0;
+   for  (i = k = 0;  i < ALPHABET_SIZE;  i ++)
+     for  (j = 0;  j < ALPHABET_SIZE;  j ++)
+       {
+        sum += train [frame] [sub] . count [0] [k];
+        final_char_ct [j] += train [frame] [sub] . count [0] [k];
+        k ++;
+       }
+
+   // find the position pair with the max mutual information
+   max_pos = 0;
+   best_info = Get_Mutual_Info (train [frame] [sub] . count [0],
+                                ALPHABET_SIZE, sum);
+   used_info = best_info;
+
+   for  (i = 1;  i < model_len - 1;  i ++)
+     {
+      next_info = Get_Mutual_Info (train [frame] [sub] . count [i],
+                                   ALPHABET_SIZE, sum);
+      if  (next_info >= best_info)
+          {
+           used_info = best_info = next_info;
+           max_pos = i;
+          }
+      else if  (next_info >= (best_info / (1.0 + MUT_INFO_BIAS)))
+          {
+           // prefer positions to the right (i.e., closer to the
+           // predicted base) if mutual-information values are
+           // close enough
+           max_pos = i;
+           used_info = next_info;
+          }
+     }
+
+   if  (best_info <= MUT_INFO_EPSILON && sum < SAMPLE_SIZE_BOUND)
+       // Not enough information gain; don't go down tree any further
+       max_pos = -1;
+
+   score [frame] [sub] . mut_info_pos = (short int) max_pos;
+#if  STORE_MUT_INFO
+   score [frame] [sub] . mut_info = float (used_info);
+#endif
+
+   if  (Verbose > 1)
+       {
+        fprintf (stderr,
+             "frame = %d  node = %d  mut_info_pos = %d  mut_info = %.3f  cts: ",
+                 frame, sub, max_pos, best_info);
+        for  (i = 0;  i < ALPHABET_SIZE;  i ++)
+          fprintf (stderr, " %4d", final_char_ct [i]);
+        fputc ('\n', stderr);
+       }
+
+   Interpolate_Probs (frame, sub, final_char_ct);
+
+#if  0
+// Should be in a separate method
+   print_node (print_string, level, sub, mut_info[max_pos],frame, ending_sum);
+#endif
+
+   return;
+  }
+
+
+
+void  ICM_Training_t :: Set_Root
+    (int frame)
+
+//  Set the max mutual-information position and the probabilities
+//  of the root node in the  frame 'th segment of the model from
+//  its counts.
+
+  {
+   int  final_char_ct [ALPHABET_SIZE] = {0};
+     // number of occurrences of each character as last in window
+   double  best_info, next_info;
+   int  max_pos, sum;
+   int  i, j, k;
+
+   // sum over k of  count [i] [k]  is same for any i
+   sum = 0;
+   for  (i = k = 0;  i < ALPHABET_SIZE;  i ++)
+     for  (j = 0;  j < ALPHABET_SIZE;  j ++)
+       {
+        sum += train [frame] [0] . count [0] [k];
+        final_char_ct [j] += train [frame] [0] . count [0] [k];
+        k ++;
+       }
+   for  (j = 0;  j < ALPHABET_SIZE;  j ++)
+     score [frame] [0] . prob [j]
+       = (final_char_ct [j] + float (PSEUDO_COUNT / ALPHABET_SIZE))
+           / float (sum + PSEUDO_COUNT);
+
+   // find the position pair with the max mutual information
+   max_pos = 0;
+   best_info = Get_Mutual_Info (train [frame] [0] . count [0],
+                                ALPHABET_SIZE, sum);
+
+   for  (i = 1;  i < model_len - 1;  i ++)
+     {
+      next_info = Get_Mutual_Info (train [frame] [0] . count [i],
+                                   ALPHABET_SIZE, sum);
+      if  (next_info >= best_info)
+          {
+           best_info = next_info;
+           max_pos = i;
+          }
+      else if  (next_info >= (best_info / (1.0 + MUT_INFO_BIAS)))
+          max_pos = i;
+          // prefer positions to the right (i.e., closer to the
+          // predicted base) if mutual-information values are
+          // close enough
+     }
+
+   score [frame] [0] . mut_info_pos = (short int) max_pos;
+#if  STORE_MUT_INFO
+   score [frame] [0] . mut_info = float (best_info);
+#endif
+
+   if  (Verbose > 1)
+       {
+        fprintf (stderr, "frame = %d  node = %d  mut_info_pos = %d  mut_info = %.3f  cts: ",
+                 frame, 0, max_pos, best_info);
+        for  (i = 0;  i < ALPHABET_SIZE;  i ++)
+          fprintf (stderr, " %4d", final_char_ct [i]);
+        fputc ('\n', stderr);
+       }
+
+   return;
+  }
+
+
+
 void  ICM_Training_t :: Take_Logs
     (void)
 
@@ -1339,9 +1576,8 @@ void  ICM_Training_t :: Train_Model
         // where first window should start in the string
       int  final_char_ct [ALPHABET_SIZE] = {0};
         // number of occurrences of each character as last in window
-      double  best_info, next_info;
-      int  max_pos, sum;
-      int  i, j, k;
+      int  sum;
+      int  i;
 
       // (dave) offset = 0 - (12 % 1) = 0
       offset = frame - (model_len % periodicity);
@@ -1370,54 +1606,7 @@ void  ICM_Training_t :: Train_Model
              Count_Char_Pairs (train [frame] [0] . count,
                                data [i] + offset, model_len, periodicity);
 
-	   // 
-           // sum over k of  count [i] [k]  is same for any i
-           sum = 0;
-           for  (i = k = 0;  i < ALPHABET_SIZE;  i ++)
-             for  (j = 0;  j < ALPHABET_SIZE;  j ++)
-               {
-                sum += train [frame] [0] . count [0] [k];
-                final_char_ct [j] += train [frame] [0] . count [0] [k];
-                k ++;
-               }
-           for  (j = 0;  j < ALPHABET_SIZE;  j ++)
-             score [frame] [0] . prob [j]
-               = (final_char_ct [j] + float (PSEUDO_COUNT / ALPHABET_SIZE))
-                   / float (sum + PSEUDO_COUNT);
-
-           // find the position pair with the max mutual information
-           max_pos = 0;
-           best_info = Get_Mutual_Info (train [frame] [0] . count [0],
-                                        ALPHABET_SIZE, sum);
-
-           for  (i = 1;  i < model_len - 1;  i ++)
-             {
-              next_info = Get_Mutual_Info (train [frame] [0] . count [i],
-                                           ALPHABET_SIZE, sum);
-              if  (next_info >= best_info)
-                  {
-                   best_info = next_info;
-                   max_pos = i;
-                  }
-              else if  (next_info >= (best_info / (1.0 + MUT_INFO_BIAS)))
-                  max_pos = i;
-                  // prefer positions to the right (i.e., closer to the
-                  // predicted base) if mutual-information values are
-                  // close enough
-             }
-
-           score [frame] [0] . mut_info_pos = (short int) max_pos;
-#if  STORE_MUT_INFO
-           score [frame] [0] . mut_info = float (best_info);
-#endif
-          }
-      if  (Verbose > 1)
-          {
-           fprintf (stderr, "frame = %d  node = %d  mut_info_pos = %d  mut_info = %.3f  cts: ",
-                    frame, 0, max_pos, best_info);
-           for  (i = 0;  i < ALPHABET_SIZE;  i ++)
-             fprintf (stderr, " %4d", final_char_ct [i]);
-           fputc ('\n', stderr);
+           Set_Root (frame);
           }
 
 #if  0
@@ -1436,6 +1625,73 @@ void  ICM_Training_t :: Train_Model
 
 
 
+void  ICM_Training_t :: Update_Model
+    (const vector <char *> & add, const vector <char *> & remove)
+
+//  Recalculate the probabilities for this model, whose counts were
+//  set by  Input_Counts , after adding the counts of the strings
+//  in  add  and subtracting those of the strings in  remove .
+//  The mutual-information positions above the last level of the
+//  tree determine which nodes each window is counted in, so they
+//  are kept as they were and only the probabilities (and the
+//  positions on the last level) are recalculated from the new
+//  counts.  Training from scratch may choose a different tree.
+
+  {
+   vector <short int>  tree_pos;
+     // mutual-information positions the counts were made with
+   int  first_node, last_node, nodes_on_level;
+   int  frame, level, sub, symbol;
+   int  i, n;
+
+   for  (frame = 0;  frame < periodicity;  frame ++)
+     for  (i = 0;  i < num_nodes;  i ++)
+       tree_pos . push_back (score [frame] [i] . mut_info_pos);
+
+   n = int (add . size ());
+   for  (i = 0;  i < n;  i ++)
+     Count_String_Delta (add [i], 1);
+   n = int (remove . size ());
+   for  (i = 0;  i < n;  i ++)
+     Count_String_Delta (remove [i], -1);
+
+   for  (frame = 0;  frame < periodicity;  frame ++)
+     {
+      Set_Root (frame);
+      score [frame] [0] . mut_info_pos = tree_pos [frame * num_nodes];
+     }
+
+   first_node = 1;
+   nodes_on_level = ALPHABET_SIZE;
+
+   for  (level = 1;  level <= model_depth;  level ++)
+     {
+      last_node = first_node + nodes_on_level - 1;
+
+      for  (frame = 0;  frame < periodicity;  frame ++)
+        {
+         symbol = 0;
+         for  (sub = first_node;  sub <= last_node;
+                 sub ++, symbol = (symbol + 1) % ALPHABET_SIZE)
+           {
+            Set_Node (frame, sub, symbol);
+            if  (level < model_depth)
+                score [frame] [sub] . mut_info_pos
+                    = tree_pos [frame * num_nodes + sub];
+           }
+        }
+
+      first_node = last_node + 1;
+      nodes_on_level *= ALPHABET_SIZE;
+     }
+
+   Take_Logs ();
+
+   return;
+  }
+
+
+
 Fixed_Length_ICM_t :: Fixed_Length_ICM_t
     (int len, int sp, int * perm, ICM_Model_t mt)
 
@@ -1811,6 +2067,176 @@ void  Fixed_Length_ICM_Training_t :: Write_Header
 
 
 
+Markov_t :: Markov_t
+    (int o)
+
+//  Constructor for a fixed Markov model of order  o  with no counts.
+
+  {
+   int  i;
+
+   order = o;
+   num_words = 1;
+   for  (i = 0;  i <= order;  i ++)
+     num_words *= ALPHABET_SIZE;
+
+   count . assign (num_words, 0.0);
+  }
+
+
+
+void  Markov_t :: Count_String
+    (const char * s, double weight)
+
+//  Add  weight  times the number of occurrences of each
+//  (order + 1)-mer in string  s  to the counts.  Use a negative
+//  weight to remove a string counted before.  Windows containing
+//  characters outside the alphabet are skipped.
+
+  {
+   const char  * p;
+   int  w = 0, len = 0;
+   int  i;
+
+   for  (i = 0;  s [i] != '\0';  i ++)
+     {
+      p = strchr (ALPHA_STRING, tolower (s [i]));
+      if  (p == NULL)
+          {
+           len = 0;
+           continue;
+          }
+
+      w = (w * ALPHABET_SIZE + int (p - ALPHA_STRING)) % num_words;
+      if  (++ len > order)
+          count [w] += weight;
+     }
+
+   return;
+  }
+
+
+
+void  Markov_t :: Input
+    (FILE * fp)
+
+//  Input from  fp , which has already been opened, the order and
+//  counts written by  Output .
+
+  {
+   int  o;
+
+   if  (fread (& o, sizeof (int), 1, fp) != 1)
+       {
+        fprintf (stderr, "ERROR reading Markov model order\n");
+        exit (EXIT_FAILURE);
+       }
+   if  (o != order)
+       {
+        fprintf (stderr, "ERROR:  Markov counts are for order %d, not %d\n",
+                 o, order);
+        exit (EXIT_FAILURE);
+       }
+   if  (fread (& count [0], sizeof (double), num_words, fp) != unsigned (num_words))
+       {
+        fprintf (stderr, "ERROR reading Markov model counts\n");
+        exit (EXIT_FAILURE);
+       }
+
+   Take_Logs ();
+
+   return;
+  }
+
+
+
+void  Markov_t :: Output
+    (FILE * fp)
+
+//  Output to  fp  in binary the order and counts of this model.
+
+  {
+   fwrite (& order, sizeof (int), 1, fp);
+   fwrite (& count [0], sizeof (double), num_words, fp);
+
+   return;
+  }
+
+
+
+void  Markov_t :: Read
+    (const char * path)
+
+//  Input the model from the file named  path .
+
+  {
+   FILE  * fp;
+
+   fp = File_Open (path, "rb");
+   Input (fp);
+   fclose (fp);
+
+   return;
+  }
+
+
+
+double  Markov_t :: Score_String
+    (const char * s, int len)
+
+//  Return the log probability of string  s [0 .. (len - 1)]
+//  under this model, over the bases that follow a full context.
+
+  {
+   const char  * p;
+   double  result = 0.0;
+   int  w = 0, ct = 0;
+   int  i;
+
+   for  (i = 0;  i < len;  i ++)
+     {
+      p = strchr (ALPHA_STRING, tolower (s [i]));
+      if  (p == NULL || s [i] == '\0')
+          {
+           ct = 0;
+           continue;
+          }
+
+      w = (w * ALPHABET_SIZE + int (p - ALPHA_STRING)) % num_words;
+      if  (++ ct > order)
+          result += log_prob [w];
+     }
+
+   return  result;
+  }
+
+
+
+void  Markov_t :: Take_Logs
+    (void)
+
+//  Set  log_prob  from the counts, adding a pseudo-count of one
+//  to every  (order + 1)-mer.
+
+  {
+   int  i, j;
+
+   log_prob . resize (num_words);
+   for  (i = 0;  i < num_words;  i += ALPHABET_SIZE)
+     {
+      double  sum = 0.0;
+
+      for  (j = 0;  j < ALPHABET_SIZE;  j ++)
+        sum += Max (count [i + j], 0.0) + 1.0;
+      for  (j = 0;  j < ALPHABET_SIZE;  j ++)
+        log_prob [i + j] = log ((Max (count [i + j], 0.0) + 1.0) / sum);
+     }
+
+   return;
+  }
+
+
+
 void  Count_Char_Pairs
     (int ct [] [ALPHA_SQUARED], char * string, int w, int period)
 
@@ -79,6 +79,12 @@ const int  SAMPLE_SIZE_BOUND = 400;
 
 const int  ICM_VERSION_ID = 200;
   // Integer version number stored in model prefix for compatibility check
+const unsigned  NUM_COUNT_PARAMS = 4;
+  // The number of binary integer parameters at the start of a
+  // training counts file
+const int  DEFAULT_MARKOV_ORDER = 3;
+  // Order of the fixed Markov model used to pre-filter models
+  // before full ICM scoring
 
 
 #define  PARENT(x) ((int) ((x) - 1) / ALPHABET_SIZE) 
@@ -192,10 +198,16 @@ class  ICM_Training_t  :  public ICM_t
        (const vector <char *> & data);
    void  Count_Char_Pairs_Restricted
        (const char * string, int level);
+   void  Count_String_Delta
+       (const char * string, int incr);
    ICM_Training_Node_t *  Get_Training_Node
        (const char * w, int frame, int level);
    void  Interpolate_Probs
        (int frame, int sub, int ct []);
+   void  Set_Node
+       (int frame, int sub, int symbol);
+   void  Set_Root
+       (int frame);
    void  Take_Logs
        (void);
 
@@ -207,8 +219,14 @@ class  ICM_Training_t  :  public ICM_t
    ~ ICM_Training_t
        ();
 
+   void  Input_Counts
+       (FILE * fp);
+   void  Output_Counts
+       (FILE * fp);
    void  Train_Model
        (const vector <char *> & data);
+   void  Update_Model
+       (const vector <char *> & add, const vector <char *> & remove);
   };
 
 
@@ -289,6 +307,38 @@ class  Fixed_Length_ICM_Training_t
 
 
 
+class  Markov_t
+  {
+  private:
+   int  order;
+   int  num_words;
+   vector <double>  count;
+     // count [w] is the (weighted) number of occurrences of the
+     // (order + 1)-mer with subscript  w  in the training strings
+   vector <double>  log_prob;
+     // log_prob [w] is the log probability of the last base of
+     // (order + 1)-mer  w  given the preceding ones
+
+  public:
+   Markov_t
+       (int o = DEFAULT_MARKOV_ORDER);
+
+   void  Count_String
+       (const char * s, double weight);
+   void  Input
+       (FILE * fp);
+   void  Output
+       (FILE * fp);
+   void  Read
+       (const char * path);
+   double  Score_String
+       (const char * s, int len);
+   void  Take_Logs
+       (void);
+  };
+
+
+
 void  Count_Char_Pairs
     (int ct [] [ALPHA_SQUARED], char * string, int w, int period);
 void  Count_Single_Chars
@@ -0,0 +1,501 @@
+//    Programmer:  David Kelley
+//          File:  multi-score.cc
+//  Last Updated:  Sun Oct 18 2026
+//
+//  Compute scores for each sequence in an input multi-fasta
+//  file (read from stdin) using every ICM named on the command
+//  line.  The models are loaded once and the input is read in a
+//  single pass, so  k  models cost one parse of the sequences
+//  rather than  k  runs of  simple-score .  With  -s  and  -n  a
+//  run scores just one shard of the sequences, writing its binary
+//  scores into place in score files shared with the other shards.
+//  With  -x  the input is a subset of the sequences, and each
+//  one's scores are written at its own position in the full set.
+//  With  -m  scoring is cascaded:  a cheap fixed-order Markov
+//  model per ICM ranks the models, and only the best few get full
+//  ICM scores.
+
+
+#include  "multi-score.hh"
+
+
+static vector <char *>  Model_Path;
+  // Names of files containing the models
+static bool  Binary_Output = false;
+  // If true write each model's scores as binary floats to its
+  // own file instead of text to stdout
+static char  * ID_Path = NULL;
+  // Name of file to which the sequence tags are written, one
+  // per line in input order
+static long int  First_Seq = -1;
+  // If non-negative, the input begins with this sequence of the
+  // full set, and binary scores are written into existing score
+  // files starting at its position
+static long int  Max_Seqs = -1;
+  // If non-negative, stop after scoring this many sequences
+static char  * Index_Path = NULL;
+  // Name of file of binary ints giving the position in the full
+  // set of each input sequence, used to place its binary scores
+static vector <int>  Seq_Index;
+  // The positions read from  Index_Path
+static int  Cascade_Top = 0;
+  // If positive, give full ICM scores only to this many models
+  // per sequence, those whose Markov pre-filters score best
+static vector <Markov_t *>  Prefilter;
+  // Markov pre-filter of each model
+static long int  Cascade_Disagree = 0;
+  // Number of sequences whose best full score was not for the
+  // pre-filter's best model
+static long int  Cascade_Edge = 0;
+  // Number of sequences whose best full score was for the last
+  // model that the pre-filter let through
+
+
+struct  Prefilter_Order
+  {
+   const vector <double> & pre;
+   Prefilter_Order (const vector <double> & p) : pre (p)
+     {}
+   bool  operator ()
+       (int a, int b) const
+     {
+      return  pre [a] > pre [b];
+     }
+  };
+
+
+//**ALD  Gets rid of make undefined reference error
+int  Unused = Filter ('a');
+
+
+
+int  main
+    (int argc, char * argv [])
+
+  {
+   vector <ICM_t *>  model;
+   vector <FILE *>  score_fp;
+   vector <double>  seq_score;
+   FILE  * id_fp = NULL;
+   char  * string = NULL, * tag = NULL;
+   long int  string_size = 0, tag_size = 0;
+   int  num_models, string_num = 0;
+   int  i;
+
+   Parse_Command_Line (argc, argv);
+
+   if  (Index_Path != NULL)
+       {
+        Read_Index (Index_Path);
+        if  (First_Seq < 0)
+            First_Seq = 0;
+       }
+
+   num_models = Model_Path . size ();
+   for  (i = 0;  i < num_models;  i ++)
+     {
+      model . push_back (new ICM_t);
+      model [i] -> Read (Model_Path [i]);
+      fprintf (stderr, "Model %d = %s\n", i, Model_Path [i]);
+      fprintf (stderr, "  len = %d  depth = %d  periodicity = %d\n",
+           model [i] -> Get_Model_Len (),
+           model [i] -> Get_Model_Depth (),
+           model [i] -> Get_Periodicity ());
+
+      if  (Cascade_Top > 0)
+          {
+           Prefilter . push_back (new Markov_t);
+           Prefilter [i] -> Read (Model_File_Path (Model_Path [i], ".mm"));
+          }
+
+      if  (Binary_Output && First_Seq >= 0)
+          {
+           score_fp . push_back (File_Open (Model_File_Path (Model_Path [i], ".scores"), "r+b"));
+           if  (fseek (score_fp [i], First_Seq * sizeof (float), SEEK_SET) != 0)
+               {
+                fprintf (stderr, "ERROR:  Cannot seek to sequence %ld in score file\n",
+                     First_Seq);
+                exit (EXIT_FAILURE);
+               }
+          }
+      else if  (Binary_Output)
+          score_fp . push_back (File_Open (Model_File_Path (Model_Path [i], ".scores"), "wb"));
+     }
+   seq_score . resize (num_models);
+
+   if  (ID_Path != NULL)
+       id_fp = File_Open (ID_Path, "w");
+
+   while  ((Max_Seqs < 0 || string_num < Max_Seqs)
+             && Read_String (stdin, string, string_size, tag, tag_size))
+     {
+      char  * token;
+      int  len;
+
+      string_num ++;
+      len = strlen (string);
+      token = strtok (tag, "\t\n");
+
+      if  (id_fp != NULL)
+          fprintf (id_fp, "%s\n", token);
+
+      Score_Sequence (model, string, len, seq_score);
+
+      if  (Binary_Output)
+          {
+           long int  pos = -1;
+
+           if  (Index_Path != NULL)
+               {
+                if  (First_Seq + string_num > long (Seq_Index . size ()))
+                    {
+                     fprintf (stderr, "ERROR:  More sequences than positions in %s\n",
+                          Index_Path);
+                     exit (EXIT_FAILURE);
+                    }
+                pos = Seq_Index [First_Seq + string_num - 1];
+               }
+
+           for  (i = 0;  i < num_models;  i ++)
+             {
+              float  score;
+
+              score = float (seq_score [i]);
+              if  (pos >= 0)
+                  fseek (score_fp [i], pos * sizeof (float), SEEK_SET);
+              fwrite (& score, sizeof (float), 1, score_fp [i]);
+             }
+           continue;
+          }
+
+      printf ("%-20s", token);
+      for  (i = 0;  i < num_models;  i ++)
+        printf ("\t%11.4f", seq_score [i]);
+      putchar ('\n');
+     }
+
+   if  (Cascade_Top > 0)
+       fprintf (stderr, "Cascade %d %ld %ld\n", string_num, Cascade_Disagree,
+            Cascade_Edge);
+
+   if  (id_fp != NULL)
+       fclose (id_fp);
+   for  (i = 0;  i < num_models;  i ++)
+     {
+      if  (Binary_Output)
+          fclose (score_fp [i]);
+      delete model [i];
+      if  (Cascade_Top > 0)
+          delete Prefilter [i];
+     }
+
+   return  0;
+  }
+
+
+
+static void  Parse_Command_Line
+    (int argc, char * argv [])
+
+//  Get options and parameters from command line with  argc
+//  arguments in  argv [0 .. (argc - 1)] .
+
+  {
+   bool  errflg = false;
+   int  ch, option_index = 0;
+   static struct option  long_options [] = {
+        {"binary", 0, 0, 'B'},
+        {"help", 0, 0, 'h'},
+        {"ids", 1, 0, 'i'},
+        {"cascade", 1, 0, 'm'},
+        {"num", 1, 0, 'n'},
+        {"start", 1, 0, 's'},
+        {"index", 1, 0, 'x'},
+        {0, 0, 0, 0}
+      };
+
+   optarg = NULL;
+
+   while  (! errflg && ((ch = getopt_long (argc, argv,
+        "Bhi:m:n:s:x:", long_options, & option_index)) != EOF))
+     switch  (ch)
+       {
+        case  'B' :
+          Binary_Output = true;
+          break;
+
+        case  'h' :
+          errflg = true;
+          break;
+
+        case  'i' :
+          ID_Path = optarg;
+          break;
+
+        case  'm' :
+          Cascade_Top = int (strtol (optarg, NULL, 10));
+          break;
+
+        case  'n' :
+          Max_Seqs = strtol (optarg, NULL, 10);
+          break;
+
+        case  's' :
+          First_Seq = strtol (optarg, NULL, 10);
+          break;
+
+        case  'x' :
+          Index_Path = optarg;
+          break;
+
+        case  '?' :
+          fprintf (stderr, "Unrecognized option -%c\n", optopt);
+
+        default :
+          errflg = TRUE;
+       }
+
+   if  (Index_Path != NULL && ! Binary_Output)
+       {
+        fprintf (stderr, "ERROR:  -x requires -B\n");
+        errflg = true;
+       }
+
+   if  (errflg || optind > argc - 1)
+       {
+        Usage ();
+        exit (EXIT_FAILURE);
+       }
+
+   while  (optind < argc)
+     Model_Path . push_back (argv [optind ++]);
+
+   return;
+  }
+
+
+
+int  Read_String
+    (FILE * fp, char * & s, long int & s_size, char * & tag,
+     long int & tag_size)
+
+//  Read next string from  fp  (assuming FASTA format) into  s [0 .. ]
+//  which has  s_size  characters.  Allocate extra memory if needed
+//  and adjust  s_size  accordingly.  Return  TRUE  if successful,  FALSE
+//  otherwise (e.g., EOF).  Put FASTA header line into  tag [0 .. ]
+//  (and adjust  tag_size  if needed).
+
+  {
+   int  ch, ct;
+
+   while  ((ch = fgetc (fp)) != EOF && ch != '>')
+     ;
+
+   if  (ch == EOF)
+       return  FALSE;
+
+   ct = 0;
+   while  ((ch = fgetc (fp)) != EOF && ch != '\n' && isspace (ch))
+     ;
+   if  (ch == EOF)
+       return  FALSE;
+   if  (ch != '\n' && ! isspace (ch))
+       ungetc (ch, fp);
+   while  ((ch = fgetc (fp)) != EOF && ch != '\n')
+     {
+      if  (ct >= tag_size - 1)
+          {
+           tag_size += INCR_SIZE;
+           tag = (char *) Safe_realloc (tag, tag_size);
+          }
+      tag [ct ++] = char (ch);
+     }
+   tag [ct ++] = '\0';
+
+   ct = 0;
+   while  ((ch = fgetc (fp)) != EOF && ch != '>')
+     {
+      if  (isspace (ch))
+          continue;
+
+      if  (ct >= s_size - 1)
+          {
+           s_size += INCR_SIZE;
+           s = (char *) Safe_realloc (s, s_size);
+          }
+      s [ct ++] = char (ch);
+     }
+   s [ct ++] = '\0';
+
+   if  (ch == '>')
+       ungetc (ch, fp);
+
+   return  TRUE;
+  }
+
+
+
+static void  Read_Index
+    (const char * path)
+
+//  Read the binary int positions in file  path  into  Seq_Index .
+
+  {
+   FILE  * fp;
+   int  pos;
+
+   fp = File_Open (path, "rb");
+   while  (fread (& pos, sizeof (int), 1, fp) == 1)
+     Seq_Index . push_back (pos);
+   fclose (fp);
+
+   return;
+  }
+
+
+
+static char *  Model_File_Path
+    (const char * model_path, const char * suffix)
+
+//  Return the name of a file belonging to the model in
+//  model_path , which is  model_path  with its extension (if any)
+//  replaced by  suffix .
+
+  {
+   char  * path;
+   const char  * dot, * slash;
+   int  len;
+
+   dot = strrchr (model_path, '.');
+   slash = strrchr (model_path, '/');
+   if  (dot == NULL || (slash != NULL && dot < slash))
+       len = strlen (model_path);
+     else
+       len = dot - model_path;
+
+   path = (char *) Safe_malloc (len + strlen (suffix) + 1);
+   strncpy (path, model_path, len);
+   strcpy (path + len, suffix);
+
+   return  path;
+  }
+
+
+
+static void  Score_Sequence
+    (vector <ICM_t *> & model, char * string, int len,
+     vector <double> & score)
+
+//  Set  score [i]  to the score of  string [0 .. (len - 1)]  under
+//  model [i] .  If  Cascade_Top  is positive, only the models whose
+//  pre-filters score best get full ICM scores.  The others get
+//  their pre-filter scores shifted by the mean difference between
+//  the full and pre-filter scores of the best, but never more than
+//  the lowest full score.
+
+  {
+   int  num_models = model . size ();
+   int  best, i, j;
+
+   if  (Cascade_Top <= 0 || Cascade_Top >= num_models)
+       {
+        for  (i = 0;  i < num_models;  i ++)
+          score [i] = model [i] -> Score_String (string, len, 1);
+        return;
+       }
+
+   vector <double>  pre (num_models);
+   vector <int>  rank (num_models);
+   double  shift = 0.0, bound = 0.0;
+
+   for  (i = 0;  i < num_models;  i ++)
+     {
+      pre [i] = Prefilter [i] -> Score_String (string, len);
+      rank [i] = i;
+     }
+   partial_sort (rank . begin (), rank . begin () + Cascade_Top, rank . end (),
+        Prefilter_Order (pre));
+
+   best = rank [0];
+   for  (j = 0;  j < Cascade_Top;  j ++)
+     {
+      i = rank [j];
+      score [i] = model [i] -> Score_String (string, len, 1);
+      shift += score [i] - pre [i];
+      if  (j == 0 || score [i] < bound)
+          bound = score [i];
+      if  (score [i] > score [best])
+          best = i;
+     }
+   shift /= Cascade_Top;
+
+   for  (j = Cascade_Top;  j < num_models;  j ++)
+     {
+      i = rank [j];
+      score [i] = Min (pre [i] + shift, bound);
+     }
+
+   if  (best != rank [0])
+       Cascade_Disagree ++;
+   if  (Cascade_Top > 1 && best == rank [Cascade_Top - 1])
+       Cascade_Edge ++;
+
+   return;
+  }
+
+
+
+static void  Usage
+    (void)
+
+//  Print to stderr description of options and command line for
+//  this program.
+
+  {
+   fprintf (stderr,
+       "USAGE:  multi-score [options] <model-1> ... <model-k> < input-file\n"
+       "\n"
+       "Read sequences from  stdin  and score each using every ICM\n"
+       "named on the command line.  Output to  stdout  one line per\n"
+       "sequence:  the sequence tag followed by  k  tab-separated\n"
+       "scores in the order the models were given\n"
+       "\n"
+       "Options:\n"
+       " -B\n"
+       " --binary\n"
+       "    Instead of text to  stdout , write the scores of each model\n"
+       "    as binary floats, one per sequence in input order, to a file\n"
+       "    named like the model with its extension replaced by .scores\n"
+       " -h\n"
+       " --help\n"
+       "    Print this message\n"
+       " -i <file>\n"
+       " --ids <file>\n"
+       "    Write the sequence tags, one per line in input order, to <file>\n"
+       " -m <num>\n"
+       " --cascade <num>\n"
+       "    Give full ICM scores only to the <num> models whose Markov\n"
+       "    pre-filters (read from the model file names with extension\n"
+       "    .mm) score best, and shifted pre-filter scores, bounded by\n"
+       "    the lowest full score, to the rest.  Report the number of\n"
+       "    sequences, how many had a best full score for a model other\n"
+       "    than the pre-filter's best, and how many for the last model\n"
+       "    let through, to stderr as  Cascade <n> <disagree> <edge>\n"
+       " -n <num>\n"
+       " --num <num>\n"
+       "    Stop after scoring <num> sequences\n"
+       " -s <num>\n"
+       " --start <num>\n"
+       "    The input begins with sequence <num> (counting from 0) of\n"
+       "    the full set.  With -B, write the scores into the existing\n"
+       "    score files at that sequence's position\n"
+       " -x <file>\n"
+       " --index <file>\n"
+       "    With -B, <file> holds a binary int for each input sequence\n"
+       "    giving its position in the full set, where its scores are\n"
+       "    written in the existing score files.  -s then counts from\n"
+       "    the start of the input\n"
+       "\n");
+
+   return;
+  }
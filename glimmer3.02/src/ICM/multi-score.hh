@@ -0,0 +1,31 @@
+//    Programmer:  David Kelley
+//          File:  multi-score.hh
+//  Last Updated:  Sun Oct 18 2026
+//
+//  Declarations for  multi-score.cc
+
+
+#ifndef _MULTI_SCORE_HH
+#define _MULTI_SCORE_HH
+
+
+#include  "icm.hh"
+
+
+static void  Parse_Command_Line
+    (int argc, char * argv []);
+static void  Read_Index
+    (const char * path);
+static char *  Model_File_Path
+    (const char * model_path, const char * suffix);
+static void  Score_Sequence
+    (vector <ICM_t *> & model, char * string, int len,
+     vector <double> & score);
+static int  Read_String
+    (FILE * fp, char * & s, long int & s_size, char * & tag,
+     long int & tag_size);
+static void  Usage
+    (void);
+
+
+#endif
@@ -33,6 +33,8 @@ def main():
         os.symlink('../glimmer3.02/bin/simple-score','bin/simple-score')
     if not os.path.isfile('bin/build-icm'):
         os.symlink('../glimmer3.02/bin/build-icm', 'bin/build-icm')
+    if not os.path.isfile('bin/multi-score'):
+        os.symlink('../glimmer3.02/bin/multi-score', 'bin/multi-score')
     
     # set scimm bin variable
     p = subprocess.Popen('sed \'s,scimm_bin = ".*",scimm_bin = "%s/bin",\' bin/scimm.py > sc.tmp' % installdir, shell=True)
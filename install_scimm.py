@@ -24,6 +24,8 @@ def main():
         os.symlink('../glimmer3.02/bin/simple-score','bin/simple-score')
     if not os.path.isfile('bin/build-icm'):
         os.symlink('../glimmer3.02/bin/build-icm', 'bin/build-icm')
+    if not os.path.isfile('bin/multi-score'):
+        os.symlink('../glimmer3.02/bin/multi-score', 'bin/multi-score')
 
     # LikelyBin
     os.chdir('likelybin-0.1')
@@ -34,9 +36,6 @@ def main():
         os.symlink('../likelybin-0.1/mcmc.pl','bin/mcmc.pl')
 
     # CBCBCompostBin
-    p = subprocess.Popen('sed \'s,cb_bin = "[a-zA-Z/]*",cb_bin = "%s/CBCBCompostBin",\' CBCBCompostBin/compostbin.py > cb.tmp' % installdir, shell=True)
-    os.waitpid(p.pid,0)
-    os.rename('cb.tmp', 'CBCBCompostBin/compostbin.py')
     p = subprocess.Popen('chmod ug+x CBCBCompostBin/compostbin.py', shell=True)
     os.waitpid(p.pid,0)
     if not os.path.isfile('bin/compostbin.py'):